@@ -0,0 +1,209 @@
+import sys
+import argparse
+
+import numpy as np
+
+import config
+
+# Storage of the accumulated mean color of a pixel, selected by config.ACCUMULATION_FORMAT.
+# Bytes per pixel of prevFrameData (without reprojection) and of one of the two HistoryPixel buffers of temporal.glsl,
+# history adds the number of samples and the distance to the first hit, std430 pads it to the alignment of the color
+FORMATS = {
+    # vec4, alpha is unused
+    'rgba32f': {'frame_buffer': 16, 'history': 32},
+    # three floats
+    'rgb32f': {'frame_buffer': 12, 'history': 20},
+    # three halves packed in uvec2
+    'rgb16f': {'frame_buffer': 8, 'history': 16},
+    # 9 bit mantissas with a shared 5 bit exponent packed in uint, GL_RGB9_E5
+    'rgb9e5': {'frame_buffer': 4, 'history': 12},
+}
+
+HALF_MAX = 65504.0
+HALF_MANTISSA_BITS = 10
+HALF_MIN_EXPONENT = -14
+
+SHARED_EXPONENT_MANTISSA_BITS = 9
+SHARED_EXPONENT_BIAS = 15
+SHARED_EXPONENT_MAX = 31
+SHARED_EXPONENT_MAX_VALUE = (2 ** 9 - 1) / 2 ** 9 * 2.0 ** (SHARED_EXPONENT_MAX - SHARED_EXPONENT_BIAS)
+
+
+def check_format(name):
+    if name not in FORMATS:
+        raise ValueError(f"Unknown accumulation format {name}, expected one of {tuple(FORMATS)}")
+
+
+def round_scaled(values, dither):
+    """
+    :param dither: uniform random numbers in [0, 1) of the shape of values for stochastic rounding, None rounds
+                   to the nearest integer
+    """
+    return np.floor(values + (0.5 if dither is None else dither))
+
+
+def quantize_half(color, dither=None):
+    """
+    Nearest or stochastically rounded value representable by a half float, encodeColor of accumulation.glsl
+    :param color: float32 array of non-negative colors
+    """
+    color = np.minimum(color.astype(np.float32), HALF_MAX)
+    exponent = np.maximum(np.floor(np.log2(np.maximum(color, 2.0 ** HALF_MIN_EXPONENT))), HALF_MIN_EXPONENT)
+    ulp = np.exp2(exponent - HALF_MANTISSA_BITS).astype(np.float32)
+    quantized = round_scaled(color / ulp, dither) * ulp
+    return np.minimum(quantized, HALF_MAX).astype(np.float16).astype(np.float32)
+
+
+def quantize_shared_exponent(color, dither=None):
+    """
+    Nearest or stochastically rounded value representable by GL_RGB9_E5, encodeColor of accumulation.glsl
+    :param color: float32 array of non-negative colors of shape (..., 3)
+    """
+    color = np.clip(color.astype(np.float32), 0, SHARED_EXPONENT_MAX_VALUE)
+    largest = color.max(axis=-1, keepdims=True)
+    exponent = np.maximum(np.floor(np.log2(np.maximum(largest, 2.0 ** -SHARED_EXPONENT_BIAS))),
+                          -SHARED_EXPONENT_BIAS - 1) + 1
+    # Rounding the largest channel up to the next power of two takes the next exponent
+    exponent += round_scaled(largest / np.exp2(exponent - SHARED_EXPONENT_MANTISSA_BITS), None) \
+        >= 2 ** SHARED_EXPONENT_MANTISSA_BITS
+    ulp = np.exp2(exponent - SHARED_EXPONENT_MANTISSA_BITS).astype(np.float32)
+    mantissa = np.minimum(round_scaled(color / ulp, dither), 2 ** SHARED_EXPONENT_MANTISSA_BITS - 1)
+    return (mantissa * ulp).astype(np.float32)
+
+
+def quantize(name, color, dither=None):
+    """
+    :return: color as read back after it's stored in the format
+    """
+    check_format(name)
+    if name == 'rgb16f':
+        return quantize_half(color, dither)
+    if name == 'rgb9e5':
+        return quantize_shared_exponent(color, dither)
+    return color.astype(np.float32)
+
+
+def accumulate(name, mean, count, new_color, new_samples, dither=None):
+    """
+    Running mean weighted by the exact number of samples of every pixel, accumulate of temporal.glsl, in float32
+    :return: (stored mean, count)
+    """
+    count = count + new_samples
+    weight = np.float32(new_samples) / count.astype(np.float32)
+    mixed = mean + (new_color - mean) * weight[..., None]
+    return quantize(name, mixed.astype(np.float32), dither), count
+
+
+def blend(mean, new_color, mixed_frames, samples_per_frame=1):
+    """
+    Running mean mixed with LogicProviderImpl.blending_alpha, which is rounded to float32 in FrameState
+    """
+    alpha = np.float32(mixed_frames / (mixed_frames + samples_per_frame))
+    return (new_color * (np.float32(1) - alpha) + mean * alpha).astype(np.float32)
+
+
+# Methods of the error model: (format, how the mean is kept)
+METHODS = (
+    ('rgba32f', 'blend'),
+    ('rgba32f', 'sum'),
+    ('rgb32f', 'nearest'),
+    ('rgb16f', 'sum'),
+    ('rgb16f', 'nearest'),
+    ('rgb16f', 'stochastic'),
+    ('rgb9e5', 'nearest'),
+    ('rgb9e5', 'stochastic'),
+)
+
+
+def error_model(frames, pixels, seed=0, checkpoints=None):
+    """
+    Accumulates the same random radiance samples with every method and compares the means with the float64 mean of
+    the samples. Samples are exponentially distributed around per pixel means, like noisy path traced radiance.
+    Brightness of pixels is spread over five orders of magnitude, their channels are within a factor of 10
+    :return: {(format, method): [(frames, relative RMS error, relative bias), ...]}, ('float64', 'noise') is the error
+             of the exact mean against the expected one, Monte Carlo noise the formats are compared with
+    """
+    random = np.random.default_rng(seed)
+    checkpoints = sorted(set(checkpoints or [frames]))
+    brightness = np.exp(random.uniform(np.log(1E-3), np.log(1E2), size=(pixels, 1)))
+    expected = brightness * random.uniform(0.1, 1, size=(pixels, 3))
+
+    exact = np.zeros((pixels, 3), dtype=np.float64)
+    means = {method: np.zeros((pixels, 3), dtype=np.float32) for method in METHODS}
+    count = np.zeros(pixels, dtype=np.float32)
+    result = {method: [] for method in METHODS + (('float64', 'noise'),)}
+
+    for frame in range(1, frames + 1):
+        sample = random.exponential(expected).astype(np.float32)
+        dither = random.random((pixels, 3), dtype=np.float32)
+        exact += (sample - exact) / frame
+
+        for method in METHODS:
+            name, kind = method
+            if kind == 'blend':
+                means[method] = blend(means[method], sample, frame - 1)
+            elif kind == 'sum':
+                means[method] = quantize(name, means[method] + sample)
+            else:
+                means[method], _ = accumulate(name, means[method], count, sample, 1,
+                                              dither if kind == 'stochastic' else None)
+        count += 1
+
+        if frame in checkpoints:
+            relative = (exact - expected) / expected
+            result['float64', 'noise'].append((frame, float(np.sqrt(np.mean(relative ** 2))), float(np.mean(relative))))
+            for method in METHODS:
+                mean = means[method] / frame if method[1] == 'sum' else means[method]
+                relative = (mean - exact) / exact
+                result[method].append((frame, float(np.sqrt(np.mean(relative ** 2))), float(np.mean(relative))))
+    return result
+
+
+def memory_table(resolutions, passes=1):
+    """
+    :param passes: render passes per frame
+    :return: rows of (format, resolution, MB of prevFrameData, MB of both history buffers,
+             {'frame_buffer', 'history'}: GB/s read and written at config.FPS)
+    """
+    rows = []
+    for name, sizes in FORMATS.items():
+        for width, height in resolutions:
+            pixels = width * height
+            frame_buffer = pixels * sizes['frame_buffer']
+            history = 2 * pixels * sizes['history']
+            # Every pass reads and writes prevFrameData, or reads one history buffer and writes the other one.
+            # Reprojection reads up to 4 history pixels while the camera moves, mostly from cache
+            bandwidth = {
+                'frame_buffer': 2 * frame_buffer * config.FPS * passes / 1E9,
+                'history': history * config.FPS * passes / 1E9,
+            }
+            rows.append((name, (width, height), frame_buffer / 2 ** 20, history / 2 ** 20, bandwidth))
+    return rows
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Error of accumulating samples in every accumulation format and their memory and bandwidth")
+    parser.add_argument('--frames', type=int, default=16384)
+    parser.add_argument('--pixels', type=int, default=4096)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    # python3 accumulation.py --frames 16384
+    args = parse_args(sys.argv[1:])
+
+    print(f"Relative RMS error / bias of the accumulated mean against float64, {args.pixels} pixels")
+    checkpoints = [frames for frames in (16, 256, 1024, 4096, 16384, 65536) if frames < args.frames] + [args.frames]
+    for (name, kind), errors in error_model(args.frames, args.pixels, args.seed, checkpoints).items():
+        cells = '  '.join(f"{frames:>6}: {rms:.1e} / {bias:+.1e}" for frames, rms, bias in errors)
+        print(f"{name:>8} {kind:<10} {cells}")
+
+    print()
+    print(f"Memory and bandwidth of one pass per frame at {config.FPS} frames/s")
+    print(f"{'format':>8} {'resolution':>10} {'prevFrameData':>22} {'history (2 buffers)':>24}")
+    for name, (width, height), frame_buffer, history, bandwidth in memory_table(
+            ((1280, 720), (1920, 1080), (2560, 1440), (3840, 2160))):
+        print(f"{name:>8} {f'{width}x{height}':>10} {frame_buffer:>8.1f} MB {bandwidth['frame_buffer']:>6.2f} GB/s "
+              f"{history:>10.1f} MB {bandwidth['history']:>6.2f} GB/s")
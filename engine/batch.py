@@ -0,0 +1,149 @@
+import os
+import sys
+import math
+import time
+import argparse
+import importlib
+import functools
+
+import headless
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Renders scene without a window and saves accumulated image")
+    parser.add_argument('scene', help="scene loader class, e.g. demo.ExampleSceneLoader, or binary scene file")
+    parser.add_argument('output', help="image file, format is taken from the extension (png, jpg, bmp, tga), "
+                                       "with --frames a pattern with a field for the frame number, e.g. turn/{:03d}.jpg")
+    parser.add_argument('--resolution', type=int, nargs=2, default=(1280, 720), metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--samples', type=int, default=256, help="samples per pixel")
+    parser.add_argument('--position', type=float, nargs=3, default=(0, 0, -1), metavar=('X', 'Y', 'Z'))
+    parser.add_argument('--yaw', type=float, default=0, help="degrees around the vertical axis")
+    parser.add_argument('--pitch', type=float, default=0, help="degrees around the camera's right axis")
+    parser.add_argument('--frames', type=int, default=1,
+                        help="renders an image sequence, the camera turns by --yaw-step between frames")
+    parser.add_argument('--yaw-step', type=float, default=0, help="degrees the camera turns between frames")
+    parser.add_argument('--backend', choices=('fragment', 'compute'), default=None, help="overrides config.BACKEND")
+    parser.add_argument('--accumulation-format', choices=('rgba32f', 'rgb32f', 'rgb16f', 'rgb9e5'), default=None,
+                        help="overrides config.ACCUMULATION_FORMAT")
+    parser.add_argument('--denoise', action='store_true', help="filter the image with denoise.comp, overrides config.DENOISE")
+    parser.add_argument('--platform', choices=headless.PLATFORMS, default='egl')
+    parser.add_argument('--software', action='store_true', help="use Mesa's llvmpipe, no GPU needed")
+    return parser.parse_args(argv)
+
+
+def scene_loader_factory(scene):
+    import scene_file
+
+    if os.path.isfile(scene):
+        return functools.partial(scene_file.BinarySceneLoader, path=scene)
+    module, name = scene.rsplit('.', 1)
+    return getattr(importlib.import_module(module), name)
+
+
+def camera_rotation(yaw, pitch):
+    """
+    Same rotation MovementEventHandler gets after turning by yaw and then by pitch degrees
+    """
+    from pyglm import glm
+
+    rotation = glm.angleAxis(glm.radians(yaw), glm.vec3(0, 1, 0))
+    right = glm.normalize(rotation * glm.vec3(1, 0, 0))
+    rotation = glm.angleAxis(glm.radians(pitch), right) * rotation
+    return glm.mat3_cast(rotation)
+
+
+def read_pixels(resolution):
+    """
+    :return: uint8 RGB image of the default framebuffer, first row is the top one
+    """
+    import numpy as np
+    from OpenGL.GL import glPixelStorei, glReadPixels, GL_PACK_ALIGNMENT, GL_RGB, GL_UNSIGNED_BYTE
+
+    width, height = resolution
+    glPixelStorei(GL_PACK_ALIGNMENT, 1)
+    pixels = glReadPixels(0, 0, width, height, GL_RGB, GL_UNSIGNED_BYTE)
+    return np.frombuffer(pixels, dtype=np.uint8).reshape(height, width, 3)[::-1]
+
+
+def render(args):
+    # Imported here, OpenGL must not be imported before headless.select_platform
+    import pygame
+    from pyglm import glm
+    from OpenGL.GL import glFinish
+
+    import config
+    import shader
+    from graphics import FrameState
+
+    config.RESOLUTION = tuple(args.resolution)
+    if args.backend is not None:
+        config.BACKEND = args.backend
+    if args.accumulation_format is not None:
+        config.ACCUMULATION_FORMAT = args.accumulation_format
+    if args.denoise:
+        config.DENOISE = True
+
+    with headless.HeadlessContext.create(args.platform, config.RESOLUTION):
+        frame_state = FrameState()
+        frame_state.position = glm.vec3(*args.position)
+        frame_state.rotation_matrix = camera_rotation(args.yaw, args.pitch)
+        _, renderer, logic_provider = shader.create_renderer(frame_state, scene_loader_factory(args.scene))
+
+        frames = max(math.ceil(args.samples / logic_provider.samples_per_frame), 1)
+
+        # First frame uploads the scene and links the program, it's not part of the throughput
+        renderer.render()
+        glFinish()
+
+        if args.frames > 1:
+            render_sequence(args, frame_state, renderer, logic_provider, frames)
+            return
+
+        start = time.perf_counter()
+        for _ in range(frames - 1):
+            renderer.render()
+        glFinish()
+        elapsed = time.perf_counter() - start
+
+        image = read_pixels(config.RESOLUTION)
+
+    pygame.image.save(pygame.image.frombuffer(image.tobytes(), config.RESOLUTION, 'RGB'), args.output)
+
+    samples = frames * logic_provider.samples_per_frame
+    timed_samples = (frames - 1) * logic_provider.samples_per_frame
+    print(f"{samples} samples per pixel at {config.RESOLUTION[0]}x{config.RESOLUTION[1]} saved to {args.output}")
+    if elapsed > 0:
+        pixels = config.RESOLUTION[0] * config.RESOLUTION[1]
+        print(f"{timed_samples / elapsed:.2f} samples/s per pixel, "
+              f"{timed_samples * pixels / elapsed / 1E6:.2f} M samples/s")
+
+
+def render_sequence(args, frame_state, renderer, logic_provider, passes):
+    """
+    Turntable, every frame accumulates passes from scratch and is read back while the next one renders
+    """
+    import config
+    from capture import FrameWriter, PixelBufferCapture
+
+    capture = PixelBufferCapture(config.RESOLUTION, FrameWriter(args.output))
+    start = time.perf_counter()
+    for number in range(args.frames):
+        frame_state.rotation_matrix = camera_rotation(args.yaw + number * args.yaw_step, args.pitch)
+        logic_provider.drop_mixed_frames()
+        for _ in range(passes):
+            renderer.render()
+        capture.capture(number)
+    capture.close()
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.frames} frames of {passes * logic_provider.samples_per_frame} samples per pixel "
+          f"at {config.RESOLUTION[0]}x{config.RESOLUTION[1]} saved to {args.output}")
+    print(f"{args.frames / elapsed:.2f} frames/s, {capture.stalls} waits for readback")
+
+
+if __name__ == "__main__":
+    # python3 batch.py demo.ExampleSceneLoader demo.png --samples 256 --software
+    # python3 batch.py demo.ExampleSceneLoader turn/{:03d}.jpg --samples 16 --frames 36 --yaw-step 10 --software
+    arguments = parse_args(sys.argv[1:])
+    headless.select_platform(arguments.platform, arguments.software)
+    render(arguments)
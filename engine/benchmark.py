@@ -0,0 +1,607 @@
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+import headless
+
+
+def best_time(function, repeat):
+    """
+    :return: shortest of repeat runs of function in seconds
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bulk(args):
+    """
+    Triangles passed to SceneLoader one object at a time from spawn_triangles and as one array to add_triangles
+    """
+    from scene import SceneLoader, Triangle, Vector, Material, Color
+
+    class BenchmarkSceneLoader(SceneLoader):
+        def define_materials_list(self):
+            self.material = Material(Color(1, 1, 1), 0.5, self)
+
+    vertices = np.random.default_rng(0).random((args.count, 3, 3), dtype=np.float32)
+    scene_loader = BenchmarkSceneLoader(None)
+
+    def objects():
+        triangles = [Triangle(Vector(*a), Vector(*b), Vector(*c), scene_loader.material) for a, b, c in vertices.tolist()]
+        Triangle.pack(triangles)
+
+    def columns():
+        BenchmarkSceneLoader(None).add_triangles(vertices, scene_loader.material)
+
+    seconds = best_time(objects, args.repeat)
+    print(f"{args.count} triangles as objects: {seconds:.3f} s, {args.count / seconds / 1E3:.0f} k triangles/s")
+    seconds = best_time(columns, args.repeat)
+    print(f"{args.count} triangles through add_triangles: {seconds:.4f} s, "
+          f"{args.count / seconds / 1E6:.0f} M triangles/s")
+
+    # Subclass without __slots__ gets the per-instance __dict__ back
+    class DictVector(Vector):
+        pass
+
+    for vector in (Vector, DictVector):
+        tracemalloc.start()
+        vectors = [vector(1.0, 2.0, 3.0) for _ in range(args.count)]
+        allocated, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del vectors
+        print(f"{vector.__name__}: {allocated / args.count:.0f} bytes per object")
+
+
+def legacy_pack(triangles):
+    """
+    Buffer of triangles the way SceneLoader built it before structured dtypes: flat lists of fields with None for
+    padding, every value reinterpreted as int32 through struct and copied into a glm array
+    """
+    from struct import pack, unpack
+    from pyglm import glm
+
+    def to_int(data):
+        if data is None:
+            return 0
+        if isinstance(data, int):
+            return data
+        return unpack('i', pack('f', data))[0]
+
+    values = []
+    for triangle in triangles:
+        values += [triangle.a.x, triangle.a.y, triangle.a.z, None,
+                   triangle.b.x, triangle.b.y, triangle.b.z, None,
+                   triangle.c.x, triangle.c.y, triangle.c.z, triangle.material_index]
+    return glm.array(glm.int32, *[to_int(value) for value in values])
+
+
+def packing(args):
+    """
+    Triangle objects packed through the Converter and glm path std430 dtypes replaced, against Triangle.pack
+    """
+    from scene import SceneLoader, Triangle, Vector, Material, Color
+
+    class BenchmarkSceneLoader(SceneLoader):
+        def define_materials_list(self):
+            self.material = Material(Color(1, 1, 1), 0.5, self)
+
+    vertices = np.random.default_rng(0).random((args.count, 3, 3), dtype=np.float32)
+    scene_loader = BenchmarkSceneLoader(None)
+    triangles = [Triangle(Vector(*a), Vector(*b), Vector(*c), scene_loader.material) for a, b, c in vertices.tolist()]
+
+    if legacy_pack(triangles).to_bytes() != Triangle.pack(triangles).tobytes():
+        raise RuntimeError("packed buffers differ")
+    legacy = best_time(lambda: legacy_pack(triangles), args.repeat)
+    packed = best_time(lambda: Triangle.pack(triangles), args.repeat)
+    for name, seconds in (('Converter + glm.array (before)', legacy), ('Triangle.pack', packed)):
+        print(f"{args.count} triangles, {name}: {seconds:.3f} s, {args.count / seconds / 1E3:.0f} k triangles/s")
+    print(f"{legacy / packed:.1f}x faster, same {args.count * Triangle.DTYPE.itemsize / 1E6:.1f} MB")
+
+
+# render.frag before the FrameState block, with its uniforms and the block side by side
+UNIFORMS_SHADER = """#version 460
+uniform vec2 resolution;
+uniform mat3 rotationMatrix;
+uniform vec3 position;
+uniform float rand1;
+uniform float rand2;
+uniform float blending_alpha;
+layout(std140, binding = 0) uniform FrameState {
+    mat3 rotationMatrix;
+    vec3 position;
+    int frameIndex;
+    vec2 resolution;
+    float blendingAlpha;
+    mat3 prevRotationMatrix;
+    vec3 prevPosition;
+    float historyLimit;
+} state;
+out vec4 color;
+
+void main() {
+    color = vec4(rotationMatrix * position + state.rotationMatrix * state.position,
+                 resolution.x + rand1 + rand2 + blending_alpha + state.blendingAlpha);
+}
+"""
+
+
+def uniforms(args):
+    """
+    Per frame state set uniform by uniform, looking every location up, against one FrameState upload.
+    Camera uniforms used to be set per input event, here they are set every frame like while the camera moves
+    """
+    from pyglm import glm
+    from OpenGL.GL import (glUseProgram, glFinish, glGetUniformLocation, glUniform1f, glUniform2f, glUniform3f,
+                           glUniformMatrix3fv, GL_FALSE, GL_VERTEX_SHADER, GL_FRAGMENT_SHADER)
+    from OpenGL.GL.shaders import compileShader, compileProgram
+
+    from graphics import FrameState
+
+    with headless.HeadlessContext.create(args.platform, (64, 64)):
+        program = compileProgram(compileShader("#version 460\nvoid main() { gl_Position = vec4(0); }", GL_VERTEX_SHADER),
+                                 compileShader(UNIFORMS_SHADER, GL_FRAGMENT_SHADER))
+        glUseProgram(program)
+        rotation, position = glm.mat3(1.0), glm.vec3(0, 0, -1)
+        frame_state = FrameState()
+
+        def separate():
+            for _ in range(args.count):
+                glUniform2f(glGetUniformLocation(program, "resolution"), 1920, 1080)
+                glUniform1f(glGetUniformLocation(program, "rand1"), random.random())
+                glUniform1f(glGetUniformLocation(program, "rand2"), random.random())
+                glUniform1f(glGetUniformLocation(program, "blending_alpha"), 0.5)
+                glUniformMatrix3fv(glGetUniformLocation(program, "rotationMatrix"), 1, GL_FALSE, glm.value_ptr(rotation))
+                glUniform3f(glGetUniformLocation(program, "position"), *position)
+            glFinish()
+
+        def block():
+            for index in range(args.count):
+                frame_state.rotation_matrix = rotation
+                frame_state.position = position
+                frame_state['frame_index'] = index
+                frame_state['resolution'] = (1920, 1080)
+                frame_state['blending_alpha'] = 0.5
+                frame_state.upload()
+            glFinish()
+
+        for name, function in (('separate uniforms', separate), ('FrameState block', block)):
+            seconds = best_time(function, args.repeat)
+            print(f"{name}: {seconds / args.count * 1E6:.1f} us per frame")
+
+
+def skybox(args):
+    """
+    Skybox faces decoded one after another and uploaded without mipmaps against SceneLoader.decode_skybox_side
+    in a thread pool with empty and filled cache, with and without mipmaps
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from simplejpeg import decode_jpeg
+    from OpenGL.GL import (glGenTextures, glDeleteTextures, glBindTexture, glTexImage2D, glGenerateMipmap, glFinish,
+                           GL_TEXTURE_CUBE_MAP, GL_TEXTURE_CUBE_MAP_POSITIVE_X, GL_RGB, GL_UNSIGNED_BYTE)
+
+    import config
+    from scene import SceneLoader
+
+    paths = SceneLoader.spawn_skybox_textures(None)
+    config.CACHE_PATH = tempfile.mkdtemp()
+
+    def serial():
+        faces = []
+        for path in paths:
+            with open(path, 'rb') as file:
+                faces.append(decode_jpeg(file.read()))
+        return faces
+
+    def pooled():
+        with ThreadPoolExecutor(max_workers=len(paths)) as executor:
+            return list(executor.map(SceneLoader.decode_skybox_side, paths))
+
+    def cold():
+        shutil.rmtree(config.CACHE_PATH, ignore_errors=True)
+        return pooled()
+
+    def upload(faces, mipmaps):
+        texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_CUBE_MAP, texture)
+        for index, face in enumerate(faces):
+            height, width, _ = face.shape
+            glTexImage2D(GL_TEXTURE_CUBE_MAP_POSITIVE_X + index, 0, GL_RGB, width, height, 0, GL_RGB,
+                         GL_UNSIGNED_BYTE, np.ascontiguousarray(face))
+        if mipmaps:
+            glGenerateMipmap(GL_TEXTURE_CUBE_MAP)
+        glFinish()
+        glDeleteTextures([texture])
+
+    try:
+        with headless.HeadlessContext.create(args.platform, (64, 64)):
+            rows = (
+                ('serial decode (before)', serial),
+                ('pooled decode, empty cache', cold),
+                ('pooled decode, cached', pooled),
+                ('serial decode + upload (before)', lambda: upload(serial(), False)),
+                ('cached + upload', lambda: upload(pooled(), False)),
+                ('cached + upload + mipmaps', lambda: upload(pooled(), True)),
+            )
+            for name, function in rows:
+                print(f"{name}: {best_time(function, args.repeat) * 1E3:.1f} ms")
+    finally:
+        shutil.rmtree(config.CACHE_PATH, ignore_errors=True)
+
+
+def startup(args):
+    """
+    Time from creating the renderer of the demo scene to its first finished frame, with the shader binary cache
+    emptied before every start ('cold') and filled by the previous one ('warm'). Skybox cache is filled by a start
+    before the measured ones. Mesa keeps its own shader cache, MESA_SHADER_CACHE_DISABLE=true turns it off
+    """
+    import os
+    from OpenGL.GL import glFinish
+
+    import config
+    import shader
+    from graphics import FrameState
+    from demo import ExampleSceneLoader
+
+    config.RESOLUTION = (160, 90)
+    config.CACHE_PATH = tempfile.mkdtemp()
+
+    def start():
+        _, renderer, _ = shader.create_renderer(FrameState(), ExampleSceneLoader)
+        renderer.render()
+        glFinish()
+
+    def cold():
+        shutil.rmtree(os.path.join(config.CACHE_PATH, 'shaders'), ignore_errors=True)
+        start()
+
+    try:
+        with headless.HeadlessContext.create(args.platform, config.RESOLUTION):
+            start()
+            for name, function in (('cold', cold), ('warm', start)):
+                print(f"{config.BACKEND} backend, {name} shader cache: "
+                      f"{best_time(function, args.repeat) * 1E3:.0f} ms to the first frame")
+    finally:
+        shutil.rmtree(config.CACHE_PATH, ignore_errors=True)
+
+
+
+def load(args):
+    """
+    Start of a generated scene of count triangles from its SceneLoader, which packs buffers and builds the BVH,
+    against BinarySceneLoader mapping the same scene baked by scene_file.save. Both are timed to the buffers
+    in memory and to the first finished frame, the file is in the page cache after baking
+    """
+    import os
+    import functools
+    from OpenGL.GL import glFinish
+
+    import config
+    import shader
+    import scene_file
+    from graphics import FrameState
+    from scene import SceneLoader, Material, Color
+
+    rng = np.random.default_rng(0)
+    vertices = rng.uniform(-20.0, 20.0, (args.count, 1, 3)) + rng.normal(0.0, 0.3, (args.count, 3, 3)) + (0, 0, 40)
+
+    class GeneratedSceneLoader(SceneLoader):
+        def __init__(self, shader_program):
+            super().__init__(shader_program)
+            self.add_triangles(vertices, self.material)
+
+        def define_materials_list(self):
+            self.material = Material(Color(0.8, 0.8, 0.8), 0.5, self)
+
+    config.RESOLUTION = (160, 90)
+    config.CACHE_PATH = tempfile.mkdtemp()
+    path = os.path.join(config.CACHE_PATH, 'generated.scene')
+
+    def buffers(scene_loader):
+        # Copies read the mapped pages the way the upload does
+        return lambda: [np.array(buffer) for buffer in scene_loader(None).pack_buffers().values()]
+
+    def first_frame(scene_loader):
+        def start():
+            _, renderer, _ = shader.create_renderer(FrameState(), scene_loader)
+            renderer.render()
+            glFinish()
+        return start
+
+    try:
+        scene_file.save(GeneratedSceneLoader(None), path)
+        binary = functools.partial(scene_file.BinarySceneLoader, path=path)
+        print(f"{args.count} triangles, {os.path.getsize(path) / 1E6:.1f} MB scene file")
+        with headless.HeadlessContext.create(args.platform, config.RESOLUTION):
+            # Fills skybox and shader caches
+            first_frame(binary)()
+            for name, scene_loader in (('SceneLoader.pack_buffers', GeneratedSceneLoader),
+                                       ('BinarySceneLoader', binary)):
+                print(f"{name}: {best_time(buffers(scene_loader), args.repeat) * 1E3:.0f} ms to buffers, "
+                      f"{best_time(first_frame(scene_loader), args.repeat) * 1E3:.0f} ms to the first frame")
+    finally:
+        shutil.rmtree(config.CACHE_PATH, ignore_errors=True)
+
+
+def write_obj(path, count):
+    """
+    Writes a wavy grid of quads with texture coordinates, about count triangles, half of them under each of two
+    materials
+    :return: number of triangles
+    """
+    side = int(np.ceil(np.sqrt(count / 2))) + 1
+    x, z = np.meshgrid(np.arange(side, dtype=np.float32), np.arange(side, dtype=np.float32))
+    points = np.stack((x.ravel(), np.sin(x.ravel() * 0.1) * np.cos(z.ravel() * 0.1), z.ravel()), axis=-1)
+
+    corner = (np.arange(side - 1)[None, :] + np.arange(side - 1)[:, None] * side).ravel() + 1
+    quads = np.stack((corner, corner + 1, corner + side + 1, corner + side), axis=-1)
+    with open(path, 'w') as file:
+        np.savetxt(file, points, fmt='v %.6f %.6f %.6f')
+        np.savetxt(file, points[:, ::2] / side, fmt='vt %.6f %.6f')
+        for material, half in zip(('stone', 'metal'), np.array_split(quads, 2)):
+            file.write(f'usemtl {material}\n')
+            np.savetxt(file, np.repeat(half, 2, axis=1), fmt='f %d/%d %d/%d %d/%d %d/%d')
+    return 2 * len(quads)
+
+
+def obj(args):
+    """
+    Parsing of a generated OBJ file of count triangles: throughput and peak of memory allocated on the way,
+    then load_mesh with an empty cache, which parses, hashes and writes the entry, and with a filled one
+    """
+    import os
+
+    import config
+    from mesh import ObjParser, load_mesh
+
+    config.CACHE_PATH = tempfile.mkdtemp()
+    path = os.path.join(config.CACHE_PATH, 'generated.obj')
+
+    def cold():
+        shutil.rmtree(os.path.join(config.CACHE_PATH, 'meshes'), ignore_errors=True)
+        return load_mesh(path)
+
+    def cached():
+        # Cached arrays are memory-mapped, copies read them
+        mesh = load_mesh(path)
+        return np.array(mesh.vertices), np.array(mesh.material_ids)
+
+    try:
+        triangles = write_obj(path, args.count)
+        print(f"{triangles} triangles, {os.path.getsize(path) / 1E6:.1f} MB OBJ file")
+
+        seconds = best_time(lambda: ObjParser(path).parse(), args.repeat)
+        print(f"parse: {seconds:.3f} s, {triangles / seconds / 1E6:.2f} M triangles/s, "
+              f"{os.path.getsize(path) / seconds / 1E6:.0f} MB/s")
+
+        tracemalloc.start()
+        mesh = ObjParser(path).parse()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"parse: {peak / 1E6:.1f} MB peak allocated for {mesh.vertices.nbytes / 1E6:.1f} MB of vertices")
+        del mesh
+
+        for name, function in (('empty cache', cold), ('cached', cached)):
+            print(f"load_mesh, {name}: {best_time(function, args.repeat) * 1E3:.0f} ms")
+    finally:
+        shutil.rmtree(config.CACHE_PATH, ignore_errors=True)
+
+
+def update(args):
+    """
+    Frames after SceneLoader.update moved 1, 100 or 10000 random spheres of a scene of count spheres:
+    time of the update calls, of the upload of their dirty ranges and of the frame, against a frame without changes.
+    Changing every sphere uploads the whole buffer like every change did before dirty ranges
+    """
+    from OpenGL.GL import glFinish
+
+    import config
+    import shader
+    from buffers import Buffers
+    from graphics import FrameState
+    from scene import SceneLoader, Material, Color
+
+    rng = np.random.default_rng(0)
+    centers = rng.uniform(-20.0, 20.0, (args.count, 3)) + (0, 0, 40)
+
+    class SpheresSceneLoader(SceneLoader):
+        def __init__(self, shader_program):
+            super().__init__(shader_program)
+            self.add_spheres(centers, np.full(args.count, 0.2), self.material)
+
+        def define_materials_list(self):
+            self.material = Material(Color(0.8, 0.8, 0.8), 0.5, self)
+
+    config.RESOLUTION = (64, 36)
+    config.CACHE_PATH = tempfile.mkdtemp()
+
+    try:
+        with headless.HeadlessContext.create(args.platform, config.RESOLUTION):
+            _, renderer, logic_provider = shader.create_renderer(FrameState(), SpheresSceneLoader)
+            scene_loader = logic_provider.scene_loader
+
+            def frame():
+                renderer.render()
+                glFinish()
+
+            frame()
+            print(f"{args.count} spheres at {config.RESOLUTION[0]}x{config.RESOLUTION[1]}, no changes: "
+                  f"{best_time(frame, args.repeat) * 1E3:.1f} ms per frame")
+
+            for changed in sorted({min(count, args.count) for count in (1, 100, 10_000, args.count)}):
+                indices = rng.choice(args.count, changed, replace=False)
+                # Update calls, upload of their dirty ranges and the frame after it
+                times = []
+                for _ in range(args.repeat):
+                    moved = centers[indices] + rng.uniform(-0.1, 0.1, 3)
+                    start = time.perf_counter()
+                    for index, center in zip(indices.tolist(), moved):
+                        scene_loader.update(Buffers.SPHERES, index, center=center)
+                    updated = time.perf_counter()
+                    scene_loader.render()
+                    glFinish()
+                    uploaded = time.perf_counter()
+                    frame()
+                    times.append((updated - start, uploaded - updated, time.perf_counter() - uploaded))
+                updates, uploads, frames = np.min(times, axis=0) * 1E3
+                print(f"{changed} changed: {updates:.2f} ms of update calls, {uploads:.2f} ms to upload, "
+                      f"{frames:.1f} ms to render")
+    finally:
+        shutil.rmtree(config.CACHE_PATH, ignore_errors=True)
+
+
+def converge(renderer, logic_provider, samples):
+    """
+    Renders samples per pixel from scratch
+    :return: (seconds, float RGB image)
+    """
+    from OpenGL.GL import glFinish
+
+    import config
+    from batch import read_pixels
+
+    logic_provider.drop_mixed_frames()
+    start = time.perf_counter()
+    for _ in range(max(samples // logic_provider.samples_per_frame, 1)):
+        renderer.render()
+    glFinish()
+    seconds = time.perf_counter() - start
+    return seconds, read_pixels(config.RESOLUTION).astype(np.float64) / 255
+
+
+def paths(args):
+    """
+    Demo scene traced with one path shared by all colors until a dispersive material splits it, against a path
+    per color. Throughput of both and mean difference of their images next to the difference of two shared
+    renders of independent samples, which is only noise
+    """
+    from OpenGL.GL import glFinish
+
+    import config
+    import shader
+    from graphics import FrameState
+    from demo import ExampleSceneLoader
+
+    config.RESOLUTION = (160, 90)
+    config.CACHE_PATH = tempfile.mkdtemp()
+    pixels = config.RESOLUTION[0] * config.RESOLUTION[1]
+
+    try:
+        with headless.HeadlessContext.create(args.platform, config.RESOLUTION):
+            images = {}
+            for shared in (True, False):
+                config.SHARED_PATH_TRACING = shared
+                _, renderer, logic_provider = shader.create_renderer(FrameState(), ExampleSceneLoader)
+                renderer.render()
+                glFinish()
+
+                seconds, images[shared] = converge(renderer, logic_provider, args.samples)
+                samples = max(args.samples // logic_provider.samples_per_frame, 1) * logic_provider.samples_per_frame
+                print(f"{'shared' if shared else 'per-channel'} paths, {config.BACKEND} backend: "
+                      f"{samples / seconds:.2f} samples/s per pixel, {samples * pixels / seconds / 1E6:.2f} M samples/s, "
+                      f"image mean {images[shared].mean():.4f}")
+                if shared:
+                    _, images['noise'] = converge(renderer, logic_provider, args.samples)
+
+            for name, other in (('per-channel', images[False]), ('shared of other samples', images['noise'])):
+                delta = np.abs(images[True] - other)
+                print(f"shared against {name}: mean difference {delta.mean():.4f}, "
+                      f"{np.mean(delta.max(axis=-1) > 2 / 255) * 100:.1f}% of pixels differ by more than 2/255")
+    finally:
+        shutil.rmtree(config.CACHE_PATH, ignore_errors=True)
+
+def denoise(args):
+    """
+    Demo scene frames of both backends with and without the denoiser, and the filter alone. The rest of the
+    difference is the tracer writing first hit features. Frames alternate between the two renderers, so the
+    machine slowing down in between affects both
+    """
+    from OpenGL.GL import glFinish, glBindImageTexture, GL_FALSE, GL_READ_WRITE, GL_RGBA32F
+
+    import config
+    import shader
+    from graphics import FrameState
+    from demo import ExampleSceneLoader
+
+    config.RESOLUTION = (160, 90)
+    config.CACHE_PATH = tempfile.mkdtemp()
+
+    try:
+        with headless.HeadlessContext.create(args.platform, config.RESOLUTION):
+            for backend in ('fragment', 'compute'):
+                config.BACKEND = backend
+                renderers = {}
+                for denoised in (False, True):
+                    config.DENOISE = denoised
+                    _, renderers[denoised], logic_provider = shader.create_renderer(FrameState(), ExampleSceneLoader)
+
+                times = {denoised: [] for denoised in renderers}
+                for _ in range(args.repeat + 1):
+                    for denoised, renderer in renderers.items():
+                        if backend == 'compute':
+                            # ComputeRenderer binds its accumulation image once, the other one of the pair took the unit
+                            glBindImageTexture(0, renderer.accumulation.texture, 0, GL_FALSE, 0, GL_READ_WRITE, GL_RGBA32F)
+                        start = time.perf_counter()
+                        renderer.render()
+                        glFinish()
+                        times[denoised].append(time.perf_counter() - start)
+                # First frames upload the scene
+                plain, denoised = (min(times[denoised][1:]) for denoised in (False, True))
+
+                renderer = renderers[True]
+                texture = renderer.accumulation.texture if backend == 'compute' else renderer.target.texture
+
+                def filtering():
+                    renderer.denoiser.render(texture)
+                    glFinish()
+
+                filtered = best_time(filtering, args.repeat)
+                print(f"{backend} backend, {logic_provider.samples_per_frame} samples per frame: "
+                      f"{plain * 1E3:.1f} ms without the denoiser, {denoised * 1E3:.1f} ms with it "
+                      f"({(denoised / plain - 1) * 100:+.0f}%), {filtered * 1E3:.1f} ms of it filtering")
+    finally:
+        shutil.rmtree(config.CACHE_PATH, ignore_errors=True)
+
+COMMANDS = {
+    'bulk': bulk,
+    'packing': packing,
+    'uniforms': uniforms,
+    'skybox': skybox,
+    'startup': startup,
+    'load': load,
+    'obj': obj,
+    'update': update,
+    'paths': paths,
+    'denoise': denoise,
+}
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Measures loading and per frame paths against the ones they replaced")
+    parser.add_argument('command', choices=tuple(COMMANDS))
+    parser.add_argument('--count', type=int, default=100_000, help="primitives of bulk, packing, load, obj and update, frames of uniforms")
+    parser.add_argument('--samples', type=int, default=64, help="samples per pixel of images compared by paths")
+    parser.add_argument('--repeat', type=int, default=5, help="runs of every measurement, the shortest is printed")
+    parser.add_argument('--platform', choices=headless.PLATFORMS, default='egl')
+    parser.add_argument('--software', action='store_true', help="use Mesa's llvmpipe, no GPU needed")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    # python3 benchmark.py bulk --count 100000
+    # python3 benchmark.py packing --count 100000
+    # python3 benchmark.py uniforms --count 10000 --software
+    # python3 benchmark.py skybox --software
+    # MESA_SHADER_CACHE_DISABLE=true python3 benchmark.py startup --software
+    arguments = parse_args(sys.argv[1:])
+    headless.select_platform(arguments.platform, arguments.software)
+    COMMANDS[arguments.command](arguments)
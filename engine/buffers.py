@@ -7,3 +7,11 @@ class Buffers(Enum):
     TRIANGLES = 3
     LENSES = 4
     FRAME_BUFFER = 5
+    TRIANGLES_BVH = 6
+    NEXT_FRAME_BUFFER = 7
+    INSTANCES = 8
+    INSTANCES_BVH = 9
+
+
+class UniformBuffers(Enum):
+    FRAME_STATE = 0
@@ -0,0 +1,320 @@
+import sys
+import time
+import argparse
+
+import numpy as np
+
+EPS = 1E-3
+INFTY = 1E9
+
+# Mirrors `struct BVHNode` in render.frag (std430, 32 bytes).
+# Interior nodes have count == 0 and their children at left_first, left_first + 1,
+# leaves reference triangles [left_first, left_first + count) of the reordered buffer.
+NODE_DTYPE = np.dtype([
+    ('bounds_min', '<f4', 3),
+    ('left_first', '<i4'),
+    ('bounds_max', '<f4', 3),
+    ('count', '<i4'),
+])
+
+# Root of the world BVH when only instances have triangles, so BLAS nodes appended after it don't start at 0.
+# Its inverted bounds mark the tree as empty for is_empty, it must not be traversed
+EMPTY_NODES = np.array([((INFTY, INFTY, INFTY), 0, (-INFTY, -INFTY, -INFTY), 0)], dtype=NODE_DTYPE)
+
+
+def is_empty(nodes):
+    return len(nodes) == 0 or bool(np.any(nodes[0]['bounds_min'] > nodes[0]['bounds_max']))
+
+
+class BVH:
+    BINS = 16
+    MAX_LEAF_SIZE = 4
+    # Keeps traversal within the fixed-size stack in render.frag (BVH_STACK_SIZE)
+    MAX_DEPTH = 48
+
+    def __init__(self, vertices, bins=BINS, max_leaf_size=MAX_LEAF_SIZE):
+        """
+        Builds binned SAH BVH over triangles
+        :param vertices: array of shape (N, 3, 3) - three vertices of every triangle
+        """
+        vertices = np.asarray(vertices, dtype=np.float32).reshape(-1, 3, 3)
+        self.__build_over(vertices.min(axis=1), vertices.max(axis=1), bins, max_leaf_size)
+        self.vertices = vertices[self.order]
+
+    @classmethod
+    def of_boxes(cls, bounds_min, bounds_max, bins=BINS, max_leaf_size=MAX_LEAF_SIZE):
+        """
+        Builds BVH over boxes, leaves reference boxes of the reordered array instead of triangles
+        :param bounds_min: array of shape (N, 3), same for bounds_max
+        """
+        bvh = cls.__new__(cls)
+        bvh.__build_over(np.asarray(bounds_min, dtype=np.float32), np.asarray(bounds_max, dtype=np.float32),
+                         bins, max_leaf_size)
+        bvh.vertices = None
+        return bvh
+
+    def __build_over(self, bounds_min, bounds_max, bins, max_leaf_size):
+        self.bins = bins
+        self.max_leaf_size = max_leaf_size
+
+        self.triangle_min = bounds_min
+        self.triangle_max = bounds_max
+        self.centroids = (self.triangle_min + self.triangle_max) * 0.5
+
+        count = len(bounds_min)
+        self.order = np.arange(count, dtype=np.int64)
+        self.nodes = np.zeros(max(2 * count - 1, 0), dtype=NODE_DTYPE)
+        self.nodes_used = 0
+
+        if count > 0:
+            self.__build()
+
+        self.nodes = self.nodes[:self.nodes_used]
+
+        del self.triangle_min, self.triangle_max, self.centroids
+
+    def __build(self):
+        """
+        Builds the tree level by level, every level is processed by a constant number of NumPy calls
+        """
+        bounds_min = np.empty((len(self.nodes), 3), dtype=np.float32)
+        bounds_max = np.empty((len(self.nodes), 3), dtype=np.float32)
+        left_first = np.zeros(len(self.nodes), dtype=np.int32)
+        counts = np.zeros(len(self.nodes), dtype=np.int32)
+
+        self.nodes_used = 1
+        nodes = np.array([0])
+        starts = np.array([0])
+        ends = np.array([len(self.order)])
+        depth = 0
+
+        while len(nodes) > 0:
+            lengths = ends - starts
+            offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+            segment = np.repeat(np.arange(len(nodes)), lengths)
+            positions = np.arange(len(segment)) + np.repeat(starts - offsets, lengths)
+            indices = self.order[positions]
+
+            triangle_min = self.triangle_min[indices]
+            triangle_max = self.triangle_max[indices]
+            bounds_min[nodes] = np.minimum.reduceat(triangle_min, offsets, axis=0)
+            bounds_max[nodes] = np.maximum.reduceat(triangle_max, offsets, axis=0)
+
+            left_mask, split = self.__find_splits(
+                indices, segment, offsets, lengths, triangle_min, triangle_max,
+                bounds_max[nodes] - bounds_min[nodes], depth < self.MAX_DEPTH)
+
+            leaves = nodes[~split]
+            left_first[leaves] = starts[~split]
+            counts[leaves] = lengths[~split]
+
+            # Stable partition of every splitting segment into its left and right halves
+            inner = split[segment]
+            key = segment[inner] * 2 + (~left_mask[inner])
+            self.order[positions[inner]] = indices[inner][np.argsort(key, kind='stable')]
+
+            split_nodes = nodes[split]
+            children = self.nodes_used + 2 * np.arange(len(split_nodes))
+            self.nodes_used += 2 * len(split_nodes)
+            left_first[split_nodes] = children
+
+            middles = starts[split] + np.bincount(segment[inner & left_mask], minlength=len(nodes))[split]
+            nodes = np.stack((children, children + 1), axis=1).ravel()
+            starts = np.stack((starts[split], middles), axis=1).ravel()
+            ends = np.stack((middles, ends[split]), axis=1).ravel()
+            depth += 1
+
+        self.nodes['bounds_min'] = bounds_min
+        self.nodes['bounds_max'] = bounds_max
+        self.nodes['left_first'] = left_first
+        self.nodes['count'] = counts
+
+    def __find_splits(self, indices, segment, offsets, lengths, triangle_min, triangle_max, extent, can_split):
+        """
+        Evaluates SAH cost of every bin boundary along all three axes of every node of the level at once
+        :return: (boolean mask of triangles going to the left child, boolean mask of nodes that are split)
+        """
+        segments = len(lengths)
+        bins = self.bins
+
+        centroids = self.centroids[indices]
+        centroid_min = np.minimum.reduceat(centroids, offsets, axis=0)
+        centroid_extent = np.maximum.reduceat(centroids, offsets, axis=0) - centroid_min
+        degenerate = ~np.any(centroid_extent > 0, axis=1)
+
+        scale = np.where(centroid_extent > 0, bins / np.where(centroid_extent > 0, centroid_extent, 1), 0)
+        bin_ids = ((centroids - centroid_min[segment]) * scale[segment]).astype(np.int64)
+        np.clip(bin_ids, 0, bins - 1, out=bin_ids)
+
+        # Bins of node s along axis k occupy [(3s + k) * bins, (3s + k + 1) * bins) of the flattened arrays
+        flat_ids = (bin_ids + (segment[:, None] * 3 + np.arange(3)) * bins).ravel()
+        bin_counts = np.bincount(flat_ids, minlength=segments * 3 * bins)
+        occupied = np.nonzero(bin_counts)[0]
+        sort = np.argsort(flat_ids, kind='stable') // 3
+        bin_starts = np.concatenate(([0], np.cumsum(bin_counts[occupied])[:-1]))
+        bin_min = np.full((segments * 3 * bins, 3), INFTY, dtype=np.float32)
+        bin_max = np.full((segments * 3 * bins, 3), -INFTY, dtype=np.float32)
+        bin_min[occupied] = np.minimum.reduceat(triangle_min[sort], bin_starts, axis=0)
+        bin_max[occupied] = np.maximum.reduceat(triangle_max[sort], bin_starts, axis=0)
+        bin_counts = bin_counts.reshape(segments, 3, bins)
+        bin_min = bin_min.reshape(segments, 3, bins, 3)
+        bin_max = bin_max.reshape(segments, 3, bins, 3)
+
+        left_count = np.cumsum(bin_counts, axis=2)[..., :-1]
+        right_count = lengths[:, None, None] - left_count
+        left_area = BVH.surface_area(
+            np.maximum.accumulate(bin_max, axis=2) - np.minimum.accumulate(bin_min, axis=2))[..., :-1]
+        right_area = BVH.surface_area(
+            np.maximum.accumulate(bin_max[:, :, ::-1], axis=2) - np.minimum.accumulate(bin_min[:, :, ::-1], axis=2)
+        )[:, :, ::-1][..., 1:]
+
+        # Not INFTY, costs of large nodes exceed it
+        cost = np.where((left_count > 0) & (right_count > 0),
+                        left_count * left_area + right_count * right_area, np.inf).reshape(segments, -1)
+        best = np.argmin(cost, axis=1)
+        best_cost = cost[np.arange(segments), best]
+        best_axis, best_bin = np.divmod(best, bins - 1)
+
+        leaf_cost = lengths * BVH.surface_area(extent)
+        split = can_split & (lengths > self.max_leaf_size)
+        split &= degenerate | (best_cost < np.inf)
+        split &= degenerate | (best_cost < leaf_cost) | (lengths > 2 * self.max_leaf_size)
+
+        left_mask = bin_ids[np.arange(len(indices)), best_axis[segment]] <= best_bin[segment]
+        # All centroids of the node coincide, SAH can't separate them so split it in half
+        halves = np.arange(len(indices)) - offsets[segment] < lengths[segment] // 2
+        left_mask = np.where(degenerate[segment], halves, left_mask)
+
+        return left_mask, split
+
+    @staticmethod
+    def surface_area(extent):
+        extent = np.maximum(extent, 0)
+        return 2 * (extent[..., 0] * extent[..., 1] + extent[..., 1] * extent[..., 2] + extent[..., 2] * extent[..., 0])
+
+    def as_bytes(self):
+        return self.nodes.tobytes()
+
+    def intersect(self, origin, direction):
+        """
+        CPU version of the traversal in render.frag
+        :return: (distance, index of triangle in the reordered buffer), distance is INFTY if nothing was hit
+        """
+        origin = np.asarray(origin, dtype=np.float32)
+        direction = np.asarray(direction, dtype=np.float32)
+        if len(self.nodes) == 0:
+            return INFTY, -1
+
+        with np.errstate(divide='ignore'):
+            inv_dir = 1.0 / np.where(np.abs(direction) < 1E-8, 1E-8, direction)
+
+        # Distances to triangles are measured in units of length, not in ray parameter
+        length = float(np.linalg.norm(direction))
+        best_dist, best_index = INFTY, -1
+        stack = [0]
+
+        while stack:
+            node = self.nodes[stack.pop()]
+            if BVH.box_distance(origin, inv_dir, node['bounds_min'], node['bounds_max']) * length >= best_dist:
+                continue
+
+            first = int(node['left_first'])
+            if node['count'] > 0:
+                dist = intersect_triangles(self.vertices[first:first + node['count']], origin, direction)
+                i = int(np.argmin(dist))
+                if dist[i] < best_dist:
+                    best_dist, best_index = float(dist[i]), first + i
+                continue
+
+            left, right = self.nodes[first], self.nodes[first + 1]
+            left_dist = BVH.box_distance(origin, inv_dir, left['bounds_min'], left['bounds_max'])
+            right_dist = BVH.box_distance(origin, inv_dir, right['bounds_min'], right['bounds_max'])
+            if left_dist <= right_dist:
+                stack += [first + 1, first]
+            else:
+                stack += [first, first + 1]
+
+        return best_dist, best_index
+
+    @staticmethod
+    def box_distance(origin, inv_dir, bounds_min, bounds_max):
+        t0 = (bounds_min - origin) * inv_dir
+        t1 = (bounds_max - origin) * inv_dir
+        near = max(float(np.minimum(t0, t1).max()), 0.0)
+        far = float(np.maximum(t0, t1).min())
+        return near if far >= near else INFTY
+
+
+def intersect_triangles(vertices, origin, direction):
+    """
+    Vectorized Möller–Trumbore matching castRayWithTriangle in render.frag
+    :param origin: one ray for all triangles or array of shape (N, 3) - a ray for every triangle, same for direction
+    :return: distance to every triangle, INFTY where there is no hit
+    """
+    vertices = np.asarray(vertices, dtype=np.float32).reshape(-1, 3, 3)
+    a, b, c = vertices[:, 0], vertices[:, 1], vertices[:, 2]
+    edge1 = b - a
+    edge2 = c - a
+    ray_cross_e2 = np.cross(direction, edge2)
+    det = np.sum(edge1 * ray_cross_e2, axis=-1)
+
+    valid = np.abs(det) >= EPS
+    inv_det = 1.0 / np.where(valid, det, 1.0)
+    s = origin - a
+    u = inv_det * np.sum(s * ray_cross_e2, axis=-1)
+    valid &= ~(((u < 0) & (np.abs(u) > EPS)) | ((u > 1) & (np.abs(u - 1) > EPS)))
+
+    s_cross_e1 = np.cross(s, edge1)
+    v = inv_det * np.sum(s_cross_e1 * direction, axis=-1)
+    valid &= ~(((v < 0) & (np.abs(v) > EPS)) | ((u + v > 1) & (np.abs(u + v - 1) > EPS)))
+
+    t = inv_det * np.sum(edge2 * s_cross_e1, axis=-1)
+    valid &= t > EPS
+
+    return np.where(valid, t * np.linalg.norm(direction, axis=-1), INFTY)
+
+
+def depth(nodes, root=0):
+    """
+    :return: number of nodes on the longest path from root to a leaf
+    """
+    levels, current = 0, [root]
+    while current:
+        levels += 1
+        current = [child for node in current if nodes[node]['count'] == 0
+                   for child in (nodes[node]['left_first'], nodes[node]['left_first'] + 1)]
+    return levels
+
+
+def benchmark(counts, seed=0):
+    """
+    Builds BVH over triangles scattered in a box, like a scanned mesh split into a triangle soup
+    :return: rows of (triangles, seconds, nodes, depth)
+    """
+    random = np.random.default_rng(seed)
+    rows = []
+    for count in counts:
+        # Triangle size shrinks with their number, so the scene has the same density of surfaces
+        size = 10.0 / np.cbrt(count)
+        centers = random.uniform(-10, 10, size=(count, 1, 3))
+        vertices = (centers + random.uniform(-size, size, size=(count, 3, 3))).astype(np.float32)
+
+        start = time.perf_counter()
+        bvh = BVH(vertices)
+        elapsed = time.perf_counter() - start
+        rows.append((count, elapsed, len(bvh.nodes), depth(bvh.nodes)))
+    return rows
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Measures BVH build time over random triangles")
+    parser.add_argument('counts', type=int, nargs='*', default=[10_000, 100_000, 1_000_000])
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    # python3 bvh.py 10000 100000 1000000
+    arguments = parse_args(sys.argv[1:])
+    for triangles, seconds, nodes, levels in benchmark(arguments.counts):
+        print(f"{triangles:>9} triangles: {seconds:.2f} s, {triangles / seconds / 1E3:.0f} k triangles/s, "
+              f"{nodes} nodes, depth {levels}")
@@ -0,0 +1,33 @@
+import os
+import hashlib
+
+import numpy as np
+
+import config
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while chunk := file.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_path(kind, name):
+    """
+    :return: path of entry name in cache directory of kind, the directory is created if needed
+    """
+    directory = os.path.join(config.CACHE_PATH, kind)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+def save_array(path, array: np.ndarray):
+    """
+    Writes .npy atomically so concurrent readers never see a partial entry
+    """
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as file:
+        np.save(file, array)
+    os.replace(temporary, path)
@@ -0,0 +1,359 @@
+import os
+import sys
+import time
+import queue
+import ctypes
+import argparse
+import threading
+from collections import deque
+
+import numpy as np
+from simplejpeg import encode_jpeg
+
+import config
+import headless
+import profiler
+
+# Formats of FrameWriter, taken from the extension of its file name pattern
+FORMATS = ('.jpg', '.jpeg', '.png', '.raw')
+# What FrameWriter.submit does when the queue is full: wait for the writer or drop the frame
+POLICIES = ('block', 'drop')
+
+
+class FrameWriter:
+    """
+    Background thread encoding and writing captured frames in the order they were submitted.
+    Frames wait in a bounded queue, so memory doesn't grow when encoding is slower than rendering
+    """
+
+    def __init__(self, pattern, policy=config.CAPTURE_POLICY, queue_size=config.CAPTURE_QUEUE_SIZE,
+                 quality=config.CAPTURE_JPEG_QUALITY):
+        """
+        :param pattern: file name with a format field for the frame number, e.g. 'frames/{:05d}.jpg'
+        :param policy: one of POLICIES
+        """
+        self.extension = os.path.splitext(pattern)[1].lower()
+        if self.extension not in FORMATS:
+            raise ValueError(f"Unsupported capture format {self.extension}, expected one of {FORMATS}")
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown capture policy {policy}, expected one of {POLICIES}")
+
+        self.pattern = pattern
+        self.policy = policy
+        self.quality = quality
+        self.queue = queue.Queue(queue_size)
+        # Numbers of written frames in the order they were written
+        self.written = []
+        self.dropped = 0
+        self.error = None
+
+        self.thread = threading.Thread(target=self.__run, name='FrameWriter', daemon=True)
+        self.thread.start()
+
+    def submit(self, number, image: np.ndarray):
+        """
+        :param image: uint8 array of shape (height, width, 3 or 4) with the first row at the top, alpha is ignored
+        :return: whether the frame was queued, it's dropped if the queue is full with the 'drop' policy
+        """
+        if self.error is not None:
+            raise RuntimeError(f"Writing frame failed: {self.error}") from self.error
+
+        if self.policy == 'block':
+            self.queue.put((number, image))
+            return True
+        try:
+            self.queue.put_nowait((number, image))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def close(self):
+        """
+        Waits until all queued frames are written
+        """
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise RuntimeError(f"Writing frame failed: {self.error}") from self.error
+
+    def __run(self):
+        while (item := self.queue.get()) is not None:
+            # After a failure the queue is still drained, so submit never blocks forever
+            if self.error is not None:
+                continue
+            try:
+                self.write(*item)
+            except Exception as error:
+                self.error = error
+
+    def write(self, number, image: np.ndarray):
+        path = self.pattern.format(number)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        height, width, channels = image.shape
+        colorspace = 'RGBA' if channels == 4 else 'RGB'
+        if self.extension == '.raw':
+            np.ascontiguousarray(image).tofile(path)
+        elif self.extension == '.png':
+            import pygame
+            pygame.image.save(pygame.image.frombuffer(image.tobytes(), (width, height), colorspace), path)
+        else:
+            data = encode_jpeg(np.ascontiguousarray(image), quality=self.quality, colorspace=colorspace)
+            with open(path, 'wb') as file:
+                file.write(data)
+
+        self.written.append(number)
+
+
+class ReadbackRing:
+    """
+    Order of readbacks through a ring of buffers, without GL so it's testable on its own. Buffers are reused in the
+    order they were freed and readbacks are handed over in the order they were started
+    """
+
+    def __init__(self, buffers):
+        """
+        :param buffers: handles of the buffers, at least one
+        """
+        if not buffers:
+            raise ValueError("Readback ring needs at least one buffer")
+        self.free = deque(buffers)
+        # (buffer, fence, frame number) of readbacks in flight, oldest first
+        self.pending = deque()
+        self.captured = 0
+        # Acquires that found all buffers busy, the oldest readback had to be waited for
+        self.stalls = 0
+
+    def acquire(self):
+        """
+        :return: the buffer freed longest ago, None if all of them are busy and the oldest readback has to finish first
+        """
+        if not self.free:
+            self.stalls += 1
+            return None
+        return self.free.popleft()
+
+    def start(self, buffer, fence, number=None):
+        """
+        :param number: number of the frame for the writer, the one after the previous readback if None
+        :return: the frame number
+        """
+        if number is None:
+            number = self.captured
+        self.pending.append((buffer, fence, number))
+        self.captured = number + 1
+        return number
+
+    def oldest(self):
+        """
+        :return: (buffer, fence, frame number) of the readback started first, None if nothing is in flight
+        """
+        return self.pending[0] if self.pending else None
+
+    def release(self):
+        """
+        Ends the oldest readback once its pixels were read and makes its buffer free again
+        :return: (buffer, fence, frame number) of it
+        """
+        if not self.pending:
+            raise RuntimeError("No readback in flight to release")
+        buffer, fence, number = self.pending.popleft()
+        self.free.append(buffer)
+        return buffer, fence, number
+
+
+class PixelBufferCapture:
+    """
+    Reads back the default framebuffer without stalling the pipeline. glReadPixels of every frame goes into the next
+    of a ring of pixel buffer objects and a fence marks when the copy is done, the pixels are mapped frames later
+    once the fence is signaled and handed to the FrameWriter
+    """
+
+    # How long finish waits for a single readback, nanoseconds
+    WAIT_TIMEOUT = 1_000_000_000
+
+    def __init__(self, resolution, writer: FrameWriter, buffers=config.CAPTURE_BUFFERS):
+        """
+        :param buffers: number of frames in flight, capture waits for the oldest one when all of them are busy
+        """
+        # OpenGL may be imported only after headless.select_platform
+        from OpenGL import GL
+        self.gl = GL
+
+        self.resolution = tuple(resolution)
+        self.writer = writer
+        width, height = self.resolution
+        self.size = width * height * 4
+
+        pbos = []
+        for _ in range(buffers):
+            pbo = GL.glGenBuffers(1)
+            GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, pbo)
+            GL.glBufferData(GL.GL_PIXEL_PACK_BUFFER, self.size, None, GL.GL_STREAM_READ)
+            pbos.append(pbo)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        self.ring = ReadbackRing(pbos)
+
+    @property
+    def stalls(self):
+        """
+        Captures that had to wait for a readback because all buffers were busy
+        """
+        return self.ring.stalls
+
+    def capture(self, number=None):
+        """
+        Starts reading back the current content of the default framebuffer
+        :param number: number of the frame for the writer, the one after the previous capture if None
+        """
+        GL = self.gl
+        self.collect()
+        pbo = self.ring.acquire()
+        if pbo is None:
+            self.__hand_over(wait=True)
+            pbo = self.ring.acquire()
+
+        width, height = self.resolution
+        GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, 0)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, pbo)
+        GL.glPixelStorei(GL.GL_PACK_ALIGNMENT, 4)
+        GL.glReadPixels(0, 0, width, height, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+
+        self.ring.start(pbo, GL.glFenceSync(GL.GL_SYNC_GPU_COMMANDS_COMPLETE, 0), number)
+
+    def collect(self):
+        """
+        Hands every finished readback to the writer in the order they were started, never waits for GPU
+        """
+        while self.ring.pending and self.__hand_over(wait=False):
+            pass
+
+    def finish(self):
+        """
+        Waits for all readbacks in flight and hands them to the writer
+        """
+        while self.ring.pending:
+            self.__hand_over(wait=True)
+
+    def __hand_over(self, wait):
+        """
+        :return: whether the oldest readback was finished and handed over
+        """
+        GL = self.gl
+        pbo, fence, number = self.ring.oldest()
+        status = GL.glClientWaitSync(fence, GL.GL_SYNC_FLUSH_COMMANDS_BIT, self.WAIT_TIMEOUT if wait else 0)
+        if status == GL.GL_WAIT_FAILED or (wait and status == GL.GL_TIMEOUT_EXPIRED):
+            raise RuntimeError(f"Readback of frame {number} didn't finish")
+        if status == GL.GL_TIMEOUT_EXPIRED:
+            return False
+
+        GL.glDeleteSync(fence)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, pbo)
+        pointer = GL.glMapBufferRange(GL.GL_PIXEL_PACK_BUFFER, 0, self.size, GL.GL_MAP_READ_BIT)
+        pixels = np.frombuffer(ctypes.string_at(pointer, self.size), dtype=np.uint8)
+        GL.glUnmapBuffer(GL.GL_PIXEL_PACK_BUFFER)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        self.ring.release()
+
+        width, height = self.resolution
+        # Rows of glReadPixels start at the bottom, the writer makes the view contiguous off the render thread
+        self.writer.submit(number, pixels.reshape(height, width, 4)[::-1])
+        return True
+
+    def close(self):
+        """
+        Writes all captured frames, waiting for the writer
+        """
+        self.finish()
+        self.writer.close()
+
+
+class CaptureRenderer:
+    """
+    Renderer capturing every presented frame
+    """
+
+    def __init__(self, renderer, capture: PixelBufferCapture):
+        self.renderer = renderer
+        self.capture = capture
+
+    def set_internal_resolution(self, resolution):
+        self.renderer.set_internal_resolution(resolution)
+
+    def render(self, present=True):
+        self.renderer.render(present)
+        if present:
+            with profiler.stage('capture'):
+                self.capture.capture()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Measures frames/s of rendering without capture, with glReadPixels and with pixel buffer capture")
+    parser.add_argument('scene', help="scene loader class, e.g. demo.ExampleSceneLoader, or binary scene file")
+    parser.add_argument('pattern', help="file name pattern of captured frames, e.g. /tmp/frames/{:05d}.jpg")
+    parser.add_argument('--resolution', type=int, nargs=2, default=(1920, 1080), metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--policy', choices=POLICIES, default=config.CAPTURE_POLICY)
+    parser.add_argument('--platform', choices=headless.PLATFORMS, default='egl')
+    parser.add_argument('--software', action='store_true', help="use Mesa's llvmpipe, no GPU needed")
+    return parser.parse_args(argv)
+
+
+def benchmark(args):
+    # Imported here, OpenGL must not be imported before headless.select_platform
+    from OpenGL.GL import glFinish
+
+    import shader
+    from batch import scene_loader_factory, read_pixels
+    from graphics import FrameState
+
+    config.RESOLUTION = tuple(args.resolution)
+
+    with headless.HeadlessContext.create(args.platform, config.RESOLUTION):
+        _, renderer, _ = shader.create_renderer(FrameState(), scene_loader_factory(args.scene))
+        # First frame uploads the scene and links the program
+        renderer.render()
+        glFinish()
+
+        def measure(render_frame):
+            start = time.perf_counter()
+            for number in range(args.frames):
+                render_frame(number)
+            glFinish()
+            return args.frames / (time.perf_counter() - start)
+
+        plain = measure(lambda number: renderer.render())
+        synchronous = measure(lambda number: (renderer.render(), read_pixels(config.RESOLUTION)))
+
+        capture = PixelBufferCapture(config.RESOLUTION, FrameWriter(args.pattern, args.policy))
+        capturing = CaptureRenderer(renderer, capture)
+        start = time.perf_counter()
+        for _ in range(args.frames):
+            capturing.render()
+        capture.finish()
+        rendered = args.frames / (time.perf_counter() - start)
+        capture.writer.close()
+        written = args.frames / (time.perf_counter() - start)
+
+    writer = capture.writer
+    print(f"{args.frames} frames at {config.RESOLUTION[0]}x{config.RESOLUTION[1]}")
+    print(f"without capture: {plain:.1f} frames/s")
+    print(f"glReadPixels: {synchronous:.1f} frames/s")
+    print(f"pixel buffers: {rendered:.1f} frames/s rendered, {written:.1f} frames/s written, "
+          f"{capture.stalls} stalls, {writer.dropped} dropped")
+
+    # Frames must come out in order, all of them unless the drop policy dropped some
+    if writer.written != sorted(writer.written) or len(writer.written) + writer.dropped != args.frames:
+        raise RuntimeError(f"Captured frames are out of order or missing: {writer.written}")
+
+
+if __name__ == "__main__":
+    # python3 capture.py demo.ExampleSceneLoader /tmp/frames/{:05d}.jpg --software
+    arguments = parse_args(sys.argv[1:])
+    headless.select_platform(arguments.platform, arguments.software)
+    benchmark(arguments)
@@ -1,3 +1,59 @@
 ICON_PATH = '../media/icon.png'
 FPS = 60
-RESOLUTION = (1920, 1080)
\ No newline at end of file
+# While the camera doesn't move, every frame renders as many accumulation passes as fit in FRAME_BUDGET_HEADROOM
+# of 1 / FPS at the measured cost of a pass, but at most MAX_IDLE_PASSES. Frames with movement render one pass
+MAX_IDLE_PASSES = 16
+FRAME_BUDGET_HEADROOM = 0.8
+# While the camera moves the image is traced at the largest of DYNAMIC_RESOLUTION_SCALES of RESOLUTION whose frame
+# fits the budget and upscaled, without the denoiser. A larger scale is taken back once its frame is predicted to take
+# at most DYNAMIC_RESOLUTION_UPSCALE_MARGIN of the budget. RESOLUTION is traced again when the camera stops,
+# with TEMPORAL_REPROJECTION history is resampled across resolution changes instead of being dropped
+DYNAMIC_RESOLUTION = True
+DYNAMIC_RESOLUTION_SCALES = (1.0, 0.75, 0.5, 0.35)
+DYNAMIC_RESOLUTION_UPSCALE_MARGIN = 0.7
+RESOLUTION = (1920, 1080)
+# Trace one ray path for all colors, splitting it only at dispersive materials
+SHARED_PATH_TRACING = True
+# Path length, fixed at shader compile time. From MIN_BOUNCES on paths with throughput below
+# ROULETTE_THRESHOLD are terminated by Russian roulette, MIN_BOUNCES = MAX_BOUNCES disables it
+MAX_BOUNCES = 10
+MIN_BOUNCES = 3
+ROULETTE_THRESHOLD = 0.1
+# Keep accumulated samples when the camera moves, they are reprojected using distance to the first hit of every pixel.
+# While the camera moves history counts as at most REPROJECTION_MAX_HISTORY samples, so its blur fades quickly.
+# History pixel is rejected as disoccluded if its distance differs by more than REPROJECTION_TOLERANCE of the expected one
+TEMPORAL_REPROJECTION = True
+REPROJECTION_MAX_HISTORY = 16
+REPROJECTION_TOLERANCE = 0.05
+# Storage of the accumulated mean of every pixel in prevFrameData and the history: 'rgba32f', 'rgb32f', 'rgb16f'
+# or 'rgb9e5' (shared exponent). Compact ones round stochastically, accumulation.py models their error over many frames
+ACCUMULATION_FORMAT = 'rgba32f'
+# Edge-avoiding à-trous filter of the accumulated image before display, the accumulated history stays unfiltered.
+# Filter radius is 2^DENOISE_ITERATIONS pixels. Pixels are mixed when their colors differ by less than
+# DENOISE_COLOR_SIGMA / sqrt(samples) and first hit normals, colors and relative distances by less than the other sigmas
+DENOISE = False
+DENOISE_ITERATIONS = 3
+DENOISE_COLOR_SIGMA = 0.5
+DENOISE_NORMAL_SIGMA = 0.1
+DENOISE_ALBEDO_SIGMA = 0.1
+DENOISE_DEPTH_SIGMA = 0.05
+# 'fragment' traces one sample per pixel per frame in render.frag,
+# 'compute' traces COMPUTE_SAMPLES samples per pixel per frame in render.comp
+BACKEND = 'fragment'
+COMPUTE_SAMPLES = 4
+COMPUTE_TILE_SIZE = 256
+# Generate mipmaps for the sky so distant lookups don't alias
+SKYBOX_MIPMAPS = True
+CACHE_PATH = '../.cache'
+# Frame capture reads presented frames back into a ring of CAPTURE_BUFFERS pixel buffers and writes them on a
+# background thread. At most CAPTURE_QUEUE_SIZE frames wait for it, then capture waits ('block') or drops them ('drop')
+CAPTURE_BUFFERS = 3
+CAPTURE_QUEUE_SIZE = 8
+CAPTURE_POLICY = 'block'
+CAPTURE_JPEG_QUALITY = 90
+# Profiling times stages of every frame on CPU and with PROFILE_GPU by GL timer queries, the last PROFILE_HISTORY
+# timings of every stage are kept. The window caption shows their medians every PROFILE_OVERLAY_INTERVAL seconds
+PROFILE = False
+PROFILE_GPU = True
+PROFILE_HISTORY = 1024
+PROFILE_OVERLAY_INTERVAL = 1.0
@@ -50,6 +50,10 @@ class ExampleSceneLoader(SceneLoader):
             Triangle(Vector(-5.0, 0.0, 11.0), Vector(-5.0, 3.46410161514, 13.0), Vector(-20.0, 3.46410161514, 13.0), self.metal),
         ]
 
+    @typing.override
+    def spawn_sun(self):
+        return Sun(Vector(-300.0, 500.0, 700.0), 25.0, Color(40.0, 38.0, 34.0))
+
     @typing.override
     def spawn_lenses(self):
         return [
@@ -65,3 +69,93 @@ class ExampleSceneLoader(SceneLoader):
             )
         ]
 
+
+def rock(subdivisions, seed=0):
+    """
+    Icosphere with every vertex pushed along its normal by noise, heavy mesh for instancing scenes
+    :return: array of shape (20 * 4^subdivisions, 3, 3)
+    """
+    t = (1.0 + 5.0 ** 0.5) / 2.0
+    points = np.array([
+        (-1, t, 0), (1, t, 0), (-1, -t, 0), (1, -t, 0), (0, -1, t), (0, 1, t),
+        (0, -1, -t), (0, 1, -t), (t, 0, -1), (t, 0, 1), (-t, 0, -1), (-t, 0, 1),
+    ], dtype=np.float64)
+    faces = np.array([
+        (0, 11, 5), (0, 5, 1), (0, 1, 7), (0, 7, 10), (0, 10, 11), (1, 5, 9), (5, 11, 4), (11, 10, 2), (10, 7, 6),
+        (7, 1, 8), (3, 9, 4), (3, 4, 2), (3, 2, 6), (3, 6, 8), (3, 8, 9), (4, 9, 5), (2, 4, 11), (6, 2, 10),
+        (8, 6, 7), (9, 8, 1),
+    ])
+    vertices = points[faces]
+    for _ in range(subdivisions):
+        a, b, c = vertices[:, 0], vertices[:, 1], vertices[:, 2]
+        ab, bc, ca = (a + b) / 2, (b + c) / 2, (c + a) / 2
+        vertices = np.concatenate([
+            np.stack(triangle, axis=1) for triangle in ((a, ab, ca), (ab, b, bc), (ca, bc, c), (ab, bc, ca))
+        ])
+
+    # Same noise for the same point, so shared vertices of neighbouring triangles stay shared
+    directions = vertices / np.linalg.norm(vertices, axis=-1, keepdims=True)
+    frequencies = np.random.default_rng(seed).normal(size=(8, 3)) * 2.0
+    noise = np.sin(directions @ frequencies.T).mean(axis=-1)
+    return (directions * (1.0 + 0.3 * noise[..., None])).astype(np.float32)
+
+
+class InstancesSceneLoader(SceneLoader):
+    """
+    Field of copies of one heavy mesh stored once, FlattenedSceneLoader renders the same scene with copied triangles
+    """
+    ROCK_SUBDIVISIONS = 3
+    GRID = 32
+
+    def __init__(self, shader_program: ShaderProgram):
+        super().__init__(shader_program)
+
+        rng = np.random.default_rng(1)
+        count = self.GRID * self.GRID
+        angles = rng.uniform(0.0, 2.0 * np.pi, count)
+        scales = rng.uniform(0.3, 0.6, count)
+        x, z = np.meshgrid(np.arange(self.GRID), np.arange(self.GRID))
+        offsets = np.stack((x.ravel() - self.GRID / 2, np.zeros(count), z.ravel() + 5.0), axis=-1) * 1.5
+
+        transforms = np.zeros((count, 3, 4), dtype=np.float32)
+        transforms[:, 0, 0] = transforms[:, 2, 2] = np.cos(angles) * scales
+        transforms[:, 0, 2] = np.sin(angles) * scales
+        transforms[:, 2, 0] = -np.sin(angles) * scales
+        transforms[:, 1, 1] = scales
+        transforms[:, :, 3] = offsets + (0.0, -2.0, 0.0) + scales[:, None] * (0.0, 0.7, 0.0)
+
+        # Every fourth copy is metal, the rest keep the stone of the mesh
+        materials = np.where(np.arange(count) % 4 == 0, self.metal.index, -1)
+        self.place(rock(self.ROCK_SUBDIVISIONS), transforms, materials)
+
+    def place(self, vertices, transforms, materials):
+        mesh = self.add_mesh(vertices, self.stone)
+        self.add_instances(mesh, transforms, materials)
+
+    @typing.override
+    def define_materials_list(self):
+        self.stone = Material(Color(0.5, 0.45, 0.4), 0.8, self)
+        self.metal = Material(Color(0.9, 0.9, 0.9), 0.05, self)
+        self.ground = Material(Color(0.3, 0.3, 0.3), 0.6, self)
+
+    @typing.override
+    def spawn_planes(self):
+        return [
+            Plane(0.0, 1.0, 0.0, 2.0, self.ground),
+        ]
+
+    @typing.override
+    def spawn_sun(self):
+        return Sun(Vector(-300.0, 500.0, 700.0), 25.0, Color(40.0, 38.0, 34.0))
+
+
+class FlattenedSceneLoader(InstancesSceneLoader):
+    """
+    InstancesSceneLoader with every copy of the mesh transformed into world triangles
+    """
+
+    @typing.override
+    def place(self, vertices, transforms, materials):
+        world = vertices[None] @ np.swapaxes(transforms[:, None, :, :3], -1, -2) + transforms[:, None, None, :, 3]
+        triangles = np.where(materials >= 0, materials, self.stone.index)
+        self.add_triangles(world.reshape(-1, 3, 3), np.repeat(triangles, len(vertices)).astype(np.int32))
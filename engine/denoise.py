@@ -0,0 +1,62 @@
+import numpy as np
+
+# B3 spline kernel of à-trous transform, weights of offsets 0, 1 and 2 along every axis
+KERNEL = np.array([3 / 8, 1 / 4, 1 / 16], dtype=np.float32)
+
+
+def shifted(image, dx, dy):
+    """
+    :return: (image[y + dy, x + dx], whether that pixel is inside the image), arrays have the first row at the bottom
+    """
+    height, width = image.shape[:2]
+    y, x = np.mgrid[0:height, 0:width]
+    x, y = x + dx, y + dy
+    inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+    return image[np.clip(y, 0, height - 1), np.clip(x, 0, width - 1)], inside
+
+
+def atrous_iteration(color, albedo, normal, depth, samples, step_width, color_sigma, normal_sigma, albedo_sigma,
+                     depth_sigma):
+    """
+    One iteration of the edge-avoiding à-trous wavelet filter (Dammertz et al. 2010), main of denoise.comp.
+    Every pixel is the mean of 5x5 pixels stepWidth apart weighted by the kernel and by similarity of their features.
+    Color sigma of a pixel shrinks with the square root of its samples, so the filter fades as the image converges
+    :param color: (height, width, 3)
+    :param albedo: material color of the first hit of shape (height, width, 3), 0 for the sky
+    :param normal: normal of the first hit facing the camera of shape (height, width, 3), 0 for the sky
+    :param depth: distance to the first hit of shape (height, width), INFTY of trace.glsl for the sky
+    :param samples: number of accumulated samples of shape (height, width)
+    :return: filtered color
+    """
+    sigma = color_sigma / np.sqrt(np.maximum(samples, 1))
+    result = np.zeros_like(color)
+    weights = np.zeros(color.shape[:2], dtype=np.float32)
+
+    for dy in range(-2, 3):
+        for dx in range(-2, 3):
+            tap_color, inside = shifted(color, dx * step_width, dy * step_width)
+            tap_albedo, _ = shifted(albedo, dx * step_width, dy * step_width)
+            tap_normal, _ = shifted(normal, dx * step_width, dy * step_width)
+            tap_depth, _ = shifted(depth, dx * step_width, dy * step_width)
+
+            distance = (np.sum((tap_color - color) ** 2, axis=-1) / (sigma * sigma)
+                        + np.sum((tap_normal - normal) ** 2, axis=-1) / (normal_sigma * normal_sigma)
+                        + np.sum((tap_albedo - albedo) ** 2, axis=-1) / (albedo_sigma * albedo_sigma)
+                        + np.abs(tap_depth - depth) / (depth_sigma * depth + 1E-3))
+            weight = np.where(inside, KERNEL[abs(dx)] * KERNEL[abs(dy)] * np.exp(-distance), 0).astype(np.float32)
+
+            result += tap_color * weight[..., None]
+            weights += weight
+
+    # The pixel itself always has a positive weight
+    return result / weights[..., None]
+
+
+def denoise(color, albedo, normal, depth, samples, iterations, color_sigma, normal_sigma, albedo_sigma, depth_sigma):
+    """
+    Filter of graphics.Denoiser, iteration i has step width 2^i and color sigma color_sigma * 2^-i
+    """
+    for i in range(iterations):
+        color = atrous_iteration(color, albedo, normal, depth, samples, 1 << i, color_sigma / (1 << i),
+                                 normal_sigma, albedo_sigma, depth_sigma)
+    return color
@@ -0,0 +1,77 @@
+import bisect
+
+
+class DirtyRanges:
+    """
+    Set of modified elements stored as sorted disjoint half-open ranges [start, end)
+    """
+
+    def __init__(self, merge_gap=0):
+        """
+        :param merge_gap: ranges closer than this are merged, uploading a few clean elements is cheaper than a GL call
+        """
+        self.merge_gap = merge_gap
+        self.starts = []
+        self.ends = []
+
+    def __bool__(self):
+        return len(self.starts) > 0
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return iter(zip(self.starts, self.ends))
+
+    @property
+    def size(self):
+        return sum(end - start for start, end in self)
+
+    def mark(self, start, end=None):
+        if end is None:
+            end = start + 1
+        if end <= start:
+            return
+
+        # First range that may touch [start, end) and the first one after it
+        first = bisect.bisect_left(self.ends, start - self.merge_gap)
+        last = bisect.bisect_right(self.starts, end + self.merge_gap)
+
+        if first < last:
+            start = min(start, self.starts[first])
+            end = max(end, self.ends[last - 1])
+
+        self.starts[first:last] = [start]
+        self.ends[first:last] = [end]
+
+    def clear(self):
+        self.starts.clear()
+        self.ends.clear()
+
+    def truncate(self, size):
+        """
+        Drops everything at or after size
+        """
+        last = bisect.bisect_left(self.starts, size)
+        del self.starts[last:], self.ends[last:]
+        if self.ends and self.ends[-1] > size:
+            self.ends[-1] = size
+
+    def coalesced(self, max_ranges):
+        """
+        :return: at most max_ranges ranges covering all dirty elements, closest ranges are merged first
+        """
+        ranges = list(self)
+        if len(ranges) <= max_ranges:
+            return ranges
+
+        gaps = sorted(range(len(ranges) - 1), key=lambda i: ranges[i + 1][0] - ranges[i][1])
+        merged = set(gaps[:len(ranges) - max_ranges])
+
+        result = [ranges[0]]
+        for i in range(1, len(ranges)):
+            if i - 1 in merged:
+                result[-1] = (result[-1][0], ranges[i][1])
+            else:
+                result.append(ranges[i])
+        return result
@@ -0,0 +1,81 @@
+import config
+
+
+class ResolutionController:
+    """
+    Internal resolution the image is traced at. While the camera moves it's the largest of the scales whose frame
+    fits the frame budget at the measured cost of a pixel, the image is upscaled to the screen.
+    Once the camera stops the native resolution is traced again
+    """
+
+    # Weight of the newest measurement in the average cost of a pixel
+    SMOOTHING = 0.25
+    # Internal resolution is a multiple of it, the size of compute shader work groups
+    ALIGNMENT = 8
+
+    def __init__(self, native_resolution, frame_budget, scales=config.DYNAMIC_RESOLUTION_SCALES,
+                 headroom=config.FRAME_BUDGET_HEADROOM, upscale_margin=config.DYNAMIC_RESOLUTION_UPSCALE_MARGIN):
+        """
+        :param frame_budget: seconds between presented frames, 1 / FPS
+        :param scales: fractions of the native width and height from the largest to the smallest one
+        :param headroom: fraction of the budget a frame may take
+        :param upscale_margin: a larger scale is taken only if its frame takes at most this fraction of the headroom,
+                               so the resolution doesn't flip between two scales every frame
+        """
+        if not scales or any(not 0 < scale <= 1 for scale in scales):
+            raise ValueError(f"Resolution scales must be in (0, 1], got {scales}")
+
+        self.native_resolution = tuple(native_resolution)
+        self.frame_budget = frame_budget
+        self.scales = sorted(scales, reverse=True)
+        self.headroom = headroom
+        self.upscale_margin = upscale_margin
+        self.level = 0
+        self.pixel_time = None
+
+    def scaled_resolution(self, level):
+        scale = self.scales[level]
+        if scale == 1:
+            return self.native_resolution
+        return tuple(self.scaled_size(size, scale) for size in self.native_resolution)
+
+    @classmethod
+    def scaled_size(cls, size, scale):
+        """
+        :return: size times scale rounded to the alignment, never above size. History buffers are allocated at the
+                 native resolution, sizes below the alignment stay native
+        """
+        aligned = max(round(size * scale / cls.ALIGNMENT), 1) * cls.ALIGNMENT
+        return min(aligned, size // cls.ALIGNMENT * cls.ALIGNMENT or size)
+
+    def frame_time(self, level):
+        """
+        :return: predicted seconds of a frame traced at the scale of level
+        """
+        width, height = self.scaled_resolution(level)
+        return self.pixel_time * width * height
+
+    def resolution(self, moving):
+        """
+        :return: internal resolution of the next frame
+        """
+        if not moving or self.pixel_time is None:
+            self.level = 0
+            return self.native_resolution
+
+        budget = self.frame_budget * self.headroom
+        while self.level < len(self.scales) - 1 and self.frame_time(self.level) > budget:
+            self.level += 1
+        while self.level > 0 and self.frame_time(self.level - 1) <= budget * self.upscale_margin:
+            self.level -= 1
+        return self.scaled_resolution(self.level)
+
+    def record(self, resolution, elapsed):
+        """
+        :param elapsed: seconds a pass at resolution took on GPU, measured after waiting for it to finish
+        """
+        pixel_time = elapsed / (resolution[0] * resolution[1])
+        if self.pixel_time is None:
+            self.pixel_time = pixel_time
+        else:
+            self.pixel_time += (pixel_time - self.pixel_time) * self.SMOOTHING
@@ -1,8 +1,13 @@
 import sys
+import time
 
 import pygame
 from pygame.locals import *
-from graphics import Renderer
+from OpenGL.GL import glFinish
+from graphics import Renderer, MovementEventHandler
+from frame_loop import FrameInput, FrameLoop, FrameScheduler, write_trace
+from dynamic_resolution import ResolutionController
+import profiler
 import config
 import platform
 import os
@@ -11,7 +16,12 @@ import numpy as np
 
 
 class Engine:
-    def __init__(self):
+    def __init__(self, record_path=None, profile_path=None):
+        """
+        :param record_path: input of every frame is written there as a trace for replay.py when the window is closed
+        :param profile_path: enables profiling regardless of config.PROFILE, stage timings are written there
+                             as CSV or JSON when the window is closed
+        """
         self.resolution = config.RESOLUTION
         if platform.system() == "Linux":
             os.environ["SDL_VIDEO_X11_FORCE_EGL"] = "1"
@@ -20,33 +30,81 @@ class Engine:
         pygame.display.set_caption('Real Engine')
         icon = pygame.image.load(config.ICON_PATH)
         pygame.display.set_icon(icon)
-        pygame.key.set_repeat(int(1000 / config.FPS))
         self.movement_event_handler = None
+        self.record_path = record_path
+        self.recorded = []
+        # capture.PixelBufferCapture of presented frames, closed when the window is closed
+        self.capture = None
+        self.profile_path = profile_path
+        if config.PROFILE or profile_path is not None:
+            profiler.enable(profiler.Profiler())
 
-    def handle_pygame_events(self, event):
-        if event.type == pygame.MOUSEMOTION:
-            if self.movement_event_handler is not None:
-                if pygame.mouse.get_pressed(3)[0]:
-                    self.movement_event_handler.handle_mouse_event(pygame.mouse.get_rel())
-                else:
-                    pygame.mouse.get_rel()
-        if event.type == pygame.KEYDOWN:
-            if self.movement_event_handler is not None:
-                self.movement_event_handler.handle_keydown_event()
-
-    def run(self, renderer: Renderer):
+    def poll_input(self):
+        """
+        Drains all pending events into input of one frame, held keys and mouse movement are polled once
+        :return: FrameInput or None if the window was closed
+        """
+        with profiler.stage('input'):
+            for event in pygame.event.get():
+                if event.type == QUIT:
+                    return None
+
+            # Movement since the previous frame, it must be taken every frame so it doesn't pile up while not dragging
+            movement = pygame.mouse.get_rel()
+            if not pygame.mouse.get_pressed(3)[0]:
+                movement = (0, 0)
+            return FrameInput(movement, MovementEventHandler.held_keys())
+
+    def update_overlay(self):
+        """
+        Shows median stage times of the profiler in the window caption
+        """
+        pygame.display.set_caption(f"Real Engine | {profiler.active.stats.overlay_text()}")
+
+    def run(self, renderer: Renderer, samples_per_pass=1):
+        """
+        :param samples_per_pass: samples of every pixel traced by one renderer.render call
+        """
         clock = pygame.time.Clock()
+        resolution_controller = None
+        if config.DYNAMIC_RESOLUTION:
+            resolution_controller = ResolutionController(config.RESOLUTION, 1.0 / config.FPS)
+        loop = FrameLoop(renderer, self.movement_event_handler, samples_per_pass, FrameScheduler(1.0 / config.FPS),
+                         finish=glFinish, resolution_controller=resolution_controller)
+
+        # First frame uploads the scene and links the program, it would be taken for the cost of a pass
+        renderer.render()
+        glFinish()
 
+        next_overlay = time.perf_counter()
         while True:
-            for event in pygame.event.get():
-                if event.type == QUIT:
-                    pygame.quit()
-                    sys.exit()
-                else:
-                    self.handle_pygame_events(event)
-            if self.movement_event_handler is not None and any(pygame.key.get_pressed()):
-                self.movement_event_handler.handle_keydown_event()
-
-            renderer.render()
-            pygame.display.flip()
+            frame_input = self.poll_input()
+            if frame_input is None:
+                self.quit()
+            if self.record_path is not None:
+                self.recorded.append(frame_input)
+
+            loop.frame(frame_input)
+            with profiler.stage('flip'):
+                pygame.display.flip()
+            loop.present()
             clock.tick(config.FPS)
+            profiler.end_frame()
+
+            if profiler.active is not None and config.PROFILE_OVERLAY_INTERVAL > 0 \
+                    and time.perf_counter() >= next_overlay:
+                self.update_overlay()
+                next_overlay = time.perf_counter() + config.PROFILE_OVERLAY_INTERVAL
+
+    def quit(self):
+        if self.profile_path is not None:
+            profiler.active.write(self.profile_path)
+            print(f"Stage timings written to {self.profile_path}")
+        if self.capture is not None:
+            self.capture.close()
+            print(f"{len(self.capture.writer.written)} frames captured, {self.capture.writer.dropped} dropped")
+        if self.record_path is not None:
+            write_trace(self.record_path, self.recorded)
+            print(f"{len(self.recorded)} frames of input written to {self.record_path}")
+        pygame.quit()
+        sys.exit()
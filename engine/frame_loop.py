@@ -0,0 +1,208 @@
+import json
+import time
+
+import numpy as np
+
+import config
+from dynamic_resolution import ResolutionController
+
+
+class FrameInput:
+    """
+    All input of one frame coalesced from the events polled before it, applied to the camera at once
+    """
+    __slots__ = ('mouse_movement', 'keys')
+
+    def __init__(self, mouse_movement=(0, 0), keys=()):
+        """
+        :param mouse_movement: sum of mouse movements with the camera drag button held, in pixels
+        :param keys: names of held keys as returned by pygame.key.name
+        """
+        self.mouse_movement = tuple(mouse_movement)
+        self.keys = frozenset(keys)
+
+    @property
+    def empty(self):
+        return self.mouse_movement == (0, 0) and not self.keys
+
+    def as_dict(self):
+        return {'mouse': list(self.mouse_movement), 'keys': sorted(self.keys)}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('mouse', (0, 0)), data.get('keys', ()))
+
+
+def write_trace(path, inputs: list[FrameInput], fps=config.FPS):
+    with open(path, 'w') as file:
+        json.dump({'fps': fps, 'frames': [frame_input.as_dict() for frame_input in inputs]}, file)
+
+
+def read_trace(path):
+    """
+    :return: (frames per second the trace was recorded at, FrameInput of every frame)
+    """
+    with open(path, 'r') as file:
+        trace = json.load(file)
+    return trace.get('fps', config.FPS), [FrameInput.from_dict(frame) for frame in trace['frames']]
+
+
+class FrameScheduler:
+    """
+    Number of accumulation passes of every frame. Frames with camera movement get one pass so the camera responds
+    at full frame rate, idle frames get as many passes as fit in the frame budget at the measured cost of a pass
+    """
+
+    # Weight of the newest measurement in the average cost of a pass
+    SMOOTHING = 0.25
+
+    def __init__(self, frame_budget, max_passes=config.MAX_IDLE_PASSES, headroom=config.FRAME_BUDGET_HEADROOM):
+        """
+        :param frame_budget: seconds between presented frames, 1 / FPS
+        :param headroom: fraction of the budget filled with passes, the rest absorbs variance of pass cost
+        """
+        self.frame_budget = frame_budget
+        self.max_passes = max_passes
+        self.headroom = headroom
+        self.pass_time = None
+
+    def passes(self, moving):
+        if moving or self.pass_time is None:
+            return 1
+        fitting = int(self.frame_budget * self.headroom / self.pass_time)
+        return min(max(fitting, 1), self.max_passes)
+
+    def record(self, passes, elapsed):
+        """
+        :param elapsed: seconds the frame's passes took on GPU, measured after waiting for them to finish
+        """
+        pass_time = elapsed / passes
+        if self.pass_time is None:
+            self.pass_time = pass_time
+        else:
+            self.pass_time += (pass_time - self.pass_time) * self.SMOOTHING
+
+
+class FrameStats:
+    """
+    Frame intervals and samples of every frame, split into frames with camera movement and idle ones
+    """
+
+    def __init__(self):
+        self.intervals = []
+        self.samples = []
+        self.moving = []
+        self.pixels = []
+
+    def add(self, interval, samples, moving, pixels=1.0):
+        """
+        :param interval: seconds since the previous frame was presented
+        :param samples: samples per pixel traced by the frame
+        :param pixels: fraction of the native pixels the frame was traced at
+        """
+        self.intervals.append(interval)
+        self.samples.append(samples)
+        self.moving.append(moving)
+        self.pixels.append(pixels)
+
+    def summary(self):
+        """
+        :return: frame time percentiles and jitter (standard deviation and mean difference of consecutive
+                 frame times) in milliseconds, samples per pixel per second and mean fraction of traced pixels,
+                 for moving and idle frames
+        """
+        intervals = np.array(self.intervals, dtype=np.float64)
+        samples = np.array(self.samples, dtype=np.float64)
+        moving = np.array(self.moving, dtype=bool)
+        pixels = np.array(self.pixels, dtype=np.float64)
+
+        result = {}
+        for name, mask in (('moving', moving), ('idle', ~moving)):
+            frames = intervals[mask]
+            if len(frames) == 0:
+                continue
+            milliseconds = frames * 1E3
+            result[name] = {
+                'frames': len(frames),
+                'mean_ms': float(milliseconds.mean()),
+                'p50_ms': float(np.percentile(milliseconds, 50)),
+                'p95_ms': float(np.percentile(milliseconds, 95)),
+                'max_ms': float(milliseconds.max()),
+                'jitter_std_ms': float(milliseconds.std()),
+                'jitter_delta_ms': float(np.abs(np.diff(milliseconds)).mean()) if len(frames) > 1 else 0.0,
+                'samples_per_second': float(samples[mask].sum() / frames.sum()),
+                'pixels': float(pixels[mask].mean()),
+            }
+        return result
+
+
+class FrameLoop:
+    """
+    One iteration per presented frame: applies coalesced input to the camera once and renders the passes
+    given by the scheduler, only the last one is presented. Shared by engine.Engine and replay.py
+    """
+
+    def __init__(self, renderer, movement_event_handler, samples_per_pass, scheduler: FrameScheduler,
+                 finish=None, stats: FrameStats = None, resolution_controller: ResolutionController = None):
+        """
+        :param renderer: graphics.Renderer or graphics.ComputeRenderer
+        :param movement_event_handler: shader.MovementEventHandlerWrapper or None
+        :param samples_per_pass: samples of every pixel traced by one render call
+        :param finish: waits for GPU to finish submitted passes, glFinish, so they can be timed
+        :param resolution_controller: lowers resolution of frames with camera movement, renderer must support
+                                      set_internal_resolution
+        """
+        self.renderer = renderer
+        self.movement_event_handler = movement_event_handler
+        self.samples_per_pass = samples_per_pass
+        self.scheduler = scheduler
+        self.finish = finish
+        self.stats = stats
+        self.resolution_controller = resolution_controller
+        # Of the last frame, recorded by present
+        self.moving = False
+        self.passes = 0
+        self.pixels = 1.0
+        self.last_present = None
+
+    def frame(self, frame_input: FrameInput):
+        """
+        Renders the frame, call present after swapping buffers
+        :return: number of passes rendered
+        """
+        moving = False
+        if self.movement_event_handler is not None and not frame_input.empty:
+            moving = self.movement_event_handler.handle_frame_input(frame_input)
+
+        controller = self.resolution_controller
+        if controller is not None:
+            resolution = controller.resolution(moving)
+            self.renderer.set_internal_resolution(resolution)
+            native_width, native_height = controller.native_resolution
+            self.pixels = resolution[0] * resolution[1] / (native_width * native_height)
+
+        passes = self.scheduler.passes(moving)
+        start = time.perf_counter()
+        for i in range(passes):
+            self.renderer.render(present=i == passes - 1)
+        if self.finish is not None:
+            self.finish()
+        elapsed = time.perf_counter() - start
+        # Passes of frames with movement may be traced at lower resolution, they'd underestimate idle ones
+        if not moving:
+            self.scheduler.record(passes, elapsed)
+        if controller is not None:
+            controller.record(resolution, elapsed / passes)
+
+        self.moving = moving
+        self.passes = passes
+        return passes
+
+    def present(self):
+        """
+        Records the interval since the previous presented frame, call right after the buffer swap
+        """
+        now = time.perf_counter()
+        if self.stats is not None and self.last_present is not None:
+            self.stats.add(now - self.last_present, self.passes * self.samples_per_pass, self.moving, self.pixels)
+        self.last_present = now
@@ -1,29 +1,276 @@
+import os
+import re
+import ctypes
+import hashlib
+
 import OpenGL.GL.shaders
 import numpy as np
 import pygame
 from OpenGL.GL import *
+from OpenGL.error import GLError
 from pygame.event import Event
 from pyglm import glm
 
+from buffers import Buffers, UniformBuffers
+from cache import cache_path
+import accumulation
+import profiler
+
 class Shader:
     shader_type = {
         "vert": GL_VERTEX_SHADER,
         "frag": GL_FRAGMENT_SHADER,
+        "comp": GL_COMPUTE_SHADER,
     }
 
+    INCLUDE = re.compile(r'^[ \t]*#include[ \t]+"(.+)"[ \t]*$', re.MULTILINE)
+
     def __init__(self, shader_src_path, shader_type=None):
         if shader_type is None:
             shader_type = self.shader_type[shader_src_path.split(".")[-1]]
 
-        with open(shader_src_path, 'r') as f:
-            shader_src = f.read()
-        self.shader = OpenGL.GL.shaders.compileShader(shader_src, shader_type)
+        self.type = shader_type
+        self.source = Shader.read_source(shader_src_path)
+        self.__compiled = {}
+
+    def variant_source(self, defines: dict):
+        """
+        :return: source with `#define name value` for every define inserted right after #version
+        """
+        if not defines:
+            return self.source
+
+        version, rest = self.source.split('\n', 1)
+        lines = [f"#define {name} {int(value) if isinstance(value, bool) else value}" for name, value in sorted(defines.items())]
+        return '\n'.join([version, *lines, '#line 2', rest])
+
+    def compile(self, defines: dict):
+        """
+        Compiled lazily, so nothing is compiled when ShaderProgram is loaded from a cached binary
+        """
+        key = tuple(sorted(defines.items()))
+        if key not in self.__compiled:
+            self.__compiled[key] = OpenGL.GL.shaders.compileShader(self.variant_source(defines), self.type)
+        return self.__compiled[key]
+
+    @staticmethod
+    def read_source(path):
+        """
+        Reads shader source replacing `#include "file"` lines with contents of file relative to path
+        """
+        with open(path, 'r') as f:
+            source = f.read()
+
+        def include(match):
+            line = source.count('\n', 0, match.start()) + 1
+            included = Shader.read_source(os.path.join(os.path.dirname(path), match.group(1)))
+            # Keeps line numbers in compilation errors pointing into the right file
+            return f"#line 1\n{included}\n#line {line + 1}"
+
+        return Shader.INCLUDE.sub(include, source)
 
 
 class ShaderProgram:
-    def __init__(self, *shaders: Shader):
+    """
+    Program with compile-time defines, every set of defines is a separate variant linked once and kept.
+    Nothing is linked until the program is specialized or used
+    """
+
+    def __init__(self, *shaders: Shader, defines: dict = None):
+        """
+        :param defines: of the variant used if the program isn't specialized before it's used
+        """
         self.shaders = shaders
-        self.program = OpenGL.GL.shaders.compileProgram(*[shader.shader for shader in shaders])
+        self.defines = None
+        self.__default_defines = defines or {}
+        self.__program = None
+        self.__uniforms = {}
+        self.__uniform_blocks = {}
+
+        self.__variants = {}
+        # Uniforms that don't change between frames, set on every variant
+        self.__static_uniforms = {}
+
+    @property
+    def program(self):
+        if self.defines is None:
+            self.specialize(self.__default_defines)
+        return self.__program
+
+    @property
+    def uniforms(self):
+        """
+        :return: locations of active uniforms of the current variant
+        """
+        if self.defines is None:
+            self.specialize(self.__default_defines)
+        return self.__uniforms
+
+    @property
+    def uniform_blocks(self):
+        if self.defines is None:
+            self.specialize(self.__default_defines)
+        return self.__uniform_blocks
+
+    @property
+    def variants(self):
+        """
+        :return: number of linked variants
+        """
+        return len(self.__variants)
+
+    def specialize(self, defines: dict):
+        """
+        Switches to the variant of the program compiled with defines
+        :return: whether program has changed, it must be bound again in that case
+        """
+        key = tuple(sorted(defines.items()))
+        if key == self.defines:
+            return False
+
+        if key not in self.__variants:
+            program = self.__load_binary(defines)
+            if program is None:
+                program = self.__link(defines)
+                self.__save_binary(program, defines)
+
+            uniforms, uniform_blocks = ShaderProgram.__introspect(program)
+            for name, value in self.__static_uniforms.items():
+                ShaderProgram.__apply_uniform(program, uniforms.get(name, -1), value)
+            self.__variants[key] = program, uniforms, uniform_blocks
+
+        self.__program, self.__uniforms, self.__uniform_blocks = self.__variants[key]
+        self.defines = key
+        return True
+
+    def set_uniform(self, name, value):
+        """
+        Sets uniform in every variant, including the ones linked later
+        :param value: int (also for samplers and bools), float or sequence of 3 floats for vec3
+        """
+        self.__static_uniforms[name] = value
+        for program, uniforms, _ in self.__variants.values():
+            ShaderProgram.__apply_uniform(program, uniforms.get(name, -1), value)
+
+    @staticmethod
+    def __apply_uniform(program, location, value):
+        if isinstance(value, (bool, int, np.integer)):
+            glProgramUniform1i(program, location, int(value))
+        elif np.isscalar(value):
+            glProgramUniform1f(program, location, float(value))
+        else:
+            glProgramUniform3f(program, location, *map(float, value))
+
+    def __binary_cache_path(self, defines: dict):
+        """
+        Program binary is only valid for the same sources and the same driver
+        """
+        digest = hashlib.sha256()
+        for name in (GL_VENDOR, GL_RENDERER, GL_VERSION):
+            digest.update(glGetString(name) or b'')
+        for shader in self.shaders:
+            digest.update(str(shader.type).encode())
+            digest.update(shader.variant_source(defines).encode())
+        return cache_path('shaders', digest.hexdigest() + '.bin')
+
+    @staticmethod
+    def binary_supported():
+        return glGetIntegerv(GL_NUM_PROGRAM_BINARY_FORMATS) > 0
+
+    def __link(self, defines: dict):
+        program = glCreateProgram()
+        for shader in self.shaders:
+            glAttachShader(program, shader.compile(defines))
+        glProgramParameteri(program, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
+        glLinkProgram(program)
+
+        if glGetProgramiv(program, GL_LINK_STATUS) != GL_TRUE:
+            raise RuntimeError(f"Shader program link failure: {glGetProgramInfoLog(program)}")
+
+        for shader in self.shaders:
+            glDetachShader(program, shader.compile(defines))
+        return program
+
+    def __load_binary(self, defines: dict):
+        """
+        :return: program created from cached binary or None if there's none or the driver rejects it
+        """
+        if not ShaderProgram.binary_supported():
+            return None
+
+        path = self.__binary_cache_path(defines)
+        if not os.path.exists(path):
+            return None
+
+        program = glCreateProgram()
+        try:
+            with open(path, 'rb') as file:
+                binary_format = np.frombuffer(file.read(4), dtype=np.uint32)[0]
+                binary = np.frombuffer(file.read(), dtype=np.uint8)
+            glProgramBinary(program, int(binary_format), binary, len(binary))
+            linked = glGetProgramiv(program, GL_LINK_STATUS) == GL_TRUE
+        except (OSError, ValueError, IndexError, GLError):
+            linked = False
+
+        if not linked:
+            # Driver was updated or the binary is truncated or corrupted, recompiled program will be saved instead
+            glDeleteProgram(program)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+        return program
+
+    def __save_binary(self, program, defines: dict):
+        if not ShaderProgram.binary_supported():
+            return
+
+        length = glGetProgramiv(program, GL_PROGRAM_BINARY_LENGTH)
+        if length <= 0:
+            return
+
+        binary = np.zeros(length, dtype=np.uint8)
+        written = np.zeros(1, dtype=np.int32)
+        binary_format = np.zeros(1, dtype=np.uint32)
+        glGetProgramBinary(program, length, written, binary_format, binary)
+
+        path = self.__binary_cache_path(defines)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, 'wb') as file:
+            file.write(binary_format.tobytes())
+            file.write(binary[:written[0]].tobytes())
+        os.replace(temporary, path)
+
+    @staticmethod
+    def __introspect(program):
+        """
+        Resolves locations of all active uniforms and indices of uniform blocks once after linking
+        :return: (uniform locations, uniform block indices)
+        """
+        uniforms = {}
+        for index in range(glGetProgramiv(program, GL_ACTIVE_UNIFORMS)):
+            name, _, _ = glGetActiveUniform(program, index)
+            name = name.decode() if isinstance(name, bytes) else name
+            name = name.removesuffix('[0]')
+            uniforms[name] = glGetUniformLocation(program, name)
+
+        uniform_blocks = {}
+        for index in range(glGetProgramiv(program, GL_ACTIVE_UNIFORM_BLOCKS)):
+            length = np.zeros(1, dtype=np.int32)
+            glGetActiveUniformBlockiv(program, index, GL_UNIFORM_BLOCK_NAME_LENGTH, length)
+            name = ctypes.create_string_buffer(int(length[0]))
+            glGetActiveUniformBlockName(program, index, int(length[0]), None, name)
+            uniform_blocks[name.value.decode()] = index
+
+        return uniforms, uniform_blocks
+
+    def uniform_location(self, name):
+        """
+        :return: cached location, -1 if uniform isn't active (same as glGetUniformLocation)
+        """
+        return self.uniforms.get(name, -1)
 
     def use(self):
         glUseProgram(self.program)
@@ -54,6 +301,108 @@ class MeshGroup:
             mesh.draw()
 
 
+class FrameState:
+    """
+    Everything that changes between frames, uploaded once per frame as `FrameState` uniform block of render.frag
+    """
+
+    # std140: mat3 columns are padded to vec4
+    DTYPE = np.dtype({
+        'names': ['rotation_matrix', 'position', 'frame_index', 'resolution', 'blending_alpha',
+                  'prev_rotation_matrix', 'prev_position', 'history_limit', 'prev_resolution'],
+        'formats': [('<f4', (3, 4)), ('<f4', 3), '<i4', ('<f4', 2), '<f4', ('<f4', (3, 4)), ('<f4', 3), '<f4',
+                    ('<f4', 2)],
+        'offsets': [0, 48, 60, 64, 72, 80, 128, 140, 144],
+        'itemsize': 160,
+    })
+
+    def __init__(self):
+        self.data = np.zeros(1, dtype=self.DTYPE)
+        self.rotation_matrix = glm.mat3(1.0)
+        self.position = glm.vec3(0, 0, -1)
+
+        self.ubo = glGenBuffers(1)
+        glBindBuffer(GL_UNIFORM_BUFFER, self.ubo)
+        glBufferData(GL_UNIFORM_BUFFER, self.data.nbytes, None, GL_DYNAMIC_DRAW)
+        glBindBufferBase(GL_UNIFORM_BUFFER, UniformBuffers.FRAME_STATE.value, self.ubo)
+
+    @property
+    def rotation_matrix(self):
+        return self.data['rotation_matrix'][0, :, :3]
+
+    @rotation_matrix.setter
+    def rotation_matrix(self, matrix: glm.mat3):
+        for column in range(3):
+            self.data['rotation_matrix'][0, column, :3] = matrix[column]
+
+    @property
+    def position(self):
+        return self.data['position'][0]
+
+    @position.setter
+    def position(self, position: glm.vec3):
+        self.data['position'][0] = position
+
+    @property
+    def camera_moved(self):
+        """
+        Whether camera has changed since the last store_camera
+        """
+        return not (np.array_equal(self.data['rotation_matrix'], self.data['prev_rotation_matrix'])
+                    and np.array_equal(self.data['position'], self.data['prev_position']))
+
+    @property
+    def resized(self):
+        """
+        Whether resolution has changed since the last store_camera
+        """
+        return not np.array_equal(self.data['resolution'], self.data['prev_resolution'])
+
+    def store_camera(self):
+        """
+        Current camera and resolution become the previous ones of the next frame
+        """
+        self.data['prev_rotation_matrix'] = self.data['rotation_matrix']
+        self.data['prev_position'] = self.data['position']
+        self.data['prev_resolution'] = self.data['resolution']
+
+    def __setitem__(self, key, value):
+        self.data[key][0] = value
+
+    def __getitem__(self, key):
+        return self.data[key][0]
+
+    def upload(self):
+        glBindBuffer(GL_UNIFORM_BUFFER, self.ubo)
+        glBufferSubData(GL_UNIFORM_BUFFER, 0, self.data.nbytes, self.data.view(np.uint8))
+
+
+class TemporalHistory:
+    """
+    Pair of `HistoryPixel` buffers of temporal.glsl, one is read and the other one is written every frame
+    """
+
+    def __init__(self, resolution, accumulation_format):
+        """
+        :param accumulation_format: one of accumulation.FORMATS the mean color of HistoryPixel is stored in
+        """
+        accumulation.check_format(accumulation_format)
+        size = resolution[0] * resolution[1] * accumulation.FORMATS[accumulation_format]['history']
+        self.ssbos = glGenBuffers(2)
+        for ssbo in self.ssbos:
+            glBindBuffer(GL_SHADER_STORAGE_BUFFER, ssbo)
+            glBufferData(GL_SHADER_STORAGE_BUFFER, size, None, GL_DYNAMIC_COPY)
+        self.current = 0
+
+    def swap(self):
+        """
+        Binds history written by the previous frame for reading and the other buffer for writing
+        """
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, Buffers.FRAME_BUFFER.value, self.ssbos[self.current])
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, Buffers.NEXT_FRAME_BUFFER.value, self.ssbos[1 - self.current])
+        self.current = 1 - self.current
+
+
 class LogicProvider:
     def __init__(self):
         pass
@@ -62,31 +411,250 @@ class LogicProvider:
         pass
 
 
+class ColorTarget:
+    """
+    Texture attached to a framebuffer, so it can be rendered into and blitted to the screen
+    """
+
+    def __init__(self, resolution, internal_format=GL_RGBA32F):
+        self.resolution = resolution
+        self.texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glTexStorage2D(GL_TEXTURE_2D, 1, internal_format, *resolution)
+
+        self.framebuffer = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.texture, 0)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+
+    def blit(self, source_resolution=None):
+        """
+        :param source_resolution: size of the rectangle at the origin that is upscaled to the whole screen,
+                                  the whole texture if None
+        """
+        width, height = self.resolution
+        source_width, source_height = self.resolution if source_resolution is None else source_resolution
+        scaled = (source_width, source_height) != (width, height)
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.framebuffer)
+        glBlitFramebuffer(0, 0, source_width, source_height, 0, 0, width, height, GL_COLOR_BUFFER_BIT,
+                          GL_LINEAR if scaled else GL_NEAREST)
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, 0)
+
+
+class Denoiser:
+    """
+    Edge-avoiding à-trous filter of denoise.comp applied to the accumulated image on its way to the screen.
+    The tracer never reads the filtered image, so accumulated history stays unfiltered
+    """
+
+    LOCAL_SIZE = 8
+    # Image units of features.glsl and denoise.comp
+    ALBEDO_UNIT = 1
+    NORMAL_DEPTH_UNIT = 2
+    INPUT_UNIT = 3
+    OUTPUT_UNIT = 4
+
+    def __init__(self, shader_program: ShaderProgram, resolution, iterations, color_sigma):
+        """
+        :param iterations: filter radius is 2^iterations pixels
+        :param color_sigma: color sigma of the first iteration for pixels with one sample, it's halved every iteration
+        """
+        if iterations < 1:
+            raise ValueError(f"Denoiser needs at least one iteration, got {iterations}")
+
+        self.shader = shader_program
+        self.resolution = resolution
+        self.iterations = iterations
+        self.color_sigma = color_sigma
+
+        self.albedo = ColorTarget(resolution, GL_RGBA16F)
+        self.normal_depth = ColorTarget(resolution, GL_RGBA32F)
+        glBindImageTexture(self.ALBEDO_UNIT, self.albedo.texture, 0, GL_FALSE, 0, GL_READ_WRITE, GL_RGBA16F)
+        glBindImageTexture(self.NORMAL_DEPTH_UNIT, self.normal_depth.texture, 0, GL_FALSE, 0, GL_READ_WRITE, GL_RGBA32F)
+
+        # Iterations alternate between them
+        self.targets = ColorTarget(resolution), ColorTarget(resolution)
+
+    def render(self, texture):
+        """
+        Filters RGBA32F texture and blits the result to the screen
+        """
+        self.shader.use()
+        # Color and features are written by the tracer
+        glMemoryBarrier(GL_SHADER_IMAGE_ACCESS_BARRIER_BIT)
+
+        width, height = self.resolution
+        step_width = self.shader.uniform_location("stepWidth")
+        color_sigma = self.shader.uniform_location("colorSigma")
+
+        target = None
+        for i in range(self.iterations):
+            target = self.targets[i % 2]
+            glBindImageTexture(self.INPUT_UNIT, texture, 0, GL_FALSE, 0, GL_READ_ONLY, GL_RGBA32F)
+            glBindImageTexture(self.OUTPUT_UNIT, target.texture, 0, GL_FALSE, 0, GL_WRITE_ONLY, GL_RGBA32F)
+            glUniform1i(step_width, 1 << i)
+            glUniform1f(color_sigma, self.color_sigma / (1 << i))
+            glDispatchCompute(-(-width // self.LOCAL_SIZE), -(-height // self.LOCAL_SIZE), 1)
+            glMemoryBarrier(GL_SHADER_IMAGE_ACCESS_BARRIER_BIT | GL_FRAMEBUFFER_BARRIER_BIT)
+            texture = target.texture
+
+        target.blit()
+
+
 class Renderer:
-    def __init__(self, shader_program: ShaderProgram, mesh: MeshGroup, logic_provider=None):
+    def __init__(self, shader_program: ShaderProgram, mesh: MeshGroup, logic_provider=None, denoiser: Denoiser = None,
+                 resolution=None):
+        """
+        :param denoiser: image is drawn into a texture and filtered by it instead of being drawn to the screen
+        :param resolution: native resolution, needed to render at lower internal resolution, see set_internal_resolution
+        """
         self.shader = shader_program
         self.mesh = mesh
         self.logic_provider = logic_provider
-
-    def render(self):
-        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        self.denoiser = denoiser
+        if resolution is None and denoiser is not None:
+            resolution = denoiser.resolution
+        self.resolution = tuple(resolution) if resolution is not None else None
+        self.internal_resolution = self.resolution
+        self.__target = None
+
+    @property
+    def target(self):
+        """
+        Offscreen image of the denoiser and of frames at lower resolution, allocated when one of them is drawn
+        """
+        if self.__target is None:
+            self.__target = ColorTarget(self.resolution)
+        return self.__target
+
+    def set_internal_resolution(self, resolution):
+        """
+        Following frames are drawn at resolution into the corner of a texture and upscaled to the screen
+        without the denoiser, the native resolution draws them as usual
+        """
+        if self.resolution is None:
+            raise RuntimeError("Renderer without native resolution can't change it")
+        self.internal_resolution = tuple(resolution)
+        if self.logic_provider is not None:
+            self.logic_provider.set_resolution(self.internal_resolution)
+
+    def render(self, present=True):
+        """
+        :param present: whether the image is going to be shown, the denoiser and upscaling are skipped otherwise
+        """
+        scaled = self.internal_resolution != self.resolution
+        if self.denoiser is not None or scaled:
+            glBindFramebuffer(GL_DRAW_FRAMEBUFFER, self.target.framebuffer)
+        if scaled:
+            glViewport(0, 0, *self.internal_resolution)
+        # The quad covers every pixel of the viewport, so nothing is cleared. Mesa 22 llvmpipe also flips gl_FragCoord
+        # of the first draw into a texture if the default framebuffer was cleared before it
+
+        # Scene specializes the program when it's loaded, so it's used after that and no generic variant is linked
+        if self.logic_provider is not None:
+            self.logic_provider.render()
         self.shader.use()
 
+        with profiler.stage('trace', gpu=True):
+            self.mesh.draw()
+
+        if scaled:
+            glViewport(0, 0, *self.resolution)
+            glBindFramebuffer(GL_DRAW_FRAMEBUFFER, 0)
+            if present:
+                with profiler.stage('present', gpu=True):
+                    self.target.blit(self.internal_resolution)
+        elif self.denoiser is not None:
+            glBindFramebuffer(GL_DRAW_FRAMEBUFFER, 0)
+            if present:
+                with profiler.stage('present', gpu=True):
+                    self.denoiser.render(self.target.texture)
+
+
+class ComputeRenderer:
+    """
+    Traces the image with compute shader into accumulation texture tile by tile and blits it to the screen,
+    through denoiser if there's one
+    """
+
+    LOCAL_SIZE = 8
+
+    def __init__(self, shader_program: ShaderProgram, resolution, tile_size, samples, logic_provider=None,
+                 denoiser: Denoiser = None):
+        self.shader = shader_program
+        self.resolution = resolution
+        self.tile_size = tile_size
+        self.samples = samples
+        self.logic_provider = logic_provider
+        self.denoiser = denoiser
+        self.internal_resolution = tuple(resolution)
+
+        self.accumulation = ColorTarget(resolution)
+        glBindImageTexture(0, self.accumulation.texture, 0, GL_FALSE, 0, GL_READ_WRITE, GL_RGBA32F)
+
+        self.shader.set_uniform("samples", samples)
+
+    def set_internal_resolution(self, resolution):
+        """
+        Following frames are traced at resolution into the corner of the accumulation texture and upscaled
+        to the screen without the denoiser, the native resolution draws them as usual
+        """
+        self.internal_resolution = tuple(resolution)
+        if self.logic_provider is not None:
+            self.logic_provider.set_resolution(self.internal_resolution)
+
+    def render(self, present=True):
+        """
+        :param present: whether to draw the accumulated image to the screen, passes that aren't shown only trace
+        """
         if self.logic_provider is not None:
             self.logic_provider.render()
+        self.shader.use()
+
+        width, height = self.internal_resolution
+        groups = self.tile_size // self.LOCAL_SIZE
+        tile_offset = self.shader.uniform_location("tileOffset")
+
+        with profiler.stage('trace', gpu=True):
+            # Small dispatches keep every one of them well below driver watchdog timeouts
+            for y in range(0, height, self.tile_size):
+                for x in range(0, width, self.tile_size):
+                    glUniform2i(tile_offset, x, y)
+                    glDispatchCompute(groups, groups, 1)
 
-        self.mesh.draw()
+            glMemoryBarrier(GL_SHADER_IMAGE_ACCESS_BARRIER_BIT | GL_FRAMEBUFFER_BARRIER_BIT)
+
+        if not present:
+            return
+        with profiler.stage('present', gpu=True):
+            if self.internal_resolution != tuple(self.resolution):
+                self.accumulation.blit(self.internal_resolution)
+            elif self.denoiser is not None:
+                self.denoiser.render(self.accumulation.texture)
+            else:
+                self.accumulation.blit()
 
 
 class MovementEventHandler:
-    def __init__(self, shader, mouse_sensitivity, keyboard_sensitivity):
+    # Names of keys as returned by pygame.key.name that move the camera, see handle_keydown_event
+    KEYS = ('w', 's', 'a', 'd', 'space', 'left shift')
+
+    def __init__(self, frame_state: FrameState, mouse_sensitivity, keyboard_sensitivity):
         self.sensitivity = mouse_sensitivity
-        self.shader = shader
+        self.frame_state = frame_state
         self.rotation_quat = glm.quat(1, 0, 0, 0)
 
         self.keyboard_sensitivity = keyboard_sensitivity
         self.position_vec = glm.vec3(0, 0, -1)
 
+    @staticmethod
+    def held_keys():
+        """
+        :return: names of KEYS held right now
+        """
+        pressed = pygame.key.get_pressed()
+        return {name for name in MovementEventHandler.KEYS if pressed[pygame.key.key_code(name)]}
+
     def handle_mouse_event(self, movement):
         yaw, pitch = movement
         yaw *= self.sensitivity
@@ -100,10 +668,16 @@ class MovementEventHandler:
         pitch_quat = glm.angleAxis(pitch, right_vector)
         self.rotation_quat = pitch_quat * self.rotation_quat
 
-        rotation_matrix = glm.mat3_cast(self.rotation_quat)
-        glUniformMatrix3fv(glGetUniformLocation(self.shader.program, "rotationMatrix"), 1, GL_FALSE, glm.value_ptr(rotation_matrix))
+        self.frame_state.rotation_matrix = glm.mat3_cast(self.rotation_quat)
+
+    def handle_keydown_event(self, keys=None):
+        """
+        Moves the camera one step in the direction of held keys
+        :param keys: names of held keys, polled from pygame if None
+        """
+        if keys is None:
+            keys = MovementEventHandler.held_keys()
 
-    def handle_keydown_event(self):
         forward = glm.normalize(self.rotation_quat * glm.vec3(0, 0, 1))
         right = glm.normalize(self.rotation_quat * glm.vec3(1, 0, 0))
         forward.y = 0
@@ -112,24 +686,38 @@ class MovementEventHandler:
         right = glm.normalize(right)
         up = glm.vec3(0, 1, 0)
 
-        keys = pygame.key.get_pressed()
-
         movement_vector = glm.vec3()
 
-        if keys[pygame.K_w]:
+        if 'w' in keys:
             movement_vector += forward
-        if keys[pygame.K_s]:
+        if 's' in keys:
             movement_vector -= forward
-        if keys[pygame.K_a]:
+        if 'a' in keys:
             movement_vector -= right
-        if keys[pygame.K_d]:
+        if 'd' in keys:
             movement_vector += right
-        if keys[pygame.K_SPACE]:
+        if 'space' in keys:
             movement_vector += up
-        if keys[pygame.K_LSHIFT]:
+        if 'left shift' in keys:
             movement_vector -= up
 
         if glm.length(movement_vector) != 0:
             self.position_vec += glm.normalize(movement_vector) * self.keyboard_sensitivity
 
-        glUniform3fv(glGetUniformLocation(self.shader.program, "position"), 1, glm.value_ptr(self.position_vec))
+        self.frame_state.position = self.position_vec
+
+    def handle_frame_input(self, frame_input):
+        """
+        Applies all input of a frame at once
+        :param frame_input: frame_loop.FrameInput
+        :return: whether the camera has moved
+        """
+        moved = False
+        if frame_input.mouse_movement != (0, 0):
+            self.handle_mouse_event(frame_input.mouse_movement)
+            moved = True
+        if frame_input.keys:
+            before = glm.vec3(self.position_vec)
+            self.handle_keydown_event(frame_input.keys)
+            moved |= self.position_vec != before
+        return moved
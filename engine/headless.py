@@ -0,0 +1,148 @@
+import os
+import ctypes
+import ctypes.util
+
+# PyOpenGL picks the platform on the first `import OpenGL.GL`, so OpenGL is only imported inside the contexts
+PLATFORMS = ('egl', 'osmesa')
+# Library PyOpenGL loads for every platform
+LIBRARIES = {'egl': 'EGL', 'osmesa': 'OSMesa'}
+
+
+def select_platform(platform, software=False):
+    """
+    Must be called before OpenGL.GL is imported anywhere
+    :param platform: 'egl' for pbuffer surface, 'osmesa' for rendering into client memory
+    :param software: force Mesa's llvmpipe rasterizer, works on machines without GPU
+    """
+    if platform not in PLATFORMS:
+        raise ValueError(f"Unknown headless platform {platform}, expected one of {PLATFORMS}")
+    # Without it PyOpenGL fails on import with an unrelated AttributeError
+    if ctypes.util.find_library(LIBRARIES[platform]) is None:
+        other = next(other for other in PLATFORMS if other != platform)
+        raise RuntimeError(f"lib{LIBRARIES[platform]} isn't installed, install it or use --platform {other}")
+
+    os.environ['PYOPENGL_PLATFORM'] = platform
+    if software:
+        os.environ['LIBGL_ALWAYS_SOFTWARE'] = '1'
+        os.environ['GALLIUM_DRIVER'] = 'llvmpipe'
+    if platform == 'egl' and 'DISPLAY' not in os.environ and 'WAYLAND_DISPLAY' not in os.environ:
+        # Mesa's default EGL platform needs X11 or Wayland
+        os.environ.setdefault('EGL_PLATFORM', 'surfaceless')
+
+
+class HeadlessContext:
+    """
+    OpenGL 4.6 core context with default framebuffer of the given resolution and no window
+    """
+
+    GL_VERSION = (4, 6)
+
+    def __init__(self, resolution):
+        self.resolution = resolution
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.destroy()
+
+    def destroy(self):
+        raise NotImplementedError
+
+    @staticmethod
+    def create(platform, resolution):
+        if platform == 'egl':
+            return EglContext(resolution)
+        if platform == 'osmesa':
+            return OsMesaContext(resolution)
+        raise ValueError(f"Unknown headless platform {platform}, expected one of {PLATFORMS}")
+
+
+class EglContext(HeadlessContext):
+    def __init__(self, resolution):
+        super().__init__(resolution)
+        from OpenGL import EGL
+        self.egl = EGL
+
+        self.display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        major, minor = EGL.EGLint(), EGL.EGLint()
+        if not EGL.eglInitialize(self.display, ctypes.pointer(major), ctypes.pointer(minor)):
+            raise RuntimeError("EGL display initialization failure")
+
+        config = EGL.EGLConfig()
+        configs_count = EGL.EGLint()
+        EGL.eglChooseConfig(self.display, EglContext.attributes(
+            EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+            EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+            EGL.EGL_RED_SIZE, 8,
+            EGL.EGL_GREEN_SIZE, 8,
+            EGL.EGL_BLUE_SIZE, 8,
+            EGL.EGL_DEPTH_SIZE, 24,
+        ), ctypes.pointer(config), 1, ctypes.pointer(configs_count))
+        if configs_count.value == 0:
+            raise RuntimeError("No EGL config with OpenGL pbuffer support")
+
+        width, height = resolution
+        self.surface = EGL.eglCreatePbufferSurface(self.display, config, EglContext.attributes(
+            EGL.EGL_WIDTH, width,
+            EGL.EGL_HEIGHT, height,
+        ))
+
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+        self.context = EGL.eglCreateContext(self.display, config, EGL.EGL_NO_CONTEXT, EglContext.attributes(
+            EGL.EGL_CONTEXT_MAJOR_VERSION, self.GL_VERSION[0],
+            EGL.EGL_CONTEXT_MINOR_VERSION, self.GL_VERSION[1],
+            EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK, EGL.EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT,
+        ))
+        if self.context == EGL.EGL_NO_CONTEXT:
+            raise RuntimeError(f"EGL can't create OpenGL {self.GL_VERSION[0]}.{self.GL_VERSION[1]} core context")
+
+        EGL.eglMakeCurrent(self.display, self.surface, self.surface, self.context)
+
+    @staticmethod
+    def attributes(*values):
+        """
+        :return: EGL_NONE terminated attribute list
+        """
+        from OpenGL import EGL
+        values = (*values, EGL.EGL_NONE)
+        return (EGL.EGLint * len(values))(*values)
+
+    def destroy(self):
+        EGL = self.egl
+        EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+        EGL.eglDestroyContext(self.display, self.context)
+        EGL.eglDestroySurface(self.display, self.surface)
+        EGL.eglTerminate(self.display)
+
+
+class OsMesaContext(HeadlessContext):
+    """
+    Renders into memory owned by Python, needs Mesa built with OSMesa (it was dropped in Mesa 25.1)
+    """
+
+    def __init__(self, resolution):
+        super().__init__(resolution)
+        from OpenGL import osmesa, arrays
+        from OpenGL.GL import GL_UNSIGNED_BYTE
+        self.osmesa = osmesa
+
+        attributes = [
+            osmesa.OSMESA_FORMAT, osmesa.OSMESA_RGBA,
+            osmesa.OSMESA_DEPTH_BITS, 24,
+            osmesa.OSMESA_PROFILE, osmesa.OSMESA_CORE_PROFILE,
+            osmesa.OSMESA_CONTEXT_MAJOR_VERSION, self.GL_VERSION[0],
+            osmesa.OSMESA_CONTEXT_MINOR_VERSION, self.GL_VERSION[1],
+            0,
+        ]
+        self.context = osmesa.OSMesaCreateContextAttribs((ctypes.c_int * len(attributes))(*attributes), None)
+        if not self.context:
+            raise RuntimeError(f"OSMesa can't create OpenGL {self.GL_VERSION[0]}.{self.GL_VERSION[1]} core context")
+
+        width, height = resolution
+        self.buffer = arrays.GLubyteArray.zeros((height, width, 4))
+        if not osmesa.OSMesaMakeCurrent(self.context, self.buffer, GL_UNSIGNED_BYTE, width, height):
+            raise RuntimeError("OSMesa can't bind the framebuffer")
+
+    def destroy(self):
+        self.osmesa.OSMesaDestroyContext(self.context)
@@ -1,6 +1,23 @@
+import argparse
+import functools
+
 import shader
 import demo
+import scene_file
 
 
 if __name__ == "__main__":
-    shader.main(demo.ExampleSceneLoader)
+    parser = argparse.ArgumentParser(description="Opens scene in a window, demo.ExampleSceneLoader by default")
+    parser.add_argument('scene', nargs='?', help="binary scene file")
+    parser.add_argument('--record', metavar='TRACE', help="writes input of every frame to a trace for replay.py")
+    parser.add_argument('--capture', metavar='PATTERN',
+                        help="writes every presented frame, e.g. frames/{:05d}.jpg, format is taken from the extension")
+    parser.add_argument('--profile', metavar='PATH',
+                        help="times stages of every frame, percentiles are written as CSV or JSON by the extension")
+    args = parser.parse_args()
+
+    if args.scene is not None:
+        shader.main(functools.partial(scene_file.BinarySceneLoader, path=args.scene),
+                    args.record, args.capture, args.profile)
+    else:
+        shader.main(demo.ExampleSceneLoader, args.record, args.capture, args.profile)
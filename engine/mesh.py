@@ -0,0 +1,423 @@
+import os
+import re
+import sys
+import json
+import struct
+import hashlib
+
+import numpy as np
+
+from cache import file_hash, cache_path, save_array
+from scene import SceneLoader, Material, Color
+
+
+class MeshMaterial:
+    __slots__ = ('name', 'color', 'roughness', 'transparent', 'optical_density', 'dispersion_coefficient')
+
+    def __init__(self, name, color=(0.8, 0.8, 0.8), roughness=1.0, transparent=False, optical_density=1.0,
+                 dispersion_coefficient=0.0):
+        """
+        :param dispersion_coefficient: see scene.Material, 0 unless the file specifies dispersion
+        """
+        self.name = name
+        self.color = tuple(color)
+        self.roughness = roughness
+        self.transparent = transparent
+        self.optical_density = optical_density
+        self.dispersion_coefficient = dispersion_coefficient
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class TriangleMesh:
+    def __init__(self, vertices: np.ndarray, material_ids: np.ndarray, materials: list[MeshMaterial]):
+        """
+        :param vertices: array of shape (N, 3, 3) - three vertices of every triangle
+        :param material_ids: array of shape (N,) - index in materials, -1 if triangle has no material
+        """
+        self.vertices = vertices
+        self.material_ids = material_ids
+        self.materials = materials
+
+
+class ObjParser:
+    # Size of text read at once, lines of a chunk are parsed with a few NumPy calls
+    CHUNK_SIZE = 1 << 22
+
+    TEXTURE_AND_NORMAL_INDICES = re.compile(r'/\S*')
+    # Looked up in the whole file on every load for the cache key. Starting with a literal lets the regex skip
+    # to candidates instead of splitting every line
+    MATERIAL_LIBRARY = re.compile(rb'\nmtllib[ \t]+([^\r\n]*)')
+
+    def __init__(self, path):
+        self.path = path
+        self.materials = []
+        self.material_names = {}
+
+    def parse(self):
+        vertex_count = 0
+        vertices = []
+        triangles = []
+        triangle_materials = []
+        material = -1
+
+        with open(self.path, 'r', encoding='utf-8', errors='replace') as file:
+            while lines := file.readlines(self.CHUNK_SIZE):
+                vertex_lines = []
+                face_lines = []
+                # Vertex count and material at the moment every face is declared
+                face_vertex_counts = []
+                face_materials = []
+
+                for line in lines:
+                    if line.startswith('v '):
+                        vertex_lines.append(' '.join(line.split(None, 4)[1:4]))
+                    elif line.startswith('f '):
+                        face_lines.append(line[2:])
+                        face_vertex_counts.append(vertex_count + len(vertex_lines))
+                        face_materials.append(material)
+                    elif line.startswith('usemtl'):
+                        material = self.__material_id(line.split(None, 1)[1].strip())
+                    elif line.startswith('mtllib'):
+                        self.__load_mtl(line.split(None, 1)[1].strip())
+
+                if vertex_lines:
+                    chunk = np.array(' '.join(vertex_lines).split(), dtype=np.float32)
+                    vertices.append(chunk.reshape(-1, 3))
+                    vertex_count += len(vertex_lines)
+
+                if face_lines:
+                    chunk_triangles, chunk_faces = ObjParser.__triangulate(face_lines, np.array(face_vertex_counts))
+                    triangles.append(chunk_triangles)
+                    triangle_materials.append(np.array(face_materials, dtype=np.int32)[chunk_faces])
+
+        if not triangles:
+            return TriangleMesh(np.zeros((0, 3, 3), dtype=np.float32), np.zeros(0, dtype=np.int32), self.materials)
+
+        vertices = np.concatenate(vertices)
+        triangles = np.concatenate(triangles)
+        return TriangleMesh(vertices[triangles], np.concatenate(triangle_materials), self.materials)
+
+    @staticmethod
+    def __triangulate(face_lines, face_vertex_counts):
+        """
+        Fan-triangulates polygons
+        :return: (0-based vertex indices of shape (T, 3), index of source face of every triangle)
+        """
+        arity = np.array([len(line.split()) for line in face_lines])
+        text = ObjParser.TEXTURE_AND_NORMAL_INDICES.sub('', ' '.join(face_lines))
+        indices = np.array(text.split(), dtype=np.int64)
+
+        # Negative indices are relative to the last vertex defined before the face
+        counts = np.repeat(face_vertex_counts, arity)
+        indices = np.where(indices < 0, counts + indices, indices - 1)
+
+        triangles_per_face = np.maximum(arity - 2, 0)
+        faces = np.repeat(np.arange(len(face_lines)), triangles_per_face)
+        first = np.repeat(np.cumsum(triangles_per_face) - triangles_per_face, triangles_per_face)
+        corner = np.arange(len(faces)) - first + 1
+        base = (np.cumsum(arity) - arity)[faces]
+
+        triangles = np.stack((indices[base], indices[base + corner], indices[base + corner + 1]), axis=1)
+        return triangles, faces
+
+    def __material_id(self, name):
+        if name not in self.material_names:
+            self.material_names[name] = len(self.materials)
+            self.materials.append(MeshMaterial(name))
+        return self.material_names[name]
+
+    @staticmethod
+    def dependencies(path):
+        """
+        :return: paths of material libraries the file references, whether they exist or not
+        """
+        names = []
+        # Every line is searched with the newline before it, the first one included
+        rest = b''
+        with open(path, 'rb') as file:
+            while chunk := file.read(ObjParser.CHUNK_SIZE):
+                lines, _, rest = (b'\n' + rest + chunk).rpartition(b'\n')
+                names += ObjParser.MATERIAL_LIBRARY.findall(lines)
+        names += ObjParser.MATERIAL_LIBRARY.findall(b'\n' + rest)
+        return [ObjParser.__mtl_path(path, name.strip().decode('utf-8', errors='replace')) for name in names]
+
+    @staticmethod
+    def __mtl_path(path, name):
+        return os.path.join(os.path.dirname(path), name)
+
+    def __load_mtl(self, name):
+        path = ObjParser.__mtl_path(self.path, name)
+        if not os.path.exists(path):
+            return
+
+        material = None
+        with open(path, 'r', encoding='utf-8', errors='replace') as file:
+            for line in file:
+                tokens = line.split()
+                if not tokens:
+                    continue
+
+                key, values = tokens[0], tokens[1:]
+                if key == 'newmtl':
+                    material = self.materials[self.__material_id(' '.join(values))]
+                elif material is None:
+                    continue
+                elif key == 'Kd':
+                    material.color = tuple(float(value) for value in values[:3])
+                elif key == 'Ns':
+                    # Phong exponent to roughness, see "Microfacet Models for Refraction" (Walter et al.)
+                    material.roughness = min(1.0, (2.0 / (float(values[0]) + 2.0)) ** 0.5)
+                elif key == 'Pr':
+                    material.roughness = float(values[0])
+                elif key == 'Ni':
+                    material.optical_density = float(values[0])
+                elif key == 'd':
+                    material.transparent |= float(values[0]) < 1.0
+                elif key == 'Tr':
+                    material.transparent |= float(values[0]) > 0.0
+                elif key == 'illum':
+                    material.transparent |= int(values[0]) in (4, 6, 7, 9)
+
+
+class GlbParser:
+    MAGIC = b'glTF'
+    JSON_CHUNK = 0x4E4F534A
+    BIN_CHUNK = 0x004E4942
+    TRIANGLES_MODE = 4
+
+    COMPONENT_TYPES = {
+        5121: np.uint8,
+        5123: np.uint16,
+        5125: np.uint32,
+        5126: np.float32,
+    }
+    TYPE_SIZES = {'SCALAR': 1, 'VEC3': 3}
+
+    def __init__(self, path):
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+
+        magic, version, _ = struct.unpack_from('<4sII', self.data, 0)
+        if magic != self.MAGIC or version != 2:
+            raise ValueError(f"{path} is not a glTF 2.0 binary")
+
+        self.json = None
+        self.bin_offset = None
+        offset = 12
+        while offset < len(self.data):
+            length, chunk_type = struct.unpack_from('<II', self.data, offset)
+            if chunk_type == self.JSON_CHUNK:
+                self.json = json.loads(self.data[offset + 8:offset + 8 + length].tobytes())
+            elif chunk_type == self.BIN_CHUNK:
+                self.bin_offset = offset + 8
+            offset += 8 + length
+
+    def parse(self):
+        materials = [GlbParser.__material(i, material) for i, material in enumerate(self.json.get('materials', []))]
+        vertices = []
+        material_ids = []
+
+        stack = [(node, np.identity(4)) for node in self.__root_nodes()]
+        while stack:
+            index, parent_transform = stack.pop()
+            node = self.json['nodes'][index]
+            transform = parent_transform @ GlbParser.__node_transform(node)
+            stack += [(child, transform) for child in node.get('children', [])]
+
+            if 'mesh' not in node:
+                continue
+
+            for primitive in self.json['meshes'][node['mesh']]['primitives']:
+                if primitive.get('mode', self.TRIANGLES_MODE) != self.TRIANGLES_MODE:
+                    continue
+
+                positions = self.__accessor(primitive['attributes']['POSITION'])
+                positions = positions @ transform[:3, :3].T + transform[:3, 3]
+                if 'indices' in primitive:
+                    indices = self.__accessor(primitive['indices']).reshape(-1, 3)
+                else:
+                    indices = np.arange(len(positions)).reshape(-1, 3)
+
+                vertices.append(positions[indices].astype(np.float32))
+                material_ids.append(np.full(len(indices), primitive.get('material', -1), dtype=np.int32))
+
+        if not vertices:
+            return TriangleMesh(np.zeros((0, 3, 3), dtype=np.float32), np.zeros(0, dtype=np.int32), materials)
+
+        return TriangleMesh(np.concatenate(vertices), np.concatenate(material_ids), materials)
+
+    @staticmethod
+    def dependencies(path):
+        return []
+
+    def __root_nodes(self):
+        if 'scenes' in self.json:
+            return self.json['scenes'][self.json.get('scene', 0)].get('nodes', [])
+
+        # Without scenes every node that isn't a child of another one is a root
+        nodes = self.json.get('nodes', [])
+        children = {child for node in nodes for child in node.get('children', [])}
+        return [index for index in range(len(nodes)) if index not in children]
+
+    def __accessor(self, index):
+        accessor = self.json['accessors'][index]
+        view = self.json['bufferViews'][accessor['bufferView']]
+        dtype = np.dtype(self.COMPONENT_TYPES[accessor['componentType']])
+        components = self.TYPE_SIZES[accessor['type']]
+
+        offset = self.bin_offset + view.get('byteOffset', 0) + accessor.get('byteOffset', 0)
+        stride = view.get('byteStride', dtype.itemsize * components)
+        data = np.ndarray((accessor['count'], components), dtype=dtype, buffer=self.data,
+                          offset=offset, strides=(stride, dtype.itemsize))
+        return data if components > 1 else data.ravel()
+
+    @staticmethod
+    def __node_transform(node):
+        if 'matrix' in node:
+            return np.array(node['matrix'], dtype=np.float64).reshape(4, 4).T
+
+        x, y, z, w = node.get('rotation', (0.0, 0.0, 0.0, 1.0))
+        rotation = np.array([
+            [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+            [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+            [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)],
+        ])
+
+        transform = np.identity(4)
+        transform[:3, :3] = rotation * np.array(node.get('scale', (1.0, 1.0, 1.0)))
+        transform[:3, 3] = node.get('translation', (0.0, 0.0, 0.0))
+        return transform
+
+    @staticmethod
+    def __material(index, material):
+        pbr = material.get('pbrMetallicRoughness', {})
+        extensions = material.get('extensions', {})
+        transparent = material.get('alphaMode') == 'BLEND' or 'KHR_materials_transmission' in extensions
+        optical_density = extensions.get('KHR_materials_ior', {}).get('ior', 1.5 if transparent else 1.0)
+        return MeshMaterial(
+            material.get('name', str(index)),
+            color=pbr.get('baseColorFactor', (1.0, 1.0, 1.0, 1.0))[:3],
+            roughness=pbr.get('roughnessFactor', 1.0),
+            transparent=transparent,
+            optical_density=optical_density,
+            dispersion_coefficient=GlbParser.dispersion_coefficient(
+                optical_density, extensions.get('KHR_materials_dispersion', {}).get('dispersion', 0.0)),
+        )
+
+    @staticmethod
+    def dispersion_coefficient(ior, dispersion):
+        """
+        :param dispersion: of KHR_materials_dispersion, 20 / Abbe number
+        :return: coefficient whose red to blue spread of optical density, 0.4 of it in trace.glsl,
+                 is n_F - n_C = (ior - 1) / Abbe number
+        """
+        return (ior - 1.0) * dispersion / 20.0 / 0.4
+
+
+# Part of the cache key, changed whenever parsing results change so older cache entries are parsed again
+CACHE_VERSION = 2
+
+PARSERS = {
+    '.obj': ObjParser,
+    '.glb': GlbParser,
+}
+
+
+def cache_key(path, parser):
+    """
+    :return: hash of the mesh file and of the files it references, a missing one hashes differently than any content
+    """
+    digest = hashlib.sha256(f'{CACHE_VERSION}:{file_hash(path)}'.encode())
+    for dependency in parser.dependencies(path):
+        digest.update(os.path.basename(dependency).encode())
+        digest.update(file_hash(dependency).encode() if os.path.exists(dependency) else b'missing')
+    return digest.hexdigest()
+
+
+def load_mesh(path, cache=True):
+    """
+    Parses mesh or reads it from the cache, cached arrays are memory-mapped
+    """
+    parser = PARSERS.get(os.path.splitext(path)[1].lower())
+    if parser is None:
+        raise ValueError(f"Unsupported mesh format: {path}")
+
+    if not cache:
+        return parser(path).parse()
+
+    entry = cache_path('meshes', cache_key(path, parser))
+    vertices_path = entry + '.vertices.npy'
+    material_ids_path = entry + '.materials.npy'
+    materials_path = entry + '.json'
+
+    if os.path.exists(materials_path):
+        with open(materials_path, 'r') as file:
+            materials = [MeshMaterial(**material) for material in json.load(file)]
+        return TriangleMesh(np.load(vertices_path, mmap_mode='r'), np.load(material_ids_path, mmap_mode='r'), materials)
+
+    mesh = parser(path).parse()
+
+    save_array(vertices_path, mesh.vertices)
+    save_array(material_ids_path, mesh.material_ids)
+    # Written last as it marks the cache entry complete
+    with open(materials_path, 'w') as file:
+        json.dump([material.as_dict() for material in mesh.materials], file)
+
+    return mesh
+
+
+def mesh_material_indices(scene_loader: SceneLoader, mesh: TriangleMesh, default_material: Material = None):
+    """
+    Creates materials of the mesh in the scene
+    :param default_material: material of triangles without one, created if needed
+    :return: material index of every triangle
+    """
+    lookup = [
+        Material(Color(*material.color), material.roughness, scene_loader, transparent=material.transparent,
+                 optical_density=material.optical_density,
+                 dispersion_coefficient=material.dispersion_coefficient).index
+        for material in mesh.materials
+    ]
+    if np.any(mesh.material_ids < 0):
+        if default_material is None:
+            default_material = Material(Color(0.8, 0.8, 0.8), 1.0, scene_loader)
+        # -1 picks the last element
+        lookup.append(default_material.index)
+
+    return np.array(lookup, dtype=np.int32)[mesh.material_ids]
+
+
+def import_mesh(scene_loader: SceneLoader, path, transform: np.ndarray = None, default_material: Material = None):
+    """
+    Adds triangles of mesh file to the scene, must be called before the first render
+    :param transform: 4x4 matrix applied to mesh vertices
+    :param default_material: material of triangles without one, created if needed
+    """
+    mesh = load_mesh(path)
+    materials = mesh_material_indices(scene_loader, mesh, default_material)
+
+    vertices = mesh.vertices
+    if transform is not None:
+        transform = np.asarray(transform, dtype=np.float32)
+        vertices = vertices @ transform[:3, :3].T + transform[:3, 3]
+
+    scene_loader.add_triangles(vertices, materials)
+
+
+def import_instanced_mesh(scene_loader: SceneLoader, path, default_material: Material = None):
+    """
+    Stores mesh file once in the scene, its copies are placed with SceneLoader.add_instances.
+    Must be called before the first render
+    :param default_material: material of triangles without one, created if needed
+    :return: index of the mesh for add_instances
+    """
+    mesh = load_mesh(path)
+    return scene_loader.add_mesh(mesh.vertices, mesh_material_indices(scene_loader, mesh, default_material))
+
+
+if __name__ == "__main__":
+    # Parses mesh into the cache ahead of time: python3 mesh.py model.obj
+    for mesh_path in sys.argv[1:]:
+        load_mesh(mesh_path)
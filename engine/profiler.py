@@ -0,0 +1,220 @@
+import os
+import csv
+import json
+import time
+import contextlib
+from collections import deque
+
+import numpy as np
+
+import config
+
+# Clocks a stage is timed with, GPU time is measured by GL_TIME_ELAPSED queries
+CLOCKS = ('cpu', 'gpu')
+PERCENTILES = (50, 95, 99)
+
+
+class RingBuffer:
+    """
+    Last capacity values, older ones are overwritten
+    """
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError(f"Ring buffer capacity must be positive, got {capacity}")
+        self.data = np.zeros(capacity, dtype=np.float64)
+        self.next = 0
+        self.count = 0
+
+    def append(self, value):
+        self.data[self.next] = value
+        self.next = (self.next + 1) % len(self.data)
+        self.count = min(self.count + 1, len(self.data))
+
+    def values(self):
+        """
+        :return: stored values from the oldest one
+        """
+        if self.count < len(self.data):
+            return self.data[:self.count].copy()
+        return np.roll(self.data, -self.next)
+
+
+class StageStats:
+    """
+    Recent timings of every stage and clock and their percentiles, needs no OpenGL
+    """
+
+    def __init__(self, capacity=config.PROFILE_HISTORY):
+        """
+        :param capacity: timings kept per stage and clock
+        """
+        self.capacity = capacity
+        # (stage, clock) -> RingBuffer of seconds, in the order stages were first recorded
+        self.timings = {}
+
+    def add(self, stage, clock, seconds):
+        if clock not in CLOCKS:
+            raise ValueError(f"Unknown clock {clock}, expected one of {CLOCKS}")
+        key = (stage, clock)
+        if key not in self.timings:
+            self.timings[key] = RingBuffer(self.capacity)
+        self.timings[key].append(seconds)
+
+    def values(self, stage, clock):
+        """
+        :return: seconds of the recorded timings from the oldest one
+        """
+        timings = self.timings.get((stage, clock))
+        return timings.values() if timings is not None else np.zeros(0)
+
+    def summary(self):
+        """
+        :return: {stage: {clock: {'count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms'}}}
+        """
+        result = {}
+        for (stage, clock), timings in self.timings.items():
+            milliseconds = timings.values() * 1E3
+            metrics = {'count': len(milliseconds), 'mean_ms': float(milliseconds.mean())}
+            for percentile, value in zip(PERCENTILES, np.percentile(milliseconds, PERCENTILES)):
+                metrics[f'p{percentile}_ms'] = float(value)
+            metrics['max_ms'] = float(milliseconds.max())
+            result.setdefault(stage, {})[clock] = metrics
+        return result
+
+    def write(self, path):
+        """
+        Writes the summary, as CSV with a row per stage and clock if path ends with .csv, as JSON otherwise
+        """
+        summary = self.summary()
+        if os.path.splitext(path)[1].lower() != '.csv':
+            with open(path, 'w') as file:
+                json.dump(summary, file, indent=2)
+            return
+
+        with open(path, 'w', newline='') as file:
+            writer = None
+            for stage, clocks in summary.items():
+                for clock, metrics in clocks.items():
+                    if writer is None:
+                        writer = csv.DictWriter(file, ['stage', 'clock', *metrics])
+                        writer.writeheader()
+                    writer.writerow({'stage': stage, 'clock': clock, **metrics})
+
+    def overlay_text(self):
+        """
+        :return: one line of median milliseconds of every stage, GPU time in brackets
+        """
+        summary = self.summary()
+        parts = []
+        for stage, clocks in summary.items():
+            text = f"{stage} {clocks['cpu']['p50_ms']:.2f}" if 'cpu' in clocks else stage
+            if 'gpu' in clocks:
+                text += f" [{clocks['gpu']['p50_ms']:.2f}]"
+            parts.append(text)
+        return ' | '.join(parts) + ' ms'
+
+
+class Profiler:
+    """
+    Times stages of a frame on CPU and optionally on GPU. GPU timer queries are read only once their results are
+    available, at the end of a later frame, so they never wait for GPU
+    """
+
+    def __init__(self, gpu=config.PROFILE_GPU, capacity=config.PROFILE_HISTORY):
+        """
+        :param gpu: time stages started with gpu=True by GL_TIME_ELAPSED queries, needs current OpenGL context
+        """
+        self.stats = StageStats(capacity)
+        self.gl = None
+        if gpu:
+            # OpenGL may be imported only after headless.select_platform
+            from OpenGL import GL
+            self.gl = GL
+        # GL_TIME_ELAPSED queries can't be nested, inner GPU stages are timed on CPU only
+        self.gpu_stage_active = False
+        self.free_queries = []
+        # (stage, query) in the order they were issued
+        self.pending = deque()
+        self.frame_start = None
+
+    @contextlib.contextmanager
+    def stage(self, name, gpu=False):
+        """
+        :param gpu: whether the stage submits GPU work worth timing
+        """
+        query = None
+        if gpu and self.gl is not None and not self.gpu_stage_active:
+            query = self.free_queries.pop() if self.free_queries else self.gl.glGenQueries(1)
+            self.gl.glBeginQuery(self.gl.GL_TIME_ELAPSED, query)
+            self.gpu_stage_active = True
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stats.add(name, 'cpu', time.perf_counter() - start)
+            if query is not None:
+                self.gl.glEndQuery(self.gl.GL_TIME_ELAPSED)
+                self.gpu_stage_active = False
+                self.pending.append((name, query))
+
+    def end_frame(self):
+        """
+        Records time since the previous end_frame and GPU times of stages whose queries finished, call once a frame
+        """
+        now = time.perf_counter()
+        if self.frame_start is not None:
+            self.stats.add('frame', 'cpu', now - self.frame_start)
+        self.frame_start = now
+        self.collect()
+
+    def collect(self, wait=False):
+        """
+        :param wait: waits for all queries, otherwise only the finished ones at the front are read
+        """
+        GL = self.gl
+        while self.pending:
+            name, query = self.pending[0]
+            if not wait:
+                available = np.zeros(1, dtype=np.int32)
+                GL.glGetQueryObjectiv(query, GL.GL_QUERY_RESULT_AVAILABLE, available)
+                if not available[0]:
+                    return
+            nanoseconds = np.zeros(1, dtype=np.uint64)
+            GL.glGetQueryObjectui64v(query, GL.GL_QUERY_RESULT, nanoseconds)
+            self.stats.add(name, 'gpu', float(nanoseconds[0]) * 1E-9)
+            self.pending.popleft()
+            self.free_queries.append(query)
+
+    def write(self, path):
+        self.collect(wait=True)
+        self.stats.write(path)
+
+
+# Shared by all stages of the disabled profiler
+NULL_STAGE = contextlib.nullcontext()
+# Enabled profiler or None
+active: Profiler | None = None
+
+
+def stage(name, gpu=False):
+    """
+    Times the block of a with statement by the enabled profiler, a shared no-op context while it's disabled
+    """
+    return NULL_STAGE
+
+
+def end_frame():
+    pass
+
+
+def enable(profiler: Profiler):
+    """
+    Instrumented code calls profiler.stage and profiler.end_frame through this module, they are rebound to
+    the profiler so the disabled one costs a call returning a constant
+    """
+    global active, stage, end_frame
+    active = profiler
+    stage = profiler.stage
+    end_frame = profiler.end_frame
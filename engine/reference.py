@@ -0,0 +1,765 @@
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import config
+from buffers import Buffers
+from bvh import EPS, INFTY, intersect_triangles, is_empty
+
+# CPU version of trace.glsl working on whole batches of rays, used to render and check images without GL.
+# Functions mirror the ones of trace.glsl, every ray of the batch is a row of the arrays.
+
+COLOR_DISPERSION_FACTOR = np.array([-0.2, 1.0, 0.2], dtype=np.float32)
+# Channel of rays traced for all three colors, see castRayShared
+SHARED = -1
+
+
+def dot(a, b):
+    return np.sum(a * b, axis=-1)
+
+
+def normalize(v):
+    return v / np.linalg.norm(v, axis=-1, keepdims=True)
+
+
+def reflect(incident, normal):
+    return incident - 2.0 * dot(normal, incident)[:, None] * normal
+
+
+def refract(incident, normal, eta):
+    """
+    GLSL refract, zero vector on total internal reflection
+    """
+    cos = dot(normal, incident)
+    k = 1.0 - eta * eta * (1.0 - cos * cos)
+    refracted = eta[:, None] * incident - (eta * cos + np.sqrt(np.maximum(k, 0)))[:, None] * normal
+    return np.where((k < 0)[:, None], 0.0, refracted).astype(np.float32)
+
+
+# Sampler of trace.glsl, integer arithmetic gives exactly the same numbers as the GPU
+SAMPLE_DIFFUSE = 0
+SAMPLE_SUN = 1
+SAMPLE_ROULETTE = 2
+SAMPLE_DIMENSIONS = 3
+R2 = np.array([3242174889, 2447445414], dtype=np.uint32)
+
+
+def pcg_hash(value):
+    state = np.asarray(value, dtype=np.uint32) * np.uint32(747796405) + np.uint32(2891336453)
+    word = ((state >> ((state >> 28) + 4)) ^ state) * np.uint32(277803737)
+    return (word >> 22) ^ word
+
+
+def init_sampler(x, y, index):
+    """
+    :return: sampler state of every ray - pairs of (pixel hash, sample index)
+    """
+    return np.stack(np.broadcast_arrays(pcg_hash(pcg_hash(x) + np.asarray(y, dtype=np.uint32)),
+                                        np.asarray(index, dtype=np.uint32)), axis=-1)
+
+
+def sample_2d(sampler, bounce, dimension):
+    """
+    :return: two numbers in [0, 1) for every ray
+    """
+    shift = pcg_hash(sampler[:, 0] + np.uint32(bounce * SAMPLE_DIMENSIONS + dimension))
+    point = sampler[:, 1:] * R2 + np.stack((shift, pcg_hash(shift)), axis=-1)
+    return (point >> 8).astype(np.float32) / np.float32(16777216.0)
+
+
+def sample_hash(seed, sample_seed):
+    """
+    hash of trace.glsl before the R2 sampler, kept to compare convergence against: fract of the sine of a ray vector
+    scaled by the seed of the sample
+    """
+    value = np.sin(dot(seed, np.array([12.9898, 78.233, 45.164], dtype=np.float32))) * np.float32(43758.5453) * sample_seed
+    return value - np.floor(value)
+
+
+def sample_seed(index):
+    """
+    :return: seed in [0, 1) of every sample index, the same for all pixels like rand1 of a frame was
+    """
+    return (pcg_hash(index) >> 8).astype(np.float32) / np.float32(16777216.0)
+
+
+def diffused_reflection(normal, incident, roughness, random):
+    theta = 2.0 * np.pi * random[:, 0]
+    phi = np.arccos(np.clip(1.0 + (2.0 * random[:, 1] - 2.0) * roughness, -1.0, 1.0))
+    random = np.stack((np.sin(phi) * np.cos(theta), np.sin(phi) * np.sin(theta), np.cos(phi)), axis=-1)
+
+    perfect = reflect(incident, normal)
+    up = np.where((np.abs(perfect[:, 1]) < 0.999)[:, None], np.float32([0, 1, 0]), np.float32([1, 0, 0]))
+    tangent = normalize(np.cross(up, perfect))
+    bitangent = np.cross(perfect, tangent)
+
+    random = normalize(tangent * random[:, :1] + bitangent * random[:, 1:2] + perfect * random[:, 2:])
+    return normalize(perfect + (random - perfect) * roughness[:, None])
+
+
+def reflect_or_refract(direction, inside, material, normal, color, random):
+    """
+    :return: (new direction, new inside flag)
+    """
+    transparent = material['transparent'] != 0
+    result = diffused_reflection(normal, direction, material['roughness'], random)
+    if not np.any(transparent):
+        return result, inside
+
+    normal = np.where((dot(direction, normal) > 0)[:, None], -normal, normal)
+    density = material['optical_density'] + material['dispersion_coefficient'] * COLOR_DISPERSION_FACTOR[color]
+    eta = np.where(inside, density, 1.0 / density).astype(np.float32)
+    refracted = refract(direction, normal, eta)
+    total_reflection = ~np.any(refracted != 0, axis=-1)
+    refracted = np.where(total_reflection[:, None], reflect(direction, normal), refracted)
+
+    result = np.where(transparent[:, None], refracted, result)
+    inside = np.where(transparent & ~total_reflection, ~inside, inside)
+    return result, inside
+
+
+def diffused_pdf(perfect, direction, roughness):
+    """
+    diffusedPdf of trace.glsl, density of directions diffused_reflection returns
+    """
+    r = np.asarray(roughness, dtype=np.float32)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        psi = np.arccos(np.clip(dot(perfect, direction), -1.0, 1.0))
+        x = (1.0 - r) * np.sin(psi) / r
+        phi = psi + np.arcsin(np.minimum(x, 1.0))
+        d_phi = 1.0 + (1.0 - r) * np.cos(psi) / np.sqrt(np.maximum(r * r - x * x * r * r, 1E-12))
+        ratio = np.where(psi < 1E-4, 1.0 / r, np.sin(phi) / np.sin(psi))
+        pdf = np.where((x <= 1.0) & (np.cos(phi) >= 1.0 - 2.0 * r), ratio * d_phi / (4.0 * np.pi * r), 0.0)
+    return np.where(r >= 1.0, 1.0 / (4.0 * np.pi), pdf)
+
+
+def scatter_pdf(direction, material, normal, scattered):
+    """
+    :return: density of scattered directions, 0 for perfect reflection and refraction
+    """
+    rough = (material['transparent'] == 0) & (material['roughness'] != 0)
+    roughness = np.where(rough, material['roughness'], 1.0)
+    return np.where(rough, diffused_pdf(reflect(direction, normal), scattered, roughness), 0.0)
+
+
+def cast_ray_with_sphere(origin, direction, center, radius):
+    """
+    :return: (distance or INFTY, t along the ray) for sphere and every ray
+    """
+    oc = origin - center
+    k1 = dot(direction, direction)
+    k2 = 2.0 * dot(oc, direction)
+    k3 = dot(oc, oc) - radius * radius
+    discr = k2 * k2 - 4.0 * k1 * k3
+
+    root = np.sqrt(np.maximum(discr, 0))
+    t1 = (-k2 - root) / (2.0 * k1)
+    t2 = (-k2 + root) / (2.0 * k1)
+    t_min, t_max = np.minimum(t1, t2), np.maximum(t1, t2)
+    t = np.where(t_min < EPS, t_max, t_min)
+
+    hit = (discr > 0) & (t >= EPS)
+    return np.where(hit, np.linalg.norm(direction, axis=-1) * t, INFTY), t
+
+
+def cast_ray_with_plane(origin, direction, plane):
+    normal = normalize(np.array([plane['a'], plane['b'], plane['c']], dtype=np.float32))
+    denom = direction @ normal
+    safe = np.where(np.abs(denom) < EPS, 1.0, denom)
+    t = -(origin @ normal + plane['d']) / safe
+
+    hit = (np.abs(denom) >= EPS) & (t >= EPS)
+    return np.where(hit, np.linalg.norm(direction, axis=-1) * t, INFTY), np.broadcast_to(normal, origin.shape)
+
+
+def cast_ray_with_lens(origin, direction, lens):
+    center, radius = lens['sphere']['center'], lens['sphere']['radius']
+    plane = lens['plane']
+    plane_normal = np.array([plane['a'], plane['b'], plane['c']], dtype=np.float32)
+
+    oc = origin - center
+    k1 = dot(direction, direction)
+    k2 = 2.0 * dot(oc, direction)
+    k3 = dot(oc, oc) - radius * radius
+    discr = k2 * k2 - 4.0 * k1 * k3
+    root = np.sqrt(np.maximum(discr, 0))
+
+    t = np.full(len(origin), INFTY, dtype=np.float32)
+    valid_side = plane_normal @ plane_normal > 0
+    # Second root is only taken where the first one doesn't fit, like the loop of castRayWithLens
+    for ti in ((-k2 + root) / (2.0 * k1), (-k2 - root) / (2.0 * k1)):
+        point = origin + direction * ti[:, None]
+        fits = (ti >= EPS) & ((point @ plane_normal + plane['d'] > 0) == valid_side)
+        t = np.where(fits, ti, t)
+
+    hit = (discr > 0) & (t < INFTY)
+    return np.where(hit, np.linalg.norm(direction, axis=-1) * t, INFTY), t
+
+
+def node_columns(nodes):
+    """
+    :return: (bounds_min, bounds_max, left_first, count) columns of BVH nodes
+    """
+    return (np.ascontiguousarray(nodes['bounds_min']), np.ascontiguousarray(nodes['bounds_max']),
+            nodes['left_first'].astype(np.int64), nodes['count'].astype(np.int64))
+
+
+def triangle_vertices(triangles):
+    """
+    Same as scene.Triangle.vertices, without importing OpenGL into worker processes
+    """
+    return np.stack((triangles['a'], triangles['b'], triangles['c']), axis=1)
+
+
+class ReferenceRenderer:
+    """
+    Renders packed scene buffers exactly like trace.glsl does, tiles are traced in parallel processes
+    """
+
+    # Rays traced by one batch, bounds memory of the BVH traversal
+    BATCH_RAYS = 1 << 15
+    TILE_ROWS = 16
+
+    def __init__(self, buffers: dict[Buffers, np.ndarray], skybox: np.ndarray,
+                 max_bounces=config.MAX_BOUNCES, min_bounces=config.MIN_BOUNCES,
+                 roulette_threshold=config.ROULETTE_THRESHOLD, shared_path=config.SHARED_PATH_TRACING, sun=None,
+                 next_event_estimation=True, hash_sampler=False):
+        """
+        :param buffers: packed std430 arrays as returned by SceneLoader.pack_buffers or scene_file.read
+        :param skybox: decoded cube map faces of shape (6, height, width, 3) in the order of GL_TEXTURE_CUBE_MAP_POSITIVE_X + i
+        :param sun: scene.Sun or None
+        :param next_event_estimation: whether the sun is sampled by shadow rays and MIS weighted like in trace.glsl,
+                                      otherwise it's only seen by paths that escape into it
+        :param hash_sampler: whether random numbers come from the sin hash of the ray like before the R2 sampler
+        """
+        self.buffers = {buffer: np.array(data) for buffer, data in buffers.items()}
+        self.skybox = np.asarray(skybox, dtype=np.float32) / 255.0
+        self.max_bounces = max_bounces
+        self.min_bounces = min_bounces
+        self.roulette_threshold = roulette_threshold
+        self.shared_path = shared_path
+        self.sun = sun is not None
+        self.next_event_estimation = next_event_estimation
+        self.hash_sampler = hash_sampler
+        if self.sun:
+            self.sun_position = np.float32(sun.position.as_record())
+            self.sun_radius = np.float32(sun.radius)
+            self.sun_color = np.float32(sun.color.as_record())
+
+        # Columns of the BVH and triangles, gathering whole structured records is several times slower
+        nodes = self.buffers[Buffers.TRIANGLES_BVH]
+        self.world_triangles = not is_empty(nodes)
+        self.triangle_nodes = node_columns(nodes)
+        self.triangle_vertices = triangle_vertices(self.buffers[Buffers.TRIANGLES])
+        self.triangle_materials = self.buffers[Buffers.TRIANGLES]['material']
+
+        # Files and loaders without instances don't have these buffers
+        instances = self.buffers.get(Buffers.INSTANCES)
+        self.instances_count = 0 if instances is None else len(instances)
+        if self.instances_count > 0:
+            self.tlas_nodes = node_columns(self.buffers[Buffers.INSTANCES_BVH])
+            self.object_from_world = np.ascontiguousarray(instances['object_from_world'])
+            self.instance_roots = instances['root'].astype(np.int64)
+            self.instance_materials = instances['material']
+
+        materials = self.buffers[Buffers.MATERIAlS]
+        self.dispersion = bool(np.any((materials['transparent'] != 0) & (materials['dispersion_coefficient'] != 0)))
+
+    @classmethod
+    def from_scene_loader(cls, scene_loader, **kwargs):
+        from scene import SceneLoader
+
+        skybox = [SceneLoader.decode_skybox_side(path) for path in scene_loader.spawn_skybox_textures()]
+        return cls(scene_loader.pack_buffers(), np.stack(skybox), sun=scene_loader.spawn_sun(), **kwargs)
+
+    def render(self, resolution, position, rotation, samples, workers=None, first_sample=0):
+        """
+        :param rotation: 3x3 camera rotation applied to view directions as `rotation @ direction`
+        :param workers: number of processes, everything is traced in this process if it's 1
+        :param first_sample: index of the first sample in the sequence, frame_index on GPU
+        :return: (mean of samples of every pixel of shape (height, width, 3) with the first row at the top,
+                  number of traced ray segments)
+        """
+        width, height = resolution
+        indices = np.arange(first_sample, first_sample + samples, dtype=np.uint32)
+        tiles = [(start, min(start + self.TILE_ROWS, height)) for start in range(0, height, self.TILE_ROWS)]
+        arguments = [(resolution, tile, np.float32(position), np.float32(rotation), indices) for tile in tiles]
+
+        workers = workers or os.cpu_count()
+        if workers == 1:
+            results = [self.render_tile(*args) for args in arguments]
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_initialize_worker, initargs=(self,)) as executor:
+                results = list(executor.map(_render_tile, arguments))
+
+        image = np.concatenate([tile for tile, _ in results])[::-1]
+        return image, sum(rays for _, rays in results)
+
+    def render_tile(self, resolution, rows, position, rotation, indices):
+        """
+        :return: (samples mean of rows [start, end) counted from the bottom like gl_FragCoord, number of rays)
+        """
+        width, height = resolution
+        y, x = np.mgrid[rows[0]:rows[1], 0:width]
+        uv = (np.stack((x.ravel(), y.ravel()), axis=-1) + 0.5 - np.float32(resolution) / 2) / max(resolution)
+        directions = normalize(np.concatenate((uv, np.ones((len(uv), 1))), axis=-1)).astype(np.float32) @ rotation.T
+
+        pixels = len(directions)
+        color = np.zeros((pixels, 3), dtype=np.float32)
+        rays = 0
+        chunk = max(self.BATCH_RAYS // pixels, 1)
+        for start in range(0, len(indices), chunk):
+            batch = indices[start:start + chunk]
+            pixel = np.tile(np.arange(pixels), len(batch))
+            sampler = init_sampler(x.ravel()[pixel], y.ravel()[pixel], np.repeat(batch, pixels))
+            origins = np.broadcast_to(position, (len(pixel), 3))
+            rays += self.get_color(origins, directions[pixel], pixel, sampler, color)
+
+        return (color / len(indices)).reshape(rows[1] - rows[0], width, 3), rays
+
+    def get_color(self, origin, direction, pixel, sampler, result):
+        """
+        Traces all rays for max_bounces and adds their colors to result[pixel]
+        :return: number of traced ray segments
+        """
+        if self.shared_path or not self.dispersion:
+            channel = np.full(len(pixel), SHARED)
+        else:
+            # Three paths traced separately, one for every color
+            origin, direction, pixel, sampler = (np.repeat(a, 3, axis=0) for a in (origin, direction, pixel, sampler))
+            channel = np.tile([0, 1, 2], len(pixel) // 3)
+
+        origin = np.array(origin, dtype=np.float32)
+        direction = np.array(direction, dtype=np.float32)
+        inside = np.zeros(len(pixel), dtype=bool)
+        throughput = np.ones((len(pixel), 3), dtype=np.float32)
+        scattered_pdf = np.zeros(len(pixel), dtype=np.float32)
+        materials = self.buffers[Buffers.MATERIAlS]
+        rays = 0
+
+        for bounce in range(self.max_bounces):
+            if len(pixel) == 0:
+                break
+            rays += len(pixel)
+            dist, normal, material = self.cast_ray_with_scene(origin, direction)
+
+            miss = dist >= INFTY
+            sky = self.sample_skybox(direction[miss])
+            if self.sun:
+                # Without shadow rays escaped paths are the only estimate of the sun, scattered_pdf 0 gives them weight 1
+                pdf = scattered_pdf[miss] if self.next_event_estimation else np.zeros_like(scattered_pdf[miss])
+                sky += self.sun_color * self.sun_hit(origin[miss], direction[miss], pdf)[:, None]
+            ReferenceRenderer.accumulate(result, pixel[miss], channel[miss], throughput[miss] * sky)
+
+            hit = ~miss
+            origin, direction, inside, channel, throughput, pixel, sampler, dist, normal, material = (
+                a[hit] for a in (origin, direction, inside, channel, throughput, pixel, sampler, dist, normal, material))
+            intersection = origin + direction * (dist / np.linalg.norm(direction, axis=-1))[:, None]
+            mat = materials[material]
+
+            if self.sun and self.next_event_estimation:
+                rotated = intersection[:, [1, 2, 0]]
+                random = self.sample(sampler, bounce, SAMPLE_SUN, rotated + direction, rotated - direction)
+                light, shadow_rays = self.sun_light(direction, intersection, normal, mat, random)
+                ReferenceRenderer.accumulate(result, pixel, channel, throughput * mat['color'] * self.sun_color * light[:, None])
+                rays += shadow_rays
+
+            # Shared path is split into three at dispersive transparent materials
+            split = (channel == SHARED) & (mat['transparent'] != 0) & (mat['dispersion_coefficient'] != 0)
+            if np.any(split):
+                repeats = np.where(split, 3, 1)
+                origin, direction, inside, throughput, pixel, sampler, normal, intersection, mat = (
+                    np.repeat(a, repeats, axis=0)
+                    for a in (origin, direction, inside, throughput, pixel, sampler, normal, intersection, mat))
+                channel = np.repeat(channel, repeats)
+                channel[np.repeat(split, repeats)] = np.tile([0, 1, 2], int(np.count_nonzero(split)))
+
+            random = self.sample(sampler, bounce, SAMPLE_DIFFUSE, origin + direction, origin - direction)
+            scattered, inside = reflect_or_refract(direction, inside, mat, normal, np.maximum(channel, 0), random)
+            scattered_pdf = scatter_pdf(direction, mat, normal, scattered)
+            origin, direction = intersection, scattered
+            throughput = throughput * mat['color']
+
+            if self.min_bounces <= bounce + 1 < self.max_bounces:
+                random = self.sample(sampler, bounce, SAMPLE_ROULETTE, origin + direction[:, [2, 0, 1]], origin)
+                survival = self.russian_roulette(channel, throughput, random[:, 0])
+                survived = survival > 0
+                throughput = throughput / np.where(survived, survival, 1)[:, None]
+                origin, direction, inside, channel, throughput, pixel, sampler, scattered_pdf = (
+                    a[survived] for a in (origin, direction, inside, channel, throughput, pixel, sampler, scattered_pdf))
+
+        # Paths that ran out of bounces keep their throughput, like castRay
+        ReferenceRenderer.accumulate(result, pixel, channel, throughput)
+        return rays
+
+    def sample(self, sampler, bounce, dimension, first_seed, second_seed):
+        """
+        :param first_seed: ray vectors the sin hash of the two numbers is taken of with hash_sampler
+        :return: two numbers in [0, 1) for every ray
+        """
+        if not self.hash_sampler:
+            return sample_2d(sampler, bounce, dimension)
+        seed = sample_seed(sampler[:, 1])
+        return np.stack((sample_hash(first_seed, seed), sample_hash(second_seed, seed)), axis=-1)
+
+    def russian_roulette(self, channel, throughput, random):
+        """
+        :return: survival probability of every path, 0 for terminated ones
+        """
+        own = np.take_along_axis(throughput, np.maximum(channel, 0)[:, None], axis=1)[:, 0]
+        survival = np.minimum(np.where(channel == SHARED, throughput.max(axis=-1), own) / self.roulette_threshold, 1.0)
+        return np.where(random < survival, survival, 0.0)
+
+    def sun_cos_max(self, point):
+        to_sun = self.sun_position - point
+        return np.sqrt(np.maximum(1.0 - self.sun_radius ** 2 / dot(to_sun, to_sun), 0.0))
+
+    def sun_hit(self, origin, direction, scattered_pdf):
+        """
+        sunHit of trace.glsl, MIS weight of the sun seen by escaped rays
+        """
+        cos_max = self.sun_cos_max(origin)
+        inside_cone = dot(normalize(direction), normalize(self.sun_position - origin)) >= cos_max
+        light_pdf = 1.0 / (2.0 * np.pi * (1.0 - cos_max))
+        weight = np.where(scattered_pdf == 0, 1.0, scattered_pdf / (scattered_pdf + light_pdf))
+        return np.where(inside_cone, weight, 0.0)
+
+    def sun_light(self, direction, intersection, normal, material, random):
+        """
+        sunLight of trace.glsl, shadow ray toward a random point of the sun
+        :return: (MIS weighted visibility of the sun for every ray, number of shadow rays)
+        """
+        axis = normalize(self.sun_position - intersection)
+        cos_max = self.sun_cos_max(intersection)
+        cos_theta = 1.0 - random[:, 0] * (1.0 - cos_max)
+        sin_theta = np.sqrt(np.maximum(1.0 - cos_theta * cos_theta, 0.0))
+        angle = 2.0 * np.pi * random[:, 1]
+
+        up = np.where((np.abs(axis[:, 1]) < 0.999)[:, None], np.float32([0, 1, 0]), np.float32([1, 0, 0]))
+        tangent = normalize(np.cross(up, axis))
+        bitangent = np.cross(axis, tangent)
+        sun_direction = (tangent * (sin_theta * np.cos(angle))[:, None] + bitangent * (sin_theta * np.sin(angle))[:, None] +
+                         axis * cos_theta[:, None]).astype(np.float32)
+
+        bsdf_pdf = scatter_pdf(direction, material, normal, sun_direction)
+        light = np.zeros(len(direction), dtype=np.float32)
+        shadow = np.nonzero(bsdf_pdf > 0)[0]
+        occluder_dist, _, _ = self.cast_ray_with_scene(intersection[shadow], sun_direction[shadow])
+        visible = shadow[occluder_dist >= INFTY]
+
+        light_pdf = 1.0 / (2.0 * np.pi * (1.0 - cos_max[visible]))
+        light[visible] = bsdf_pdf[visible] / (bsdf_pdf[visible] + light_pdf)
+        return light, len(shadow)
+
+    @staticmethod
+    def accumulate(result, pixel, channel, color):
+        mask = np.where((channel == SHARED)[:, None], 1.0, np.arange(3) == channel[:, None])
+        np.add.at(result, pixel, color * mask)
+
+    def cast_ray_with_scene(self, origin, direction):
+        """
+        :return: (distance, normal, material) of the nearest hit for every ray, distance is INFTY on miss
+        """
+        dist = np.full(len(origin), INFTY, dtype=np.float32)
+        normal = np.zeros((len(origin), 3), dtype=np.float32)
+        material = np.zeros(len(origin), dtype=np.int32)
+
+        def closer(new_dist, new_normal, new_material):
+            nearer = new_dist < dist
+            dist[nearer] = new_dist[nearer]
+            normal[nearer] = new_normal[nearer]
+            material[nearer] = new_material
+
+        for sphere in self.buffers[Buffers.SPHERES]:
+            new_dist, t = cast_ray_with_sphere(origin, direction, sphere['center'], sphere['radius'])
+            closer(new_dist, normalize(origin + direction * t[:, None] - sphere['center']), sphere['material'])
+
+        for plane in self.buffers[Buffers.PLANES]:
+            closer(*cast_ray_with_plane(origin, direction, plane), plane['material'])
+
+        if self.world_triangles:
+            triangle_dist, triangle_normal, triangle_material = self.cast_ray_with_triangles(origin, direction, dist)
+            nearer = triangle_dist < dist
+            dist[nearer] = triangle_dist[nearer]
+            normal[nearer] = triangle_normal[nearer]
+            material[nearer] = triangle_material[nearer]
+
+        if self.instances_count > 0:
+            instance_dist, instance_normal, instance_material = self.cast_ray_with_instances(origin, direction, dist)
+            nearer = instance_dist < dist
+            dist[nearer] = instance_dist[nearer]
+            normal[nearer] = instance_normal[nearer]
+            material[nearer] = instance_material[nearer]
+
+        for lens in self.buffers[Buffers.LENSES]:
+            new_dist, t = cast_ray_with_lens(origin, direction, lens)
+            closer(new_dist, normalize(origin + direction * t[:, None] - lens['sphere']['center']), lens['material'])
+
+        return dist, normal, material
+
+    @staticmethod
+    def traverse_bvh(nodes, origin, direction, max_dist, root, intersect_leaf):
+        """
+        BVH traversal of all rays at once, every step tests all (ray, node) pairs of the current frontier
+        :param nodes: columns of the tree returned by node_columns
+        :param root: root node of every ray
+        :param intersect_leaf: function (rays, items, max_dist) returning the distance from every ray to its item
+                               of a leaf, INFTY on miss
+        :return: (distance, nearest item or -1) of every ray
+        """
+        bounds_min, bounds_max, left_first, node_counts = nodes
+        inv_dir = 1.0 / np.where(np.abs(direction) < 1E-8, np.float32(1E-8), direction)
+        length = np.linalg.norm(direction, axis=-1)
+        best = max_dist.copy()
+        best_item = np.full(len(origin), -1)
+
+        ray = np.arange(len(origin))
+        node = np.broadcast_to(np.asarray(root, dtype=np.int64), len(origin))
+        while len(ray) > 0:
+            t0 = (bounds_min[node] - origin[ray]) * inv_dir[ray]
+            t1 = (bounds_max[node] - origin[ray]) * inv_dir[ray]
+            near = np.maximum(np.minimum(t0, t1).max(axis=-1), 0)
+            far = np.maximum(t0, t1).min(axis=-1)
+            visible = (far >= near) & (near * length[ray] < best[ray])
+            ray, node = ray[visible], node[visible]
+
+            counts = node_counts[node]
+            leaf = counts > 0
+            counts = counts[leaf]
+            leaf_ray = np.repeat(ray[leaf], counts)
+            if len(leaf_ray) > 0:
+                leaf_item = np.repeat(left_first[node[leaf]] - np.cumsum(counts) + counts, counts) + np.arange(len(leaf_ray))
+                hit_dist = intersect_leaf(leaf_ray, leaf_item, best[leaf_ray])
+                np.minimum.at(best, leaf_ray, hit_dist)
+                nearest = (hit_dist < INFTY) & (hit_dist == best[leaf_ray])
+                best_item[leaf_ray[nearest]] = leaf_item[nearest]
+
+            inner = ~leaf
+            ray = np.repeat(ray[inner], 2)
+            node = np.repeat(left_first[node[inner]], 2)
+            node[1::2] += 1
+
+        return best, best_item
+
+    def cast_ray_with_triangles(self, origin, direction, max_dist, root=0):
+        """
+        :param root: root node of the world BVH or of BLAS of a mesh for every ray
+        :return: (distance, normal, material) of the nearest triangle of the tree, distance is INFTY on miss
+        """
+        dist = np.full(len(origin), INFTY, dtype=np.float32)
+        normal = np.zeros((len(origin), 3), dtype=np.float32)
+        material = np.zeros(len(origin), dtype=np.int32)
+
+        best, best_triangle = self.traverse_bvh(
+            self.triangle_nodes, origin, direction, max_dist, root,
+            lambda rays, triangles, _: intersect_triangles(self.triangle_vertices[triangles], origin[rays], direction[rays]))
+
+        hit = best_triangle >= 0
+        vertices = self.triangle_vertices[best_triangle[hit]]
+        dist[hit] = best[hit]
+        normal[hit] = normalize(np.cross(vertices[:, 1] - vertices[:, 0], vertices[:, 2] - vertices[:, 0]))
+        material[hit] = self.triangle_materials[best_triangle[hit]]
+        return dist, normal, material
+
+    def cast_ray_with_instance(self, origin, direction, max_dist, instance):
+        """
+        Traces every ray in object space of its instance, the parameter along the ray is the same in both spaces
+        :param instance: index of the instance of every ray
+        :return: (distance, normal, material) of every ray, distance is INFTY on miss
+        """
+        transform = self.object_from_world[instance]
+        object_origin = np.einsum('nij,nj->ni', transform[:, :, :3], origin) + transform[:, :, 3]
+        object_direction = np.einsum('nij,nj->ni', transform[:, :, :3], direction)
+        scale = np.linalg.norm(object_direction, axis=-1) / np.linalg.norm(direction, axis=-1)
+
+        object_dist, object_normal, object_material = self.cast_ray_with_triangles(
+            object_origin, object_direction, max_dist * scale, self.instance_roots[instance])
+
+        hit = object_dist < INFTY
+        dist = np.where(hit, object_dist / scale, INFTY).astype(np.float32)
+        # Normals transform with the inverse transpose of the object to world transform
+        normal = np.einsum('nji,nj->ni', transform[:, :, :3], object_normal)
+        normal[hit] = normalize(normal[hit])
+        materials = self.instance_materials[instance]
+        return dist, normal, np.where(materials >= 0, materials, object_material)
+
+    def cast_ray_with_instances(self, origin, direction, max_dist):
+        """
+        TLAS traversal, the nearest instance of every ray is traced once more to get its normal and material
+        :return: (distance, normal, material) of the nearest instance, distance is INFTY on miss
+        """
+        dist = np.full(len(origin), INFTY, dtype=np.float32)
+        normal = np.zeros((len(origin), 3), dtype=np.float32)
+        material = np.zeros(len(origin), dtype=np.int32)
+
+        _, best_instance = self.traverse_bvh(
+            self.tlas_nodes, origin, direction, max_dist, 0,
+            lambda rays, instances, dists: self.cast_ray_with_instance(origin[rays], direction[rays], dists, instances)[0])
+
+        hit = best_instance >= 0
+        dist[hit], normal[hit], material[hit] = self.cast_ray_with_instance(
+            origin[hit], direction[hit], max_dist[hit], best_instance[hit])
+        return dist, normal, material
+
+    def sample_skybox(self, direction):
+        """
+        Bilinear lookup of the base level of the cube map, face selection follows the OpenGL specification
+        """
+        x, y, z = direction[:, 0], direction[:, 1], direction[:, 2]
+        ax, ay, az = np.abs(direction).T
+        x_major = (ax >= ay) & (ax >= az)
+        y_major = ~x_major & (ay >= az)
+
+        face = np.where(x_major, np.where(x > 0, 0, 1), np.where(y_major, np.where(y > 0, 2, 3), np.where(z > 0, 4, 5)))
+        sc = np.choose(face, (-z, z, x, x, x, -x))
+        tc = np.choose(face, (-y, -y, z, -z, -y, -y))
+        ma = np.choose(face, (ax, ax, ay, ay, az, az))
+
+        _, height, width, _ = self.skybox.shape
+        u = np.clip((sc / ma + 1) * 0.5 * width - 0.5, 0, width - 1)
+        v = np.clip((tc / ma + 1) * 0.5 * height - 0.5, 0, height - 1)
+        u0, v0 = np.floor(u).astype(np.int64), np.floor(v).astype(np.int64)
+        u1, v1 = np.minimum(u0 + 1, width - 1), np.minimum(v0 + 1, height - 1)
+        fu, fv = (u - u0)[:, None], (v - v0)[:, None]
+
+        top = self.skybox[face, v0, u0] * (1 - fu) + self.skybox[face, v0, u1] * fu
+        bottom = self.skybox[face, v1, u0] * (1 - fu) + self.skybox[face, v1, u1] * fu
+        return top * (1 - fv) + bottom * fv
+
+
+
+# Variants of the tracer compared by --convergence as (label, keyword arguments of ReferenceRenderer),
+# the ground truth is rendered by the first one
+CONVERGENCE_VARIANTS = {
+    'roulette': (
+        ('no roulette', {'min_bounces': config.MAX_BOUNCES}),
+        ('MIN_BOUNCES 1, threshold 0.1', {'min_bounces': 1, 'roulette_threshold': 0.1}),
+        ('MIN_BOUNCES 3, threshold 0.1', {'min_bounces': 3, 'roulette_threshold': 0.1}),
+        ('MIN_BOUNCES 3, threshold 0.5', {'min_bounces': 3, 'roulette_threshold': 0.5}),
+        ('MIN_BOUNCES 5, threshold 0.1', {'min_bounces': 5, 'roulette_threshold': 0.1}),
+    ),
+    'sun': (
+        ('NEE + MIS', {}),
+        ('BSDF sampling only', {'next_event_estimation': False}),
+    ),
+    'sampler': (
+        ('R2 sequence', {}),
+        ('sin hash', {'hash_sampler': True}),
+    ),
+}
+# Ground truth of --convergence has this many times more samples than the compared images,
+# its own noise adds 1 / CONVERGENCE_TRUTH_FACTOR of their variance to the measured error
+CONVERGENCE_TRUTH_FACTOR = 64
+
+
+def convergence(renderers: dict[str, ReferenceRenderer], resolution, position, rotation, samples, workers=None):
+    """
+    Renders 1, 2, 4, ... samples with every renderer, each count continues the previous one, and compares them with
+    an image of the first renderer from other CONVERGENCE_TRUTH_FACTOR * samples samples
+    :return: (sample counts, {label: (RMSE at every count, seconds of all samples, number of rays)})
+    """
+    first = next(iter(renderers.values()))
+    truth, _ = first.render(resolution, position, rotation, samples * CONVERGENCE_TRUTH_FACTOR, workers,
+                            first_sample=samples)
+    counts = sorted({2 ** i for i in range(samples.bit_length())} | {samples})
+
+    results = {}
+    for label, renderer in renderers.items():
+        image = np.zeros_like(truth)
+        errors = []
+        seconds = 0.0
+        rays = 0
+        for done, count in zip([0] + counts, counts):
+            start = time.perf_counter()
+            block, block_rays = renderer.render(resolution, position, rotation, count - done, workers, first_sample=done)
+            seconds += time.perf_counter() - start
+            rays += block_rays
+            image = (image * done + block * (count - done)) / count
+            errors.append(float(np.sqrt(np.mean((image - truth) ** 2))))
+        results[label] = (errors, seconds, rays)
+    return counts, results
+
+_worker_renderer = None
+
+
+def _initialize_worker(renderer):
+    global _worker_renderer
+    _worker_renderer = renderer
+
+
+def _render_tile(arguments):
+    return _worker_renderer.render_tile(*arguments)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Renders scene on CPU, measures rays/s with --benchmark "
+                                                 "or convergence of variants of the tracer with --convergence")
+    parser.add_argument('scene', help="scene loader class, e.g. demo.ExampleSceneLoader, or binary scene file")
+    parser.add_argument('output', nargs='?', help="image file, format is taken from the extension")
+    parser.add_argument('--resolution', type=int, nargs=2, default=(320, 180), metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--samples', type=int, default=16, help="samples per pixel")
+    parser.add_argument('--position', type=float, nargs=3, default=(0, 0, -1), metavar=('X', 'Y', 'Z'))
+    parser.add_argument('--yaw', type=float, default=0)
+    parser.add_argument('--pitch', type=float, default=0)
+    parser.add_argument('--workers', type=int, default=None, help="processes, all cores by default")
+    parser.add_argument('--benchmark', action='store_true', help="render at several resolutions and worker counts")
+    parser.add_argument('--convergence', choices=tuple(CONVERGENCE_VARIANTS),
+                        help="error against a long render after 1, 2, 4, ... up to --samples samples of every "
+                             "variant of the tracer, time and variance per sample")
+    return parser.parse_args(argv)
+
+
+def main(args):
+    import pygame
+
+    from batch import scene_loader_factory, camera_rotation
+
+    scene_loader = scene_loader_factory(args.scene)(None)
+    # glm matrices convert to arrays of columns
+    rotation = np.array(camera_rotation(args.yaw, args.pitch)).T
+
+    if args.convergence:
+        resolution = tuple(args.resolution)
+        renderers = {label: ReferenceRenderer.from_scene_loader(scene_loader, **kwargs)
+                     for label, kwargs in CONVERGENCE_VARIANTS[args.convergence]}
+        counts, results = convergence(renderers, resolution, args.position, rotation, args.samples, args.workers)
+        paths = resolution[0] * resolution[1] * args.samples
+        for label, (errors, seconds, rays) in results.items():
+            print(f"{label}: {seconds / args.samples * 1E3:.0f} ms per sample, {rays / paths:.2f} rays per path, "
+                  f"variance {errors[-1] ** 2 * args.samples:.5f} per sample, "
+                  f"efficiency 1 / (RMSE^2 s) {1 / (errors[-1] ** 2 * seconds):.0f}")
+            print("    RMSE " + ", ".join(f"{count}: {error:.4f}" for count, error in zip(counts, errors)))
+        return
+
+    renderer = ReferenceRenderer.from_scene_loader(scene_loader)
+
+    if args.benchmark:
+        workers = sorted({1, *(2 ** i for i in range(1, os.cpu_count().bit_length())), os.cpu_count()})
+        for width, height in ((160, 90), (320, 180), (640, 360)):
+            for count in workers:
+                start = time.perf_counter()
+                _, rays = renderer.render((width, height), args.position, rotation, args.samples, count)
+                elapsed = time.perf_counter() - start
+                print(f"{width}x{height}, {count} workers: {rays / elapsed / 1E6:.3f} M rays/s")
+        return
+
+    start = time.perf_counter()
+    image, rays = renderer.render(tuple(args.resolution), args.position, rotation, args.samples, args.workers)
+    elapsed = time.perf_counter() - start
+    print(f"{rays} rays in {elapsed:.2f} s: {rays / elapsed / 1E6:.3f} M rays/s")
+
+    if args.output is not None:
+        pixels = (np.clip(image, 0, 1) * 255 + 0.5).astype(np.uint8)
+        pygame.image.save(pygame.image.frombuffer(pixels.tobytes(), tuple(args.resolution), 'RGB'), args.output)
+
+
+if __name__ == "__main__":
+    # python3 reference.py demo.ExampleSceneLoader reference.png --samples 16
+    # python3 reference.py demo.InstancesSceneLoader --convergence roulette --resolution 48 27 --samples 32
+    # python3 reference.py demo.InstancesSceneLoader --convergence sun --resolution 48 27 --samples 64
+    # python3 reference.py demo.ExampleSceneLoader --convergence sampler --resolution 64 36 --samples 64
+    main(parse_args(sys.argv[1:]))
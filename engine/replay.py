@@ -0,0 +1,115 @@
+import sys
+import json
+import time
+import argparse
+
+import headless
+from batch import scene_loader_factory, read_pixels
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Replays input trace recorded by main.py --record without a window and prints frame time metrics")
+    parser.add_argument('scene', help="scene loader class, e.g. demo.ExampleSceneLoader, or binary scene file")
+    parser.add_argument('trace', help="input trace of main.py --record")
+    parser.add_argument('--resolution', type=int, nargs=2, default=(1280, 720), metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--idle-frames', type=int, default=0, help="frames without input appended to the trace")
+    parser.add_argument('--max-idle-passes', type=int, default=None,
+                        help="overrides config.MAX_IDLE_PASSES, 1 renders one pass per frame")
+    parser.add_argument('--fixed-resolution', action='store_true',
+                        help="traces frames with movement at the native resolution, overrides config.DYNAMIC_RESOLUTION")
+    parser.add_argument('--unpaced', action='store_true',
+                        help="renders frames back to back instead of waiting for the frame rate of the trace")
+    parser.add_argument('--backend', choices=('fragment', 'compute'), default=None, help="overrides config.BACKEND")
+    parser.add_argument('--output', help="saves the last frame, format is taken from the extension")
+    parser.add_argument('--metrics', help="writes metrics as JSON")
+    parser.add_argument('--profile', help="times stages of every frame, percentiles are written as CSV or JSON "
+                                          "by the extension")
+    parser.add_argument('--platform', choices=headless.PLATFORMS, default='egl')
+    parser.add_argument('--software', action='store_true', help="use Mesa's llvmpipe, no GPU needed")
+    return parser.parse_args(argv)
+
+
+def replay(args):
+    # Imported here, OpenGL must not be imported before headless.select_platform
+    import pygame
+    from OpenGL.GL import glFinish
+
+    import config
+    import shader
+    import profiler
+    from graphics import FrameState
+    from frame_loop import FrameInput, FrameLoop, FrameScheduler, FrameStats, read_trace
+    from dynamic_resolution import ResolutionController
+
+    config.RESOLUTION = tuple(args.resolution)
+    if args.backend is not None:
+        config.BACKEND = args.backend
+    max_passes = config.MAX_IDLE_PASSES if args.max_idle_passes is None else args.max_idle_passes
+
+    fps, inputs = read_trace(args.trace)
+    inputs += [FrameInput() for _ in range(args.idle_frames)]
+    frame_budget = 1.0 / fps
+
+    with headless.HeadlessContext.create(args.platform, config.RESOLUTION):
+        # Trace starts from the initial camera of main.py
+        frame_state = FrameState()
+        _, renderer, logic_provider = shader.create_renderer(frame_state, scene_loader_factory(args.scene))
+        movement_event_handler = shader.create_movement_event_handler(frame_state, logic_provider)
+
+        if args.profile is not None:
+            profiler.enable(profiler.Profiler())
+
+        # First frame uploads the scene and links the program, it's not part of the metrics
+        renderer.render()
+        glFinish()
+
+        resolution_controller = None
+        if config.DYNAMIC_RESOLUTION and not args.fixed_resolution:
+            resolution_controller = ResolutionController(config.RESOLUTION, frame_budget)
+
+        stats = FrameStats()
+        loop = FrameLoop(renderer, movement_event_handler, logic_provider.samples_per_frame,
+                         FrameScheduler(frame_budget, max_passes), finish=glFinish, stats=stats,
+                         resolution_controller=resolution_controller)
+        loop.present()
+
+        next_frame = time.perf_counter()
+        for frame_input in inputs:
+            loop.frame(frame_input)
+            if not args.unpaced:
+                # Stands in for the buffer swap waiting for vsync
+                next_frame += frame_budget
+                delay = next_frame - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_frame = time.perf_counter()
+            loop.present()
+            profiler.end_frame()
+
+        if args.profile is not None:
+            profiler.active.write(args.profile)
+        image = read_pixels(config.RESOLUTION) if args.output is not None else None
+
+    if image is not None:
+        pygame.image.save(pygame.image.frombuffer(image.tobytes(), config.RESOLUTION, 'RGB'), args.output)
+
+    summary = stats.summary()
+    print(f"{len(inputs)} frames at {config.RESOLUTION[0]}x{config.RESOLUTION[1]}, budget {frame_budget * 1E3:.2f} ms")
+    for name, metrics in summary.items():
+        print(f"{name}: {metrics['frames']} frames, mean {metrics['mean_ms']:.2f} ms, p50 {metrics['p50_ms']:.2f} ms, "
+              f"p95 {metrics['p95_ms']:.2f} ms, max {metrics['max_ms']:.2f} ms, "
+              f"jitter {metrics['jitter_std_ms']:.2f} ms std / {metrics['jitter_delta_ms']:.2f} ms frame to frame, "
+              f"{metrics['samples_per_second']:.1f} samples/s per pixel, {metrics['pixels']:.0%} of pixels traced")
+    if args.metrics is not None:
+        with open(args.metrics, 'w') as file:
+            json.dump(summary, file, indent=2)
+
+
+if __name__ == "__main__":
+    # python3 main.py --record walk.json, then
+    # python3 replay.py demo.ExampleSceneLoader walk.json --idle-frames 300 --software
+    arguments = parse_args(sys.argv[1:])
+    headless.select_platform(arguments.platform, arguments.software)
+    replay(arguments)
@@ -0,0 +1,122 @@
+import numpy as np
+
+# Same as INFTY of trace.glsl, distance of pixels that see the sky
+INFTY = np.float32(1E9)
+
+
+class Camera:
+    """
+    Position and 3x3 rotation of FrameState, rotation is applied to view directions as `rotation @ direction`.
+    FrameState.rotation_matrix holds columns of the matrix, so it's Camera(frame_state.position, frame_state.rotation_matrix.T)
+    """
+
+    __slots__ = ('position', 'rotation')
+
+    def __init__(self, position, rotation):
+        self.position = np.asarray(position, dtype=np.float32)
+        self.rotation = np.asarray(rotation, dtype=np.float32)
+
+    def __eq__(self, other):
+        return np.array_equal(self.position, other.position) and np.array_equal(self.rotation, other.rotation)
+
+
+def pixel_centres(resolution):
+    """
+    :return: gl_FragCoord of every pixel of shape (height, width, 2), first row is the bottom one
+    """
+    width, height = resolution
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32) + np.float32(0.5)
+    return np.stack((x, y), axis=-1)
+
+
+def camera_rays(pixel_centre, resolution, camera):
+    """
+    cameraRay of trace.glsl
+    :return: normalized world space directions of shape (..., 3)
+    """
+    uv = (pixel_centre - np.float32(resolution) / 2) / max(resolution)
+    local = np.concatenate((uv, np.ones(uv.shape[:-1] + (1,), dtype=np.float32)), axis=-1)
+    local /= np.linalg.norm(local, axis=-1, keepdims=True)
+    return local @ camera.rotation.T
+
+
+def project(points, directions, sky, resolution, camera):
+    """
+    Inverse of camera_rays, previousPixel of temporal.glsl
+    :param sky: rays that hit nothing, their directions are projected instead of points at infinity
+    :return: (gl_FragCoord where camera sees the points, whether they are in front of it)
+    """
+    local = np.where(sky[..., None], directions, points - camera.position) @ camera.rotation
+    visible = local[..., 2] > np.float32(1E-3)
+    depth = np.where(visible, local[..., 2], 1)[..., None]
+    return local[..., :2] / depth * max(resolution) + np.float32(resolution) / 2, visible
+
+
+def reproject(history_color, history_samples, history_distance, hit_distance, resolution, camera, prev_camera,
+              history_limit, tolerance, prev_resolution=None):
+    """
+    Resamples history accumulated for prev_camera at prev_resolution into pixels of camera,
+    reprojectHistory of temporal.glsl.
+    Every pixel takes the bilinear mix of the 4 previous pixels around the reprojected point that saw the same surface,
+    i.e. their distance to the first hit differs from the distance to the point by less than tolerance of it
+    :param history_color: mean of samples of shape (prev height, prev width, 3), first row is the bottom one
+    :param history_samples: number of samples of shape (prev height, prev width)
+    :param history_distance: distance from prev_camera to the first hit of every pixel, INFTY for the sky
+    :param hit_distance: distance from camera to the first hit of every pixel
+    :param history_limit: reprojected history counts as at most this number of samples
+    :param prev_resolution: resolution history was traced at, the same as resolution by default
+    :return: (color, samples) of shape (height, width, 3) and (height, width), samples is 0 where history is rejected
+    """
+    width, height = resolution
+    prev_resolution = tuple(resolution) if prev_resolution is None else tuple(prev_resolution)
+    prev_width, prev_height = prev_resolution
+    if history_limit == 0:
+        # History is dropped, it may be garbage
+        return np.zeros((height, width, 3), dtype=np.float32), np.zeros((height, width), dtype=np.float32)
+    if camera == prev_camera and prev_resolution == tuple(resolution):
+        return history_color, np.minimum(history_samples, history_limit)
+
+    directions = camera_rays(pixel_centres(resolution), resolution, camera)
+    sky = hit_distance >= INFTY
+    points = camera.position + directions * np.where(sky, 0, hit_distance)[..., None]
+    coord, visible = project(points, directions, sky, prev_resolution, prev_camera)
+    expected = np.linalg.norm(points - prev_camera.position, axis=-1)
+
+    coord -= np.float32(0.5)
+    base = np.floor(coord).astype(np.int64)
+    fraction = coord - base
+
+    color = np.zeros((height, width, 3), dtype=np.float32)
+    samples = np.zeros((height, width), dtype=np.float32)
+    weights = np.zeros((height, width), dtype=np.float32)
+    for dy in (0, 1):
+        for dx in (0, 1):
+            x, y = base[..., 0] + dx, base[..., 1] + dy
+            inside = visible & (x >= 0) & (x < prev_width) & (y >= 0) & (y < prev_height)
+            x, y = np.where(inside, x, 0), np.where(inside, y, 0)
+
+            distance = history_distance[y, x]
+            same = np.where(sky, distance >= INFTY, np.abs(distance - expected) <= tolerance * expected)
+            weight = np.where(dx, fraction[..., 0], 1 - fraction[..., 0]) * np.where(dy, fraction[..., 1], 1 - fraction[..., 1])
+            weight = np.where(inside & same, weight, 0).astype(np.float32)
+
+            color += history_color[y, x] * weight[..., None]
+            samples += history_samples[y, x] * weight
+            weights += weight
+
+    # Corner taps with tiny weights would give history of a single noisy pixel the weight of the whole history
+    valid = weights > np.float32(1E-3)
+    safe = np.where(valid, weights, 1)
+    color = np.where(valid[..., None], color / safe[..., None], 0)
+    samples = np.where(valid, np.minimum(samples / safe, history_limit), 0)
+    return color, samples
+
+
+def accumulate(history_color, history_samples, new_color, new_samples):
+    """
+    Running mean with per pixel weights, accumulate of temporal.glsl
+    :return: (color, samples)
+    """
+    samples = history_samples + new_samples
+    alpha = (history_samples / samples)[..., None]
+    return new_color * (1 - alpha) + history_color * alpha, samples
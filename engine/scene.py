@@ -1,54 +1,71 @@
+import os
 import typing
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+import profiler
 from buffers import Buffers
+from cache import cache_path, save_array
+from bvh import BVH, EMPTY_NODES, NODE_DTYPE, is_empty
+from dirty_ranges import DirtyRanges
 from graphics import LogicProvider, ShaderProgram
 
+import numpy as np
 from OpenGL.GL import *
 from pyglm import glm
-from struct import pack, unpack
 from simplejpeg import decode_jpeg
 
 
-class Converter:
-    @staticmethod
-    def to_int(data):
-        if data is None:
-            return 0
-        if isinstance(data, int):
-            return data
-        if isinstance(data, float):
-            data = pack('f', data)
-            return unpack('i', data)[0]
-        if isinstance(data, bool):
-            return float(data)
-
-        raise NotImplementedError()
-
-    @staticmethod
-    def to_glm_array(arr):
-        arr = [Converter.to_int(item) for item in arr]
-        return glm.array(glm.int32, *arr)
+def std430(fields, itemsize):
+    """
+    Structured dtype with explicit offsets of std430 struct from render.frag
+    :param fields: list of (name, format, offset)
+    """
+    names, formats, offsets = zip(*fields)
+    return np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': itemsize})
 
 
 class LoadableObject:
+    DTYPE: np.dtype = None
+    __slots__ = ()
+
     def __init__(self):
         pass
 
-    def as_array(self):
+    def as_record(self):
+        """
+        :return: tuple matching DTYPE
+        """
         raise NotImplementedError()
 
+    @classmethod
+    def pack(cls, objects: list['LoadableObject']):
+        """
+        Packs objects into one contiguous std430 array, padding is zeroed
+        """
+        packed = np.zeros(len(objects), dtype=cls.DTYPE)
+        packed[:] = [item.as_record() for item in objects]
+        return packed
+
 
 class Vector(LoadableObject):
+    DTYPE = np.dtype(('<f4', 3))
+    __slots__ = ('x', 'y', 'z')
+
     def __init__(self, x, y, z):
         self.x = x
         self.y = y
         self.z = z
 
     @typing.override
-    def as_array(self):
-        return [self.x, self.y, self.z, None]
+    def as_record(self):
+        return self.x, self.y, self.z
 
 
 class Color(Vector):
+    __slots__ = ()
+
     def __init__(self, red, green, blue):
         super().__init__(red, green, blue)
 
@@ -66,6 +83,15 @@ class Color(Vector):
 
 
 class Material(LoadableObject):
+    DTYPE = std430([
+        ('color', Vector.DTYPE, 0),
+        ('roughness', '<f4', 12),
+        ('optical_density', '<f4', 16),
+        ('transparent', '<u4', 20),
+        ('dispersion_coefficient', '<f4', 24),
+    ], 32)
+    __slots__ = ('color', 'roughness', 'transparent', 'optical_density', 'dispersion_coefficient', 'index')
+
     def __init__(self, color: Color, roughness: float, scene_loader, transparent: bool = False, optical_density: float = 1, dispersion_coefficient: float = 0.01):
         super().__init__()
         self.color = color
@@ -78,40 +104,53 @@ class Material(LoadableObject):
         scene_loader.new_material(self)
 
     @typing.override
-    def as_array(self):
-        res = [
-            self.color.red, self.color.green, self.color.blue,
+    def as_record(self):
+        return (
+            self.color.as_record(),
             self.roughness,
             self.optical_density,
             self.transparent,
             self.dispersion_coefficient,
-            None
-        ]
-        return res
+        )
 
 
 class GraphicalPrimitive(LoadableObject):
+    __slots__ = ('material_index',)
+
     def __init__(self, material: Material):
         super().__init__()
         self.material_index = material.index
 
 
 class Sphere(GraphicalPrimitive):
+    DTYPE = std430([
+        ('center', Vector.DTYPE, 0),
+        ('radius', '<f4', 12),
+        ('material', '<i4', 16),
+    ], 32)
+    __slots__ = ('center', 'radius')
+
     def __init__(self, center: Vector, radius, material: Material):
         super().__init__(material)
         self.center = center
         self.radius = radius
 
     @typing.override
-    def as_array(self):
-        return [
-            self.center.x, self.center.y, self.center.z,
-            self.radius, self.material_index,
-            None, None, None  # padding
-        ]
+    def as_record(self):
+        return self.center.as_record(), self.radius, self.material_index
 
 
 class Plane(GraphicalPrimitive):
+    # Only scalar members, so std430 doesn't pad the struct to 16 bytes
+    DTYPE = std430([
+        ('a', '<f4', 0),
+        ('b', '<f4', 4),
+        ('c', '<f4', 8),
+        ('d', '<f4', 12),
+        ('material', '<i4', 16),
+    ], 20)
+    __slots__ = ('a', 'b', 'c', 'd')
+
     def __init__(self, a: float, b: float, c: float, d: float, material: Material):
         super().__init__(material)
         self.a = a
@@ -120,15 +159,19 @@ class Plane(GraphicalPrimitive):
         self.d = d
 
     @typing.override
-    def as_array(self):
-        return [
-            self.a, self.b, self.c, self.d,
-            self.material_index,
-            None, None, None  # padding
-        ]
+    def as_record(self):
+        return self.a, self.b, self.c, self.d, self.material_index
 
 
 class Triangle(GraphicalPrimitive):
+    DTYPE = std430([
+        ('a', Vector.DTYPE, 0),
+        ('b', Vector.DTYPE, 16),
+        ('c', Vector.DTYPE, 32),
+        ('material', '<i4', 44),
+    ], 48)
+    __slots__ = ('a', 'b', 'c')
+
     def __init__(self, a: Vector, b: Vector, c: Vector, material: Material):
         super().__init__(material)
         self.a = a
@@ -136,114 +179,584 @@ class Triangle(GraphicalPrimitive):
         self.c = c
 
     @typing.override
-    def as_array(self):
-        return [
-            self.a.x, self.a.y, self.a.z, None,
-            self.b.x, self.b.y, self.b.z, None,
-            self.c.x, self.c.y, self.c.z,
-            self.material_index
-        ]
+    def as_record(self):
+        return self.a.as_record(), self.b.as_record(), self.c.as_record(), self.material_index
+
+    @staticmethod
+    def vertices(triangles: np.ndarray):
+        """
+        :param triangles: packed triangles
+        :return: array of shape (N, 3, 3)
+        """
+        return np.stack((triangles['a'], triangles['b'], triangles['c']), axis=1)
 
 
 class Lens(GraphicalPrimitive):
+    DTYPE = std430([
+        ('sphere', Sphere.DTYPE, 0),
+        ('plane', Plane.DTYPE, 32),
+        ('material', '<i4', 52),
+    ], 64)
+    __slots__ = ('sphere', 'plane')
+
     def __init__(self, sphere: Sphere, plane: Plane, material: Material):
         super().__init__(material)
         self.sphere = sphere
         self.plane = plane
 
     @typing.override
-    def as_array(self):
-        return self.sphere.as_array() + self.plane.as_array()[:-3] + [self.material_index, None, None]
+    def as_record(self):
+        return self.sphere.as_record(), self.plane.as_record(), self.material_index
+
+
+class Instance:
+    """
+    Copy of a mesh added by SceneLoader.add_mesh placed with 3x4 transform, see SceneLoader.add_instances
+    """
+    # Inverse of the transform, trace.glsl transforms rays into object space of the mesh.
+    # root is the BLAS root node in TRIANGLES_BVH, material overrides materials of the mesh unless it's -1
+    DTYPE = std430([
+        ('object_from_world', ('<f4', (3, 4)), 0),
+        ('root', '<i4', 48),
+        ('material', '<i4', 52),
+    ], 64)
+
+
+class Sun:
+    """
+    Spherical light behind all geometry of the scene, sampled explicitly by shadow rays
+    """
+    __slots__ = ('position', 'radius', 'color')
+
+    def __init__(self, position: Vector, radius: float, color: Color):
+        """
+        :param color: emitted radiance, may be above 1
+        """
+        self.position = position
+        self.radius = radius
+        self.color = color
+
+
+class PrimitiveArray:
+    """
+    Growable array of packed primitives, capacity is doubled when it runs out
+    """
+
+    def __init__(self, dtype: np.dtype, capacity=16):
+        self.__data = np.zeros(capacity, dtype=dtype)
+        self.__size = 0
+
+    @classmethod
+    def of(cls, data: np.ndarray):
+        array = cls(data.dtype, max(len(data), 16))
+        array.allocate(len(data))[:] = data
+        return array
+
+    def __len__(self):
+        return self.__size
+
+    @property
+    def data(self):
+        return self.__data[:self.__size]
+
+    @property
+    def capacity(self):
+        return len(self.__data)
+
+    @property
+    def storage(self):
+        """
+        Whole allocated array including unused capacity
+        """
+        return self.__data
+
+    def reserve(self, capacity):
+        if capacity <= len(self.__data):
+            return
+
+        data = np.zeros(max(capacity, 2 * len(self.__data)), dtype=self.__data.dtype)
+        data[:self.__size] = self.__data[:self.__size]
+        self.__data = data
+
+    def allocate(self, count):
+        """
+        :return: view of count new zeroed records to be filled by caller
+        """
+        self.reserve(self.__size + count)
+        self.__size += count
+        return self.__data[self.__size - count:self.__size]
+
+    def truncate(self, size):
+        self.__data[size:self.__size] = np.zeros(1, dtype=self.__data.dtype)
+        self.__size = min(self.__size, size)
 
 
 class SceneLoader(LogicProvider):
+    # Buffers that can be changed after initialization, triangles are static as they are sorted by BVH
+    DYNAMIC_BUFFERS = (Buffers.MATERIAlS, Buffers.SPHERES, Buffers.PLANES, Buffers.LENSES)
+    # Dirty ranges closer than this number of records are uploaded as one
+    MERGE_GAP = 4
+    MAX_UPLOAD_RANGES = 64
+    # Arrays of the loaded scene with at most this many primitives get a constant loop bound in the shader variant
+    UNROLL_LIMIT = 8
+    # Every instance is a whole BLAS traversal, so TLAS leaves hold one of them
+    TLAS_LEAF_SIZE = 1
+
     def __init__(self, shader_program: ShaderProgram):
         super().__init__()
         self.shader = shader_program
         self.__initialized = False
+        # Whether last render uploaded any visible change
+        self.changed = False
 
         self.last_material_index = 0
         self.materials = []
+
+        # Columnar primitives, after initialization hold every primitive of dynamic buffers
+        self.__primitives = {
+            Buffers.SPHERES: PrimitiveArray(Sphere.DTYPE),
+            Buffers.PLANES: PrimitiveArray(Plane.DTYPE),
+            Buffers.TRIANGLES: PrimitiveArray(Triangle.DTYPE),
+            Buffers.LENSES: PrimitiveArray(Lens.DTYPE),
+        }
+        self.__dirty = {buffer: DirtyRanges(self.MERGE_GAP) for buffer in self.DYNAMIC_BUFFERS}
+        self.__ssbos = {}
+        # Capacity of GL buffer and number of records in its bound range
+        self.__capacities = {}
+        self.__bound_sizes = {}
+        self.__world_triangles = False
+        self.__instances_count = 0
+        # Counts of primitives of the loaded scene small enough to get constant loop bounds
+        self.__unrolled_counts = {}
+        # (vertices, materials) of every mesh and (meshes, transforms, materials) of every add_instances call
+        self.__meshes = []
+        self.__instances = []
+        self.sun = None
+
         self.define_materials_list()
 
     @typing.final
     def render(self):
-        if not self.__initialized:
-            self.__initialize()
+        initializing = not self.__initialized
+        if initializing:
+            with profiler.stage('scene_upload', gpu=True):
+                self.__initialize()
             self.__initialized = True
 
+        with profiler.stage('scene_update', gpu=True):
+            self.changed = self.__upload_changes()
+        if (initializing or self.changed) and self.shader.specialize(self.shader_defines()):
+            self.shader.use()
         super().render()
 
+    def shader_defines(self):
+        """
+        :return: defines of the shader variant specialized for the current contents of the scene
+        """
+        counts = {
+            'SPHERES': len(self.__primitives[Buffers.SPHERES]),
+            'PLANES': len(self.__primitives[Buffers.PLANES]),
+            'LENSES': len(self.__primitives[Buffers.LENSES]),
+        }
+        defines = {f'HAS_{name}': count > 0 for name, count in counts.items()}
+        # Only counts of the loaded scene are unrolled, adding or removing primitives switches to the variant
+        # with runtime loop bounds once instead of linking a variant for every count
+        defines |= {f'{name}_COUNT': count for name, count in counts.items() if self.__unrolled_counts.get(name) == count}
+        defines['HAS_TRIANGLES'] = self.__world_triangles
+        defines['HAS_INSTANCES'] = self.__instances_count > 0
+        defines['HAS_SUN'] = self.sun is not None
+
+        materials = self.__primitives[Buffers.MATERIAlS].data
+        defines['DISPERSION'] = bool(np.any((materials['transparent'] != 0) & (materials['dispersion_coefficient'] != 0)))
+        defines['MAX_BOUNCES'] = config.MAX_BOUNCES
+        defines['MIN_BOUNCES'] = config.MIN_BOUNCES
+        defines['ROULETTE_THRESHOLD'] = config.ROULETTE_THRESHOLD
+        defines['SHARED_PATH'] = config.SHARED_PATH_TRACING
+        defines['REPROJECTION'] = config.TEMPORAL_REPROJECTION
+        defines['REPROJECTION_TOLERANCE'] = config.REPROJECTION_TOLERANCE
+        defines['ACCUMULATION_FORMAT'] = config.ACCUMULATION_FORMAT.upper()
+        defines['DENOISE'] = config.DENOISE
+        return defines
+
     def new_material_index(self):
         self.last_material_index += 1
         return self.last_material_index - 1
 
     def new_material(self, material):
         self.materials.append(material)
+        if self.__initialized:
+            self.__allocate(Buffers.MATERIAlS, 1)[0] = material.as_record()
 
-    def __initialize(self):
-        spheres = self.spawn_spheres()
-        planes = self.spawn_planes()
-        triangles = self.spawn_triangles()
-        lenses = self.spawn_lenses()
+    @staticmethod
+    def material_indices(materials: Material | np.ndarray):
+        if isinstance(materials, Material):
+            return materials.index
+        return np.asarray(materials, dtype=np.int32)
+
+    def add_spheres(self, centers: np.ndarray, radii: np.ndarray, materials: Material | np.ndarray):
+        """
+        Columnar alternative to spawn_spheres for large scenes
+        :param centers: array of shape (N, 3)
+        :param radii: array of shape (N,)
+        :param materials: Material shared by all spheres or array of material indices of shape (N,)
+        """
+        radii = np.asarray(radii, dtype=np.float32)
+        block = self.__allocate(Buffers.SPHERES, len(radii))
+        block['center'] = centers
+        block['radius'] = radii
+        block['material'] = SceneLoader.material_indices(materials)
+
+    def add_planes(self, coefficients: np.ndarray, materials: Material | np.ndarray):
+        """
+        :param coefficients: array of shape (N, 4) - a, b, c, d of plane equation
+        """
+        coefficients = np.asarray(coefficients, dtype=np.float32).reshape(-1, 4)
+        block = self.__allocate(Buffers.PLANES, len(coefficients))
+        for i, name in enumerate('abcd'):
+            block[name] = coefficients[:, i]
+        block['material'] = SceneLoader.material_indices(materials)
+
+    def add_triangles(self, vertices: np.ndarray, materials: Material | np.ndarray):
+        """
+        :param vertices: array of shape (N, 3, 3) - three vertices of every triangle
+        """
+        if self.__initialized:
+            raise RuntimeError("Triangles can't be added after the scene is initialized")
+
+        vertices = np.asarray(vertices, dtype=np.float32).reshape(-1, 3, 3)
+        block = self.__primitives[Buffers.TRIANGLES].allocate(len(vertices))
+        block['a'] = vertices[:, 0]
+        block['b'] = vertices[:, 1]
+        block['c'] = vertices[:, 2]
+        block['material'] = SceneLoader.material_indices(materials)
+
+    def add_mesh(self, vertices: np.ndarray, materials: Material | np.ndarray):
+        """
+        Stores mesh once for any number of add_instances, vertices are in object space of the mesh
+        :param vertices: array of shape (N, 3, 3) - three vertices of every triangle
+        :return: index of the mesh
+        """
+        if self.__initialized:
+            raise RuntimeError("Meshes can't be added after the scene is initialized")
+
+        vertices = np.asarray(vertices, dtype=np.float32).reshape(-1, 3, 3)
+        if len(vertices) == 0:
+            raise ValueError("Mesh has no triangles")
+
+        materials = np.broadcast_to(SceneLoader.material_indices(materials), len(vertices))
+        self.__meshes.append((vertices, materials))
+        return len(self.__meshes) - 1
+
+    def add_instances(self, meshes: int | np.ndarray, transforms: np.ndarray, materials: Material | np.ndarray = None):
+        """
+        Places copies of meshes, memory of a copy doesn't depend on the size of its mesh
+        :param meshes: index returned by add_mesh for all instances or array of shape (N,)
+        :param transforms: array of shape (N, 3, 4) or (N, 4, 4) - transforms from object space of the mesh to the world
+        :param materials: material of all triangles of every instance, materials of the mesh are kept if it's None
+        """
+        if self.__initialized:
+            raise RuntimeError("Instances can't be added after the scene is initialized")
+
+        transforms = np.asarray(transforms, dtype=np.float32)
+        transforms = transforms.reshape(-1, *transforms.shape[-2:])[:, :3, :4]
+        meshes = np.broadcast_to(np.asarray(meshes, dtype=np.int64), len(transforms))
+        if np.any((meshes < 0) | (meshes >= len(self.__meshes))):
+            raise ValueError(f"Unknown mesh, {len(self.__meshes)} meshes were added")
+
+        materials = -1 if materials is None else SceneLoader.material_indices(materials)
+        self.__instances.append((meshes, transforms, np.broadcast_to(materials, len(transforms))))
+
+    def add_lenses(self, centers: np.ndarray, radii: np.ndarray, coefficients: np.ndarray, materials: Material | np.ndarray):
+        """
+        :param coefficients: array of shape (N, 4) - planes cutting the spheres
+        """
+        radii = np.asarray(radii, dtype=np.float32)
+        coefficients = np.asarray(coefficients, dtype=np.float32).reshape(-1, 4)
+        materials = SceneLoader.material_indices(materials)
+        block = self.__allocate(Buffers.LENSES, len(radii))
+        block['sphere']['center'] = centers
+        block['sphere']['radius'] = radii
+        block['sphere']['material'] = materials
+        for i, name in enumerate('abcd'):
+            block['plane'][name] = coefficients[:, i]
+        block['plane']['material'] = materials
+        block['material'] = materials
+
+    def __allocate(self, buffer: Buffers, count):
+        primitives = self.__primitives[buffer]
+        block = primitives.allocate(count)
+        if self.__initialized:
+            self.__dirty[buffer].mark(len(primitives) - count, len(primitives))
+        return block
+
+    def update(self, buffer: Buffers, index, **fields):
+        """
+        Changes fields of primitive in one of DYNAMIC_BUFFERS, e.g. update(Buffers.SPHERES, 0, center=(0, 1, 2))
+        Indices are positions in the buffer: spawned primitives first, then the ones added in bulk
+        """
+        # Record of a structured array is a view, assigning its fields changes the buffer
+        record = self.__primitives[buffer].data[self.__check_index(buffer, index)]
+        previous = record.tobytes()
+        for name, value in fields.items():
+            record[name] = value
+
+        if record.tobytes() != previous:
+            self.__dirty[buffer].mark(index)
+
+    def update_material(self, material: Material):
+        """
+        Uploads material after its attributes were changed
+        """
+        if not self.__initialized:
+            return
+
+        record = self.__primitives[Buffers.MATERIAlS].data[material.index:material.index + 1]
+        previous = record.tobytes()
+        record[0] = material.as_record()
+
+        if record.tobytes() != previous:
+            self.__dirty[Buffers.MATERIAlS].mark(material.index)
+
+    def remove(self, buffer: Buffers, index):
+        """
+        Removes primitive by moving the last one of the buffer in its place.
+        Materials can't be removed, primitives reference them by index
+        """
+        if buffer == Buffers.MATERIAlS:
+            raise ValueError("Materials can't be removed, primitives reference them by index")
+
+        primitives = self.__primitives[buffer]
+        self.__check_index(buffer, index)
+        last = len(primitives) - 1
+        if index != last:
+            primitives.data[index] = primitives.data[last]
+            self.__dirty[buffer].mark(index)
+        primitives.truncate(last)
+        self.__dirty[buffer].truncate(last)
+
+    def __check_index(self, buffer: Buffers, index):
+        """
+        :return: index if it's a primitive of one of DYNAMIC_BUFFERS
+        """
+        if buffer not in self.DYNAMIC_BUFFERS:
+            raise ValueError(f"{buffer.name} can't be changed, dynamic buffers are "
+                             f"{', '.join(dynamic.name for dynamic in self.DYNAMIC_BUFFERS)}")
+
+        # Materials are packed into primitives when the scene is initialized
+        size = len(self.__primitives[buffer]) if buffer in self.__primitives else 0
+        if not 0 <= index < size:
+            raise IndexError(f"{buffer.name} has {size} primitives, index {index} is out of range")
+        return index
 
-        self.__load_SSBO(self.materials, Buffers.MATERIAlS.value)
-        self.__load_SSBO(spheres, Buffers.SPHERES.value)
-        self.__load_SSBO(planes, Buffers.PLANES.value)
-        self.__load_SSBO(triangles, Buffers.TRIANGLES.value)
-        self.__load_SSBO(lenses, Buffers.LENSES.value)
+    @staticmethod
+    def concatenate(*arrays: np.ndarray):
+        """
+        Unlike np.concatenate keeps std430 padding of the structured dtype
+        """
+        result = np.zeros(sum(len(array) for array in arrays), dtype=arrays[0].dtype)
+        offset = 0
+        for array in arrays:
+            result[offset:offset + len(array)] = array
+            offset += len(array)
+        return result
+
+    def pack_buffers(self):
+        """
+        :return: packed std430 array for every scene buffer
+        """
+        primitives = self.__primitives
+        spheres = SceneLoader.concatenate(Sphere.pack(self.spawn_spheres()), primitives[Buffers.SPHERES].data)
+        planes = SceneLoader.concatenate(Plane.pack(self.spawn_planes()), primitives[Buffers.PLANES].data)
+        triangles = SceneLoader.concatenate(Triangle.pack(self.spawn_triangles()), primitives[Buffers.TRIANGLES].data)
+        lenses = SceneLoader.concatenate(Lens.pack(self.spawn_lenses()), primitives[Buffers.LENSES].data)
+
+        bvh = BVH(Triangle.vertices(triangles))
+        triangles = triangles[bvh.order]
+        triangles, nodes, instances, tlas = self.__pack_instances(triangles, bvh.nodes)
+
+        return {
+            Buffers.MATERIAlS: Material.pack(self.materials),
+            Buffers.SPHERES: spheres,
+            Buffers.PLANES: planes,
+            Buffers.TRIANGLES: triangles,
+            Buffers.LENSES: lenses,
+            Buffers.TRIANGLES_BVH: nodes,
+            Buffers.INSTANCES: instances,
+            Buffers.INSTANCES_BVH: tlas,
+        }
+
+    def __pack_instances(self, triangles, nodes):
+        """
+        Appends triangles and BLAS of every mesh after the world ones, so the world BVH keeps root 0,
+        and builds TLAS over world bounds of instances
+        :return: (triangles, BVH nodes, instances, TLAS nodes)
+        """
+        if not self.__instances:
+            return triangles, nodes, np.zeros(0, dtype=Instance.DTYPE), np.zeros(0, dtype=NODE_DTYPE)
+
+        if len(nodes) == 0:
+            nodes = EMPTY_NODES
+        all_triangles, all_nodes = [triangles], [nodes]
+        triangles_count, nodes_count = len(triangles), len(nodes)
+        roots, root_min, root_max = [], [], []
+
+        for vertices, materials in self.__meshes:
+            blas = BVH(vertices)
+            packed = np.zeros(len(vertices), dtype=Triangle.DTYPE)
+            packed['a'], packed['b'], packed['c'] = blas.vertices[:, 0], blas.vertices[:, 1], blas.vertices[:, 2]
+            packed['material'] = materials[blas.order]
+
+            blas_nodes = blas.nodes.copy()
+            leaves = blas_nodes['count'] > 0
+            blas_nodes['left_first'] += np.where(leaves, triangles_count, nodes_count).astype(np.int32)
+
+            roots.append(nodes_count)
+            root_min.append(blas.nodes[0]['bounds_min'])
+            root_max.append(blas.nodes[0]['bounds_max'])
+            all_triangles.append(packed)
+            all_nodes.append(blas_nodes)
+            triangles_count += len(packed)
+            nodes_count += len(blas_nodes)
+
+        meshes, transforms, materials = (np.concatenate(column) for column in zip(*self.__instances))
+        roots, root_min, root_max = np.array(roots, dtype=np.int32), np.array(root_min), np.array(root_max)
+
+        # World bounds of an instance are bounds of the transformed corners of its mesh bounds
+        corners = np.stack(np.meshgrid([0, 1], [0, 1], [0, 1], indexing='ij'), axis=-1).reshape(8, 3)
+        corners = np.where(corners, root_max[meshes][:, None], root_min[meshes][:, None])
+        corners = corners @ np.swapaxes(transforms[:, :, :3], 1, 2) + transforms[:, None, :, 3]
+        tlas = BVH.of_boxes(corners.min(axis=1), corners.max(axis=1), max_leaf_size=self.TLAS_LEAF_SIZE)
+
+        square = np.zeros((len(transforms), 4, 4), dtype=np.float32)
+        square[:, :3] = transforms
+        square[:, 3, 3] = 1
+        instances = np.zeros(len(transforms), dtype=Instance.DTYPE)
+        instances['object_from_world'] = np.linalg.inv(square)[:, :3]
+        instances['root'] = roots[meshes]
+        instances['material'] = materials
+        instances = instances[tlas.order]
+
+        return (SceneLoader.concatenate(*all_triangles), SceneLoader.concatenate(*all_nodes),
+                instances, tlas.nodes)
 
+    def __initialize(self):
+        for buffer, data in self.pack_buffers().items():
+            if buffer in self.DYNAMIC_BUFFERS:
+                self.__primitives[buffer] = PrimitiveArray.of(data)
+                self.__ssbos[buffer] = glGenBuffers(1)
+                self.__capacities[buffer] = 0
+                self.__bound_sizes[buffer] = 0
+                self.__dirty[buffer].clear()
+                self.__dirty[buffer].mark(0, len(data))
+            else:
+                self.__load_SSBO(data, buffer.value)
+
+            if buffer == Buffers.TRIANGLES_BVH:
+                self.__world_triangles = not is_empty(data)
+            if buffer == Buffers.INSTANCES:
+                self.__instances_count = len(data)
+
+        self.__primitives[Buffers.TRIANGLES] = None
+        self.__unrolled_counts = {
+            buffer.name: len(self.__primitives[buffer]) for buffer in (Buffers.SPHERES, Buffers.PLANES, Buffers.LENSES)
+            if 0 < len(self.__primitives[buffer]) <= self.UNROLL_LIMIT
+        }
         self.__load_skybox()
 
-    def __load_SSBO(self, data, index):
+        self.sun = self.spawn_sun()
+        if self.sun is not None:
+            self.shader.set_uniform("sunPosition", self.sun.position.as_record())
+            self.shader.set_uniform("sunRadius", float(self.sun.radius))
+            self.shader.set_uniform("sunColor", self.sun.color.as_record())
+
+    def __upload_changes(self):
+        """
+        Uploads dirty ranges of dynamic buffers, buffer is reallocated only when its capacity grows
+        :return: whether anything was uploaded
+        """
+        changed = False
+
+        for buffer in self.DYNAMIC_BUFFERS:
+            primitives = self.__primitives[buffer]
+            dirty = self.__dirty[buffer]
+            if not dirty and len(primitives) == self.__bound_sizes[buffer]:
+                continue
+            changed = True
+
+            itemsize = primitives.storage.dtype.itemsize
+            glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.__ssbos[buffer])
+
+            if primitives.capacity != self.__capacities[buffer]:
+                storage = primitives.storage.view(np.uint8)
+                glBufferData(GL_SHADER_STORAGE_BUFFER, storage.nbytes, storage, GL_DYNAMIC_DRAW)
+                self.__capacities[buffer] = primitives.capacity
+            else:
+                for start, end in dirty.coalesced(self.MAX_UPLOAD_RANGES):
+                    data = primitives.storage[start:end].view(np.uint8)
+                    glBufferSubData(GL_SHADER_STORAGE_BUFFER, start * itemsize, data.nbytes, data)
+            dirty.clear()
+
+            # Runtime array length in the shader is taken from the size of the bound range
+            self.__bound_sizes[buffer] = len(primitives)
+            if len(primitives) == 0:
+                glBindBufferBase(GL_SHADER_STORAGE_BUFFER, buffer.value, 0)
+            else:
+                glBindBufferRange(GL_SHADER_STORAGE_BUFFER, buffer.value, self.__ssbos[buffer], 0, len(primitives) * itemsize)
+
+        return changed
+
+    def __load_SSBO(self, data: np.ndarray, index):
         if len(data) == 0:
             return
 
-        data = SceneLoader.to_glm_array(data)
-        size = len(data) * 4
         ssbo = glGenBuffers(1)
         glBindBuffer(GL_SHADER_STORAGE_BUFFER, ssbo)
-        glBufferData(GL_SHADER_STORAGE_BUFFER, size, None, GL_STATIC_DRAW)
-        glBufferSubData(GL_SHADER_STORAGE_BUFFER, 0, size, data.ptr)
+        glBufferData(GL_SHADER_STORAGE_BUFFER, data.nbytes, np.ascontiguousarray(data).view(np.uint8), GL_STATIC_DRAW)
         glBindBufferBase(GL_SHADER_STORAGE_BUFFER, index, ssbo)
 
     def __load_skybox(self):
         texture_id = glGenTextures(1)
         glBindTexture(GL_TEXTURE_CUBE_MAP, texture_id)
 
-        for i, j in enumerate(self.spawn_skybox_textures()):
-            self.__load_skybox_side(i, j)
-
-        glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        # Faces are decoded concurrently (decode_jpeg releases the GIL) and uploaded as soon as they're ready
+        paths = self.spawn_skybox_textures()
+        with ThreadPoolExecutor(max_workers=len(paths)) as executor:
+            for i, face in enumerate(executor.map(SceneLoader.decode_skybox_side, paths)):
+                self.__load_skybox_side(i, face)
+
+        if config.SKYBOX_MIPMAPS:
+            glGenerateMipmap(GL_TEXTURE_CUBE_MAP)
+            glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
+        else:
+            glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
         glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
         glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
         glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
         glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_WRAP_R, GL_CLAMP_TO_EDGE)
+        glEnable(GL_TEXTURE_CUBE_MAP_SEAMLESS)
 
-        glUniform1i(glGetUniformLocation(self.shader.program, "skybox"), 0)
-
+        self.shader.set_uniform("skybox", 0)
 
-    def __load_skybox_side(self, idx, path):
+    @staticmethod
+    def decode_skybox_side(path):
+        """
+        :return: decoded RGB pixels, cached on disk by hash of the file
+        """
         with open(path, 'rb') as texture_file:
             texture_bytes = texture_file.read()
-        texture_data = decode_jpeg(texture_bytes)
-        width, height, _ = texture_data.shape
-        glTexImage2D(GL_TEXTURE_CUBE_MAP_POSITIVE_X + idx,
-                         0, GL_RGB, width, height, 0, GL_RGB, GL_UNSIGNED_BYTE, texture_data
-            );
-
-
-    @staticmethod
-    def to_glm_array(data: list[LoadableObject]):
-        if len(data) == 0:
-            return None
 
-        arr = []
+        entry = cache_path('skybox', hashlib.sha256(texture_bytes).hexdigest() + '.npy')
+        if os.path.exists(entry):
+            return np.load(entry, mmap_mode='r')
 
-        for i in data:
-            arr += i.as_array()
+        texture_data = decode_jpeg(texture_bytes)
+        save_array(entry, texture_data)
+        return texture_data
 
-        return Converter.to_glm_array(arr)
+    def __load_skybox_side(self, idx, texture_data: np.ndarray):
+        height, width, _ = texture_data.shape
+        glTexImage2D(GL_TEXTURE_CUBE_MAP_POSITIVE_X + idx,
+                     0, GL_RGB, width, height, 0, GL_RGB, GL_UNSIGNED_BYTE, np.ascontiguousarray(texture_data))
 
     def define_materials_list(self):
         raise NotImplementedError()
@@ -260,6 +773,9 @@ class SceneLoader(LogicProvider):
     def spawn_lenses(self):
         return glm.array(glm.float32)
 
+    def spawn_sun(self) -> Sun | None:
+        return None
+
     def spawn_skybox_textures(self):
         return [
             "../media/bluecloud_ft.jpg",
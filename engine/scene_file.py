@@ -0,0 +1,167 @@
+import sys
+import typing
+import importlib
+
+import numpy as np
+
+from buffers import Buffers
+from bvh import NODE_DTYPE
+from scene import SceneLoader, Material, Sphere, Plane, Triangle, Lens, Instance, Sun, Vector, Color
+from graphics import ShaderProgram
+
+# Binary scene layout (little endian):
+#   header - HEADER_DTYPE
+#   block table - header['blocks'] records of BLOCK_DTYPE
+#   blocks - every block starts at ALIGNMENT boundary, buffer blocks hold std430 records
+#   ready to be copied into SSBO, skybox block holds newline separated utf-8 paths,
+#   optional sun block holds one SUN_DTYPE record, scenes without sun don't have it
+MAGIC = b'RESC'
+VERSION = 1
+ALIGNMENT = 16
+SKYBOX_BLOCK = 0xFF
+SUN_BLOCK = 0xFE
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S4'),
+    ('version', '<u4'),
+    ('blocks', '<u4'),
+    ('reserved', '<u4'),
+])
+
+BLOCK_DTYPE = np.dtype([
+    ('kind', '<u4'),
+    ('itemsize', '<u4'),
+    ('offset', '<u8'),
+    ('count', '<u8'),
+])
+
+SUN_DTYPE = np.dtype([
+    ('position', '<f4', 3),
+    ('radius', '<f4'),
+    ('color', '<f4', 3),
+])
+
+BUFFER_DTYPES = {
+    Buffers.MATERIAlS: Material.DTYPE,
+    Buffers.SPHERES: Sphere.DTYPE,
+    Buffers.PLANES: Plane.DTYPE,
+    Buffers.TRIANGLES: Triangle.DTYPE,
+    Buffers.LENSES: Lens.DTYPE,
+    Buffers.TRIANGLES_BVH: NODE_DTYPE,
+    Buffers.INSTANCES: Instance.DTYPE,
+    Buffers.INSTANCES_BVH: NODE_DTYPE,
+}
+
+
+def align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write(path, buffers: dict[Buffers, np.ndarray], skybox: list[str], sun: Sun | None = None):
+    skybox_data = '\n'.join(skybox).encode('utf-8')
+    extra = [(SKYBOX_BLOCK, skybox_data)]
+    if sun is not None:
+        sun_record = np.array([(sun.position.as_record(), sun.radius, sun.color.as_record())], dtype=SUN_DTYPE)
+        extra.append((SUN_BLOCK, sun_record.tobytes()))
+
+    blocks = np.zeros(len(buffers) + len(extra), dtype=BLOCK_DTYPE)
+    offset = align(HEADER_DTYPE.itemsize + blocks.nbytes)
+    for block, (buffer, data) in zip(blocks, buffers.items()):
+        block['kind'] = buffer.value
+        block['itemsize'] = data.dtype.itemsize
+        block['offset'] = offset
+        block['count'] = len(data)
+        offset = align(offset + data.nbytes)
+
+    for block, (kind, data) in zip(blocks[len(buffers):], extra):
+        block['kind'], block['itemsize'], block['offset'], block['count'] = kind, 1, offset, len(data)
+        offset = align(offset + len(data))
+
+    header = np.array([(MAGIC, VERSION, len(blocks), 0)], dtype=HEADER_DTYPE)
+
+    with open(path, 'wb') as file:
+        file.write(header.tobytes())
+        file.write(blocks.tobytes())
+        for block, data in zip(blocks, buffers.values()):
+            file.seek(int(block['offset']))
+            file.write(np.ascontiguousarray(data).tobytes())
+        for block, (_, data) in zip(blocks[len(buffers):], extra):
+            file.seek(int(block['offset']))
+            file.write(data)
+
+
+def read(path):
+    """
+    Maps scene file into memory, buffers are returned as read only np.memmap without copying
+    :return: (packed std430 array for every scene buffer, skybox texture paths, Sun or None)
+    """
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+    if len(header) == 0 or header[0]['magic'] != MAGIC:
+        raise ValueError(f"{path} is not a scene file")
+    if header[0]['version'] != VERSION:
+        raise ValueError(f"{path} has version {header[0]['version']}, expected {VERSION}")
+
+    blocks = np.fromfile(path, dtype=BLOCK_DTYPE, count=header[0]['blocks'], offset=HEADER_DTYPE.itemsize)
+
+    # Files written before a buffer was added don't have its block, the buffer is empty then
+    buffers = {buffer: np.zeros(0, dtype=dtype) for buffer, dtype in BUFFER_DTYPES.items()}
+    skybox = []
+    sun = None
+    for block in blocks:
+        offset, count = int(block['offset']), int(block['count'])
+
+        if block['kind'] == SKYBOX_BLOCK:
+            with open(path, 'rb') as file:
+                file.seek(offset)
+                skybox = file.read(count).decode('utf-8').split('\n')
+            continue
+        if block['kind'] == SUN_BLOCK:
+            if count != SUN_DTYPE.itemsize:
+                raise ValueError(f"{path}: sun record is {count} bytes, expected {SUN_DTYPE.itemsize}")
+            record = np.fromfile(path, dtype=SUN_DTYPE, count=1, offset=offset)[0]
+            sun = Sun(Vector(*record['position'].tolist()), float(record['radius']), Color(*record['color'].tolist()))
+            continue
+
+        buffer = Buffers(int(block['kind']))
+        dtype = BUFFER_DTYPES[buffer]
+        if block['itemsize'] != dtype.itemsize:
+            raise ValueError(f"{path}: {buffer.name} record is {block['itemsize']} bytes, expected {dtype.itemsize}")
+
+        if count == 0:
+            buffers[buffer] = np.zeros(0, dtype=dtype)
+        else:
+            buffers[buffer] = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(count,))
+
+    return buffers, skybox, sun
+
+
+def save(scene_loader: SceneLoader, path):
+    write(path, scene_loader.pack_buffers(), scene_loader.spawn_skybox_textures(), scene_loader.spawn_sun())
+
+
+class BinarySceneLoader(SceneLoader):
+    def __init__(self, shader_program: ShaderProgram, path):
+        self.buffers, self.skybox, self.saved_sun = read(path)
+        super().__init__(shader_program)
+
+    @typing.override
+    def define_materials_list(self):
+        pass
+
+    @typing.override
+    def pack_buffers(self):
+        return self.buffers
+
+    @typing.override
+    def spawn_skybox_textures(self):
+        return self.skybox
+
+    @typing.override
+    def spawn_sun(self):
+        return self.saved_sun
+
+
+if __name__ == "__main__":
+    # python3 scene_file.py demo.ExampleSceneLoader demo.scene
+    module, name = sys.argv[1].rsplit('.', 1)
+    save(getattr(importlib.import_module(module), name)(None), sys.argv[2])
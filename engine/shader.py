@@ -4,16 +4,59 @@ from graphics import *
 from OpenGL.GL import *
 import config
 import engine
+import accumulation
+import profiler
+from capture import FrameWriter, PixelBufferCapture, CaptureRenderer
 from scene import *
-import random
 
 
-def main(scene_loader):
-    engine_instance = engine.Engine()
+def main(scene_loader, record_path=None, capture_pattern=None, profile_path=None):
+    engine_instance = engine.Engine(record_path, profile_path)
+    frame_state = FrameState()
+    shader, renderer, logic_provider = create_renderer(frame_state, scene_loader)
+    if capture_pattern is not None:
+        engine_instance.capture = PixelBufferCapture(config.RESOLUTION, FrameWriter(capture_pattern))
+        renderer = CaptureRenderer(renderer, engine_instance.capture)
+
+    engine_instance.movement_event_handler = create_movement_event_handler(frame_state, logic_provider)
+    engine_instance.run(renderer, logic_provider.samples_per_frame)
+
+
+def create_movement_event_handler(frame_state, logic_provider):
+    return MovementEventHandlerWrapper(MovementEventHandler(frame_state, 0.05, 0.05), logic_provider)
+
+
+def create_renderer(frame_state, scene_loader):
+    """
+    Needs current OpenGL context, either engine.Engine window or headless.HeadlessContext
+    :return: (shader, renderer, logic_provider) of the backend selected in config
+    """
+    denoiser = create_denoiser() if config.DENOISE else None
+
+    if config.BACKEND == 'compute':
+        shader = ShaderProgram(Shader("../shaders/render.comp"))
+        logic_provider = LogicProviderImpl(shader, frame_state, scene_loader, config.COMPUTE_SAMPLES, frame_buffer=False)
+        renderer = ComputeRenderer(shader, config.RESOLUTION, config.COMPUTE_TILE_SIZE, config.COMPUTE_SAMPLES,
+                                   logic_provider, denoiser)
+        return shader, renderer, logic_provider
+
+    return fragment_renderer(frame_state, scene_loader, denoiser)
+
+
+def create_denoiser():
+    shader = ShaderProgram(Shader("../shaders/denoise.comp"), defines={
+        'NORMAL_SIGMA': config.DENOISE_NORMAL_SIGMA,
+        'ALBEDO_SIGMA': config.DENOISE_ALBEDO_SIGMA,
+        'DEPTH_SIGMA': config.DENOISE_DEPTH_SIGMA,
+    })
+    return Denoiser(shader, config.RESOLUTION, config.DENOISE_ITERATIONS, config.DENOISE_COLOR_SIGMA)
+
+
+def fragment_renderer(frame_state, scene_loader, denoiser=None):
     vertex_shader = Shader("../shaders/render.vert")
     fragment_shader = Shader("../shaders/render.frag")
     shader = ShaderProgram(vertex_shader, fragment_shader)
-    logic_provider = LogicProviderImpl(shader, scene_loader)
+    logic_provider = LogicProviderImpl(shader, frame_state, scene_loader)
 
     # Cube vertices (positions + colors)
     vertices = np.array([
@@ -27,46 +70,99 @@ def main(scene_loader):
     ], dtype=np.float32)
 
     mesh = VerticesMesh(vertices)
-    renderer = Renderer(shader, MeshGroup(mesh), logic_provider)
-    movement_event_handler = MovementEventHandler(shader, 0.05, 0.05)
-    movement_event_handler_wrapper = MovementEventHandlerWrapper(movement_event_handler, logic_provider)
-    engine_instance.movement_event_handler = movement_event_handler_wrapper
-    engine_instance.run(renderer)
+    renderer = Renderer(shader, MeshGroup(mesh), logic_provider, denoiser, config.RESOLUTION)
+    return shader, renderer, logic_provider
 
 
 class LogicProviderImpl(LogicProvider):
-    def __init__(self, shader: ShaderProgram, scene_loader):
+    def __init__(self, shader: ShaderProgram, frame_state: FrameState, scene_loader, samples_per_frame=1, frame_buffer=True):
+        """
+        :param samples_per_frame: samples of every pixel traced per frame
+        :param frame_buffer: whether to allocate prevFrameData, compute backend accumulates into its own texture.
+                             Both of them keep history in TemporalHistory with config.TEMPORAL_REPROJECTION
+        """
         super().__init__()
         self.shader = shader
+        self.frame_state = frame_state
         self.scene_loader = scene_loader(shader)
-        self.prev_frame_ssbo = glGenBuffers(1)
+        self.samples_per_frame = samples_per_frame
+        self.prev_frame_ssbo = None
+        self.history = None
+        # Number of samples averaged in every pixel
         self.mixed_frames = 0
-
-        glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.prev_frame_ssbo)
-        glBufferData(GL_SHADER_STORAGE_BUFFER, config.RESOLUTION[0] * config.RESOLUTION[1] * 4 * 4, None, GL_DYNAMIC_DRAW)  # Allocate memory
-        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, Buffers.FRAME_BUFFER.value, self.prev_frame_ssbo)
+        self.frame_index = 0
+        # Resolution the image is traced at, buffers of history have the size of the native one
+        # and are indexed by the width of this one
+        self.resolution = tuple(config.RESOLUTION)
+
+        if config.TEMPORAL_REPROJECTION:
+            self.history = TemporalHistory(config.RESOLUTION, config.ACCUMULATION_FORMAT)
+        elif frame_buffer:
+            self.prev_frame_ssbo = glGenBuffers(1)
+            glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.prev_frame_ssbo)
+            accumulation.check_format(config.ACCUMULATION_FORMAT)
+            size = config.RESOLUTION[0] * config.RESOLUTION[1] * accumulation.FORMATS[config.ACCUMULATION_FORMAT]['frame_buffer']
+            glBufferData(GL_SHADER_STORAGE_BUFFER, size, None, GL_DYNAMIC_DRAW)  # Allocate memory
+            glBindBufferBase(GL_SHADER_STORAGE_BUFFER, Buffers.FRAME_BUFFER.value, self.prev_frame_ssbo)
 
     def render(self):
         self.scene_loader.render()
-        glUniform2f(glGetUniformLocation(self.shader.program,
-                                         "resolution"), config.RESOLUTION[0], config.RESOLUTION[1])
-        glUniform1f(glGetUniformLocation(
-            self.shader.program, "rand1"), random.random())
-        glUniform1f(glGetUniformLocation(
-            self.shader.program, "rand2"), random.random())
-        glUniform1f(glGetUniformLocation(
-            self.shader.program, "blending_alpha"), self.blending_alpha)
-        self.mixed_frames += 1
-
-        glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.prev_frame_ssbo)
-        glMemoryBarrier(GL_SHADER_STORAGE_BARRIER_BIT)  # Ensure synchronization
+        if self.scene_loader.changed:
+            self.drop_mixed_frames()
+        with profiler.stage('uniforms'):
+            self.frame_state['resolution'] = self.resolution
+            self.frame_state['blending_alpha'] = self.blending_alpha
+            self.frame_state['frame_index'] = self.frame_index
+            self.frame_state['history_limit'] = self.history_limit
+            self.frame_state.upload()
+            self.frame_state.store_camera()
+        self.mixed_frames += self.samples_per_frame
+        self.frame_index += 1
+
+        if self.history is not None:
+            self.history.swap()
+            glMemoryBarrier(GL_SHADER_STORAGE_BARRIER_BIT)
+        if self.prev_frame_ssbo is not None:
+            glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.prev_frame_ssbo)
+            glMemoryBarrier(GL_SHADER_STORAGE_BARRIER_BIT)  # Ensure synchronization
 
     def drop_mixed_frames(self):
         self.mixed_frames = 0
 
+    def set_resolution(self, resolution):
+        """
+        History is reprojected to the new resolution with TEMPORAL_REPROJECTION, prevFrameData can only be dropped
+        """
+        resolution = tuple(resolution)
+        if resolution != self.resolution:
+            self.resolution = resolution
+            if self.history is None:
+                self.drop_mixed_frames()
+
+    def camera_moved(self):
+        """
+        History is reprojected to the new camera with TEMPORAL_REPROJECTION, otherwise it's useless
+        """
+        if self.history is None:
+            self.drop_mixed_frames()
+
+    @property
+    def history_limit(self):
+        """
+        :return: number of samples history of every pixel counts as at most in this frame
+        """
+        if self.mixed_frames == 0:
+            return 0.0
+        if self.frame_state.camera_moved or self.frame_state.resized:
+            # History upscaled from a lower resolution is blurred, it fades as fast as it has fewer pixels
+            prev_width, prev_height = self.frame_state['prev_resolution']
+            width, height = self.resolution
+            return float(config.REPROJECTION_MAX_HISTORY * min(prev_width * prev_height / (width * height), 1.0))
+        return float(np.finfo(np.float32).max)
+
     @property
     def blending_alpha(self):
-        return float(self.mixed_frames) / float(self.mixed_frames + 1)
+        return float(self.mixed_frames) / float(self.mixed_frames + self.samples_per_frame)
 
 
 class MovementEventHandlerWrapper(MovementEventHandler):
@@ -77,12 +173,19 @@ class MovementEventHandlerWrapper(MovementEventHandler):
     @override
     def handle_mouse_event(self, movement):
         self.event_handler.handle_mouse_event(movement)
-        self.logic_provider.drop_mixed_frames()
+        self.logic_provider.camera_moved()
+
+    @override
+    def handle_keydown_event(self, keys=None):
+        self.event_handler.handle_keydown_event(keys)
+        self.logic_provider.camera_moved()
 
     @override
-    def handle_keydown_event(self):
-        self.event_handler.handle_keydown_event()
-        self.logic_provider.drop_mixed_frames()
+    def handle_frame_input(self, frame_input):
+        moved = self.event_handler.handle_frame_input(frame_input)
+        if moved:
+            self.logic_provider.camera_moved()
+        return moved
 
 
 class VerticesMesh(Mesh):
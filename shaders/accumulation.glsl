@@ -0,0 +1,88 @@
+// Storage of accumulated mean colors in prevFrameData of render.frag and in history of temporal.glsl, included after
+// trace.glsl. Compact formats round stochastically, so updates of the mean smaller than their precision are kept
+// on average instead of being rounded away. accumulation.py does the same on CPU and models the error of every format
+
+#define RGBA32F 0
+#define RGB32F 1
+#define RGB16F 2
+#define RGB9E5 3
+
+// Defined by SceneLoader.shader_defines from config
+#ifndef ACCUMULATION_FORMAT
+#define ACCUMULATION_FORMAT RGBA32F
+#endif
+
+#if ACCUMULATION_FORMAT == RGBA32F
+#define PackedColor vec4
+#elif ACCUMULATION_FORMAT == RGB32F
+struct PackedColor {
+    float r;
+    float g;
+    float b;
+};
+#elif ACCUMULATION_FORMAT == RGB16F
+// Halves of rg and of b
+#define PackedColor uvec2
+#else
+// GL_RGB9_E5: 9 bit mantissas of rgb and 5 bit exponent shared by them
+#define PackedColor uint
+#endif
+
+const float HALF_MAX = 65504.0;
+const int SHARED_EXPONENT_BIAS = 15;
+const int SHARED_EXPONENT_MANTISSA_BITS = 9;
+const uint SHARED_EXPONENT_MANTISSA_MAX = 511u;
+const float SHARED_EXPONENT_MAX = 65408.0;
+
+// Three numbers in [0, 1) of the current pixel and sample, independent of sample2D
+vec3 roundingDither() {
+    uint first = pcgHash(pixelHash ^ pcgHash(sampleIndex + 2654435769u));
+    uint second = pcgHash(first);
+    return vec3(uvec3(first, second, pcgHash(second)) >> 8u) / 16777216.0;
+}
+
+// floor(value / ulp + dither) * ulp, the value is rounded up with probability of its fraction of ulp
+vec3 roundStochastic(vec3 value, vec3 ulp, vec3 dither) {
+    return floor(value / ulp + dither) * ulp;
+}
+
+PackedColor encodeColor(vec3 color) {
+#if ACCUMULATION_FORMAT == RGBA32F
+    return vec4(color, 1.0);
+#elif ACCUMULATION_FORMAT == RGB32F
+    return PackedColor(color.r, color.g, color.b);
+#elif ACCUMULATION_FORMAT == RGB16F
+    color = clamp(color, 0.0, HALF_MAX);
+    ivec3 exponent;
+    frexp(max(color, exp2(-14.0)), exponent);
+    // Rounded value is representable exactly, so it doesn't depend on rounding of packHalf2x16
+    color = min(roundStochastic(color, ldexp(vec3(1.0), max(exponent - 1, -14) - 10), roundingDither()), HALF_MAX);
+    return uvec2(packHalf2x16(color.rg), packHalf2x16(vec2(color.b, 0.0)));
+#else
+    color = clamp(color, 0.0, SHARED_EXPONENT_MAX);
+    float largest = max(color.r, max(color.g, color.b));
+    int exponent;
+    frexp(max(largest, exp2(-float(SHARED_EXPONENT_BIAS))), exponent);
+    // Rounding the largest channel up to the next power of two takes the next exponent
+    if (floor(ldexp(largest, SHARED_EXPONENT_MANTISSA_BITS - exponent) + 0.5) > float(SHARED_EXPONENT_MANTISSA_MAX)) {
+        exponent += 1;
+    }
+    float ulp = ldexp(1.0, exponent - SHARED_EXPONENT_MANTISSA_BITS);
+    uvec3 mantissa = min(uvec3(roundStochastic(color, vec3(ulp), roundingDither())), SHARED_EXPONENT_MANTISSA_MAX);
+    return mantissa.r | (mantissa.g << 9u) | (mantissa.b << 18u) | (uint(exponent + SHARED_EXPONENT_BIAS) << 27u);
+#endif
+}
+
+vec3 decodeColor(PackedColor stored) {
+#if ACCUMULATION_FORMAT == RGBA32F
+    return stored.rgb;
+#elif ACCUMULATION_FORMAT == RGB32F
+    return vec3(stored.r, stored.g, stored.b);
+#elif ACCUMULATION_FORMAT == RGB16F
+    return vec3(unpackHalf2x16(stored.x), unpackHalf2x16(stored.y).x);
+#else
+    uvec3 mantissa = (uvec3(stored) >> uvec3(0u, 9u, 18u)) & SHARED_EXPONENT_MANTISSA_MAX;
+    int exponent = int(stored >> 27u) - SHARED_EXPONENT_BIAS;
+    return vec3(mantissa) * ldexp(1.0, exponent - SHARED_EXPONENT_MANTISSA_BITS);
+#endif
+}
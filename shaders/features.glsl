@@ -0,0 +1,19 @@
+// First hit features of every pixel for denoise.comp shared by render.frag and render.comp, included after trace.glsl
+
+// Defined by SceneLoader.shader_defines from config
+#ifndef DENOISE
+#define DENOISE 0
+#endif
+
+#if DENOISE
+// Bound by graphics.Denoiser. rgb of albedo is the color of the material, a is the number of accumulated samples
+layout(rgba16f, binding = 1) writeonly uniform image2D albedoFeature;
+// xyz is the normal, w is the distance
+layout(rgba32f, binding = 2) writeonly uniform image2D normalDepthFeature;
+
+// Must be called right after getColor, it takes the first hit from recordCameraHit
+void writeFeatures(ivec2 pixelCoord, float samples) {
+    imageStore(albedoFeature, pixelCoord, vec4(cameraAlbedo, samples));
+    imageStore(normalDepthFeature, pixelCoord, vec4(cameraNormal, cameraHitDistance));
+}
+#endif
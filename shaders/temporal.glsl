@@ -0,0 +1,115 @@
+// Accumulation of samples across frames with camera motion shared by render.frag and render.comp, included after
+// accumulation.glsl.
+// Every pixel keeps the mean of its samples, their number and the distance to the first hit. When the camera moves or
+// the internal resolution changes the history is reprojected from where the previous camera saw the same surface
+// instead of being dropped.
+// reprojection.py does the same on CPU
+
+// Defined by SceneLoader.shader_defines from config
+#ifndef REPROJECTION
+#define REPROJECTION 1
+#endif
+// History pixel saw another surface if its distance differs by more than this fraction
+#ifndef REPROJECTION_TOLERANCE
+#define REPROJECTION_TOLERANCE 0.05
+#endif
+
+#if REPROJECTION
+struct HistoryPixel {
+    // Mean of samples in ACCUMULATION_FORMAT
+    PackedColor color;
+    float samples;
+    float dist;
+};
+
+// Swapped every frame by graphics.TemporalHistory
+layout(std430, binding = 5) readonly buffer HistoryBuffer {
+    HistoryPixel history[];
+};
+
+layout(std430, binding = 7) writeonly buffer NextHistoryBuffer {
+    HistoryPixel nextHistory[];
+};
+
+// Buffers have the native size, pixels of a frame are stored in rows as wide as its resolution
+int historyIndex(ivec2 pixelCoord, vec2 size) {
+    return pixelCoord.y * int(size.x) + pixelCoord.x;
+}
+
+// gl_FragCoord of the previous frame at prevResolution where point was seen, directions of the sky are projected
+// instead of points. Returns false if it's behind the previous camera
+bool previousPixel(vec3 point, vec3 dir, bool sky, out vec2 coord) {
+    vec3 local = transpose(prevRotationMatrix) * (sky ? dir : point - prevPosition);
+    if (local.z <= EPS) {
+        return false;
+    }
+    coord = local.xy / local.z * max(prevResolution.x, prevResolution.y) + prevResolution / 2;
+    return true;
+}
+
+// History resampled from the previous frame: bilinear mix of the 4 pixels around the reprojected point that saw
+// the same surface. Mean in rgb and number of samples in a, 0 if all of them are disoccluded
+vec4 reprojectHistory(ivec2 pixelCoord, vec3 dir, float hitDistance) {
+    // History is dropped, it may be garbage
+    if (historyLimit == 0.0) {
+        return vec4(0.0);
+    }
+    if (prevRotationMatrix == rotationMatrix && prevPosition == position && prevResolution == resolution) {
+        HistoryPixel old = history[historyIndex(pixelCoord, resolution)];
+        return vec4(decodeColor(old.color), min(old.samples, historyLimit));
+    }
+
+    bool sky = hitDistance == INFTY;
+    vec3 point = position + dir * (sky ? 0.0 : hitDistance);
+    vec2 coord;
+    if (!previousPixel(point, dir, sky, coord)) {
+        return vec4(0.0);
+    }
+    float expected = length(point - prevPosition);
+
+    coord -= 0.5;
+    ivec2 base = ivec2(floor(coord));
+    vec2 fraction = coord - vec2(base);
+
+    vec4 res = vec4(0.0);
+    float weights = 0.0;
+    for (int dy = 0; dy < 2; ++dy) {
+        for (int dx = 0; dx < 2; ++dx) {
+            ivec2 tap = base + ivec2(dx, dy);
+            if (any(lessThan(tap, ivec2(0))) || any(greaterThanEqual(tap, ivec2(prevResolution)))) {
+                continue;
+            }
+
+            HistoryPixel old = history[historyIndex(tap, prevResolution)];
+            bool same = sky ? old.dist == INFTY : abs(old.dist - expected) <= REPROJECTION_TOLERANCE * expected;
+            if (!same) {
+                continue;
+            }
+
+            float weight = (dx == 1 ? fraction.x : 1.0 - fraction.x) * (dy == 1 ? fraction.y : 1.0 - fraction.y);
+            res += vec4(decodeColor(old.color), old.samples) * weight;
+            weights += weight;
+        }
+    }
+
+    // Corner taps with tiny weights would give history of a single noisy pixel the weight of the whole history
+    if (weights <= 1E-3) {
+        return vec4(0.0);
+    }
+    res /= weights;
+    return vec4(res.rgb, min(res.a, historyLimit));
+}
+
+// Adds samples of this frame traced along camera ray dir to the reprojected history and stores it for the next frame.
+// Must be called right after getColor, it takes the distance from cameraHitDistance.
+// Returns the mean in rgb and the number of samples in a
+vec4 accumulate(ivec2 pixelCoord, vec3 dir, vec3 newColor, float newSamples) {
+    vec4 old = reprojectHistory(pixelCoord, dir, cameraHitDistance);
+    float count = old.a + newSamples;
+    vec3 color = mix(newColor, old.rgb, old.a / count);
+    HistoryPixel next = HistoryPixel(encodeColor(color), count, cameraHitDistance);
+    nextHistory[historyIndex(pixelCoord, resolution)] = next;
+    // The image shows the stored mean, so it's the same as what following frames accumulate to
+    return vec4(decodeColor(next.color), count);
+}
+#endif
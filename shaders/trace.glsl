@@ -0,0 +1,807 @@
+// Scene description and path tracing shared by render.frag and render.comp, included after #version
+
+// Mirrors graphics.FrameState, updated once per frame
+layout(std140, binding = 0) uniform FrameState {
+    mat3 rotationMatrix;
+    vec3 position;
+    int frameIndex;
+    vec2 resolution;
+    float blending_alpha;
+    // Camera and resolution of the previous frame and the number of samples its history counts as, see temporal.glsl
+    mat3 prevRotationMatrix;
+    vec3 prevPosition;
+    float historyLimit;
+    vec2 prevResolution;
+};
+
+uniform samplerCube skybox;
+
+// Scene variant, defined by ShaderProgram.specialize from SceneLoader.shader_defines.
+// Defaults give the generic shader that works with any scene
+#ifndef HAS_SPHERES
+#define HAS_SPHERES 1
+#endif
+#ifndef HAS_PLANES
+#define HAS_PLANES 1
+#endif
+#ifndef HAS_TRIANGLES
+#define HAS_TRIANGLES 1
+#endif
+#ifndef HAS_LENSES
+#define HAS_LENSES 1
+#endif
+#ifndef HAS_INSTANCES
+#define HAS_INSTANCES 1
+#endif
+
+// Small arrays get a constant loop bound so the loop can be unrolled
+#ifndef SPHERES_COUNT
+#define SPHERES_COUNT spheres.length()
+#endif
+#ifndef PLANES_COUNT
+#define PLANES_COUNT planes.length()
+#endif
+#ifndef LENSES_COUNT
+#define LENSES_COUNT lenses.length()
+#endif
+
+#ifndef MAX_BOUNCES
+#define MAX_BOUNCES 10
+#endif
+// Paths are terminated by Russian roulette from this bounce on
+#ifndef MIN_BOUNCES
+#define MIN_BOUNCES 3
+#endif
+// Only paths with throughput below this take part in the roulette
+#ifndef ROULETTE_THRESHOLD
+#define ROULETTE_THRESHOLD 0.1
+#endif
+// Whether any transparent material has non-zero dispersionCoefficient
+#ifndef DISPERSION
+#define DISPERSION 1
+#endif
+// Whether SceneLoader.spawn_sun returned a sun, it's sampled explicitly when it is
+#ifndef HAS_SUN
+#define HAS_SUN 0
+#endif
+// Trace one path for all colors instead of three, see castRayShared
+#ifndef SHARED_PATH
+#define SHARED_PATH 1
+#endif
+
+#define INFTY 1E9
+#define EPS   1E-3
+#define PI    3.14159265359
+
+#define COLOR_RED   0
+#define COLOR_GREEN 1
+#define COLOR_BLUE  2
+
+const float colorDispersionFactor[3] = float[3](-0.2, 1.0, 0.2);
+
+struct Ray {
+    vec3 start;
+    vec3 dir;
+    int color;
+    bool isInside;
+};
+
+struct Material {
+    vec3 color;
+    float roughness;
+    float opticalDensity;
+    bool transparent;
+    float dispersionCoefficient;
+};
+
+struct Sphere {
+    vec3 centre;
+    float radius;
+    int material;
+};
+
+struct Plane {
+    float a;
+    float b;
+    float c;
+    float d;
+
+    int material;
+};
+
+struct Triangle {
+    vec3 a;
+    vec3 b;
+    vec3 c;
+
+    int material;
+};
+
+struct Lens {
+    Sphere sphere;
+    Plane plane;
+    int material;
+};
+
+#define LAYOUT std430
+
+layout(LAYOUT, binding = 0) buffer MaterialsBuffer {
+    Material materials[];
+};
+
+layout(LAYOUT, binding = 1) buffer SpheresBuffer {
+    Sphere spheres[];
+};
+
+layout(LAYOUT, binding = 2) buffer PlanesBuffer {
+    Plane planes[];
+};
+
+layout(LAYOUT, binding = 3) buffer TrianglesBuffer {
+    Triangle trs[];
+};
+
+layout(LAYOUT, binding = 4) buffer LensesBuffer {
+    Lens lenses[];
+};
+
+// Leaves (count > 0) reference trs[leftOrFirst .. leftOrFirst + count),
+// inner nodes have children at leftOrFirst and leftOrFirst + 1
+struct BVHNode {
+    vec3 boundsMin;
+    int leftOrFirst;
+    vec3 boundsMax;
+    int count;
+};
+
+// BVH of the world triangles with root 0 followed by BLAS of every mesh of instances
+layout(LAYOUT, binding = 6) buffer TrianglesBVHBuffer {
+    BVHNode bvh[];
+};
+
+// Copy of a mesh whose triangles and BLAS are stored once in trs and bvh
+struct Instance {
+    // Rows of 3x4 matrix transforming world space into object space of the mesh
+    vec4 objectFromWorld[3];
+    // Root of BLAS of the mesh in bvh
+    int root;
+    // Overrides materials of the mesh unless it's -1
+    int material;
+};
+
+layout(LAYOUT, binding = 8) buffer InstancesBuffer {
+    Instance instances[];
+};
+
+// Leaves reference instances[leftOrFirst .. leftOrFirst + count)
+layout(LAYOUT, binding = 9) buffer InstancesBVHBuffer {
+    BVHNode tlas[];
+};
+
+#if HAS_SUN
+// Spherical light behind all the geometry, set from SceneLoader.spawn_sun
+uniform vec3 sunPosition;
+uniform float sunRadius;
+uniform vec3 sunColor;
+#endif
+
+struct Reflection {
+    vec3 intersection;
+    vec3 normal;
+    float dist;
+};
+#define NONE_REFLECTION Reflection(vec3(0.0, 0.0, 0.0), vec3(0.0, 0.0, 0.0), INFTY)
+
+Reflection newReflection(Ray ray, vec3 normal, float t) {
+    return Reflection(ray.start + ray.dir * t, normal, length(ray.dir) * t);
+}
+
+// Sampler: R2 sequence (https://extremelearning.com.au/unreasonable-effectiveness-of-quasirandom-sequences/)
+// indexed by sample number, shifted by a random per pixel and per dimension offset (Cranley-Patterson rotation).
+// Everything is integer arithmetic modulo 2^32, so all GPUs produce the same numbers
+#define SAMPLE_DIFFUSE  0
+#define SAMPLE_SUN      1
+#define SAMPLE_ROULETTE 2
+#define SAMPLE_DIMENSIONS 3
+
+// 2^32 / g and 2^32 / g^2 where g is the plastic number
+const uvec2 R2 = uvec2(3242174889u, 2447445414u);
+
+// Set by initSampler in main
+uint pixelHash;
+uint sampleIndex;
+
+// https://www.jcgt.org/published/0009/03/02/
+uint pcgHash(uint value) {
+    uint state = value * 747796405u + 2891336453u;
+    uint word = ((state >> ((state >> 28u) + 4u)) ^ state) * 277803737u;
+    return (word >> 22u) ^ word;
+}
+
+void initSampler(uvec2 pixel, uint index) {
+    pixelHash = pcgHash(pcgHash(pixel.x) + pixel.y);
+    sampleIndex = index;
+}
+
+// Two numbers in [0, 1) of the current sample for one of SAMPLE_* of the bounce
+vec2 sample2D(int bounce, int dimension) {
+    uint shift = pcgHash(pixelHash + uint(bounce * SAMPLE_DIMENSIONS + dimension));
+    uvec2 point = sampleIndex * R2 + uvec2(shift, pcgHash(shift));
+    return vec2(point >> 8u) / 16777216.0;
+}
+
+vec3 diffusedReflection(vec3 normal, vec3 incidentDir, float roughness, vec2 random) {
+    float theta = 2.0 * PI * random.x;
+    float phi = acos(mix(1.0, 2.0 * random.y - 1.0, roughness));
+
+    vec3 randDir = vec3(
+            sin(phi) * cos(theta),
+            sin(phi) * sin(theta),
+            cos(phi)
+        );
+
+    vec3 perfectReflection = reflect(incidentDir, normal);
+
+    vec3 up = abs(perfectReflection.y) < 0.999 ? vec3(0, 1, 0) : vec3(1, 0, 0);
+    vec3 tangent = normalize(cross(up, perfectReflection));
+    vec3 bitangent = cross(perfectReflection, tangent);
+
+    vec3 randomReflection = normalize(
+            tangent * randDir.x +
+                bitangent * randDir.y +
+                perfectReflection * randDir.z
+        );
+
+    return normalize(mix(perfectReflection, randomReflection, roughness));
+}
+
+vec3 reflectOrRefract(inout Ray ray, Material material, vec3 normal, vec2 random) {
+    if (material.transparent) {
+        if (dot(ray.dir, normal) > 0.0) {
+            normal = -normal;
+        }
+#if DISPERSION
+        float materialOpticalDensity = material.opticalDensity + material.dispersionCoefficient * colorDispersionFactor[ray.color];
+#else
+        float materialOpticalDensity = material.opticalDensity;
+#endif
+        float theta = 1.0 / materialOpticalDensity;
+        if (ray.isInside) {
+            theta = 1.0 / theta;
+        }
+        vec3 refr = refract(ray.dir, normal, theta);
+
+        if (refr == vec3(0.0)) {
+            return reflect(ray.dir, normal);
+        }
+
+        ray.isInside = !ray.isInside;
+        return refr;
+    }
+    return diffusedReflection(normal, ray.dir, material.roughness, random);
+}
+
+float castRayWithSky(Ray ray) {
+    return texture(skybox, ray.dir)[ray.color];
+}
+
+Reflection castRayWithPlane(Ray ray, Plane plane) {
+    vec3 normal = normalize(vec3(plane.a, plane.b, plane.c));
+    float denom = dot(normal, ray.dir);
+
+    if (abs(denom) < EPS) {
+        return NONE_REFLECTION;
+    }
+
+    float t = -(dot(normal, ray.start) + plane.d) / denom;
+
+    if (t < EPS) {
+        return NONE_REFLECTION;
+    }
+
+    return newReflection(ray, normal, t);
+}
+
+// https://en.wikipedia.org/wiki/M%C3%B6ller%E2%80%93Trumbore_intersection_algorithm
+Reflection castRayWithTriangle(Ray ray, Triangle tr) {
+    vec3 edge1 = tr.b - tr.a;
+    vec3 edge2 = tr.c - tr.a;
+    vec3 ray_cross_e2 = cross(ray.dir, edge2);
+    float det = dot(edge1, ray_cross_e2);
+
+    if (det > -EPS && det < EPS) {
+        return NONE_REFLECTION;
+    }
+
+    float inv_det = 1.0 / det;
+    vec3 s = ray.start - tr.a;
+    float u = inv_det * dot(s, ray_cross_e2);
+
+    if ((u < 0 && abs(u) > EPS) || (u > 1 && abs(u - 1) > EPS)) {
+        return NONE_REFLECTION;
+    }
+
+    vec3 s_cross_e1 = cross(s, edge1);
+    float v = inv_det * dot(ray.dir, s_cross_e1);
+
+    if ((v < 0 && abs(v) > EPS) || (u + v > 1 && abs(u + v - 1) > EPS)) {
+        return NONE_REFLECTION;
+    }
+
+    float t = inv_det * dot(edge2, s_cross_e1);
+
+    if (t > EPS) // ray intersection
+    {
+        vec3 normal = normalize(cross(edge1, edge2));
+        return newReflection(ray, normal, t);
+    }
+    else { // This means that there is a line intersection but not a ray intersection.
+        return NONE_REFLECTION;
+    }
+}
+
+Reflection castRayWithSphere(Ray ray, Sphere sph) {
+    vec3 OC = ray.start - sph.centre;
+    float k1 = dot(ray.dir, ray.dir);
+    float k2 = 2 * dot(OC, ray.dir);
+    float k3 = dot(OC, OC) - sph.radius * sph.radius;
+    float discr = k2 * k2 - 4 * k1 * k3;
+
+    if (discr <= 0) {
+        return NONE_REFLECTION;
+    }
+
+    discr = sqrt(discr);
+
+    float t1 = (-k2 - discr) / (2 * k1);
+    float t2 = (-k2 + discr) / (2 * k1);
+
+    float t_min = min(t1, t2);
+    float t_max = max(t1, t2);
+
+    float t = t_min;
+
+    if (t_min < EPS) {
+        if (t_max < EPS) {
+            return NONE_REFLECTION;
+        }
+        t = t_max;
+    }
+
+    vec3 intersection = ray.start + ray.dir * t;
+    vec3 rvector = normalize(intersection - sph.centre);
+    return newReflection(ray, rvector, t);
+}
+
+Reflection castRayWithLens(Ray ray, Lens lens) {
+    vec3 OC = ray.start - lens.sphere.centre;
+    float k1 = dot(ray.dir, ray.dir);
+    float k2 = 2.0 * dot(OC, ray.dir);
+    float k3 = dot(OC, OC) - lens.sphere.radius * lens.sphere.radius;
+    float discr = k2 * k2 - 4.0 * k1 * k3;
+
+    if (discr <= 0.0) {
+        return NONE_REFLECTION;
+    }
+
+    discr = sqrt(discr);
+    float t1 = (-k2 - discr) / (2.0 * k1);
+    float t2 = (-k2 + discr) / (2.0 * k1);
+
+    float t = INFTY;
+    vec3 intersection;
+    vec3 normal;
+
+    for (int i = 0; i < 2; i++) {
+        float ti = (i == 0) ? t1 : t2;
+        if (ti < EPS) continue;
+        vec3 lensDirection = vec3(lens.plane.a, lens.plane.b, lens.plane.c);
+
+        vec3 candidateIntersection = ray.start + ray.dir * ti;
+        vec3 candidateNormal = normalize(candidateIntersection - lens.sphere.centre);
+
+        float planeSide = dot(vec3(lens.plane.a, lens.plane.b, lens.plane.c), candidateIntersection) + lens.plane.d;
+        bool validSide = dot(vec3(lens.plane.a, lens.plane.b, lens.plane.c), lensDirection) > 0.0;
+
+        if ((planeSide > 0.0) == validSide) {
+            t = ti;
+            intersection = candidateIntersection;
+            normal = candidateNormal;
+            break;
+        }
+    }
+
+    if (t == INFTY) {
+        return NONE_REFLECTION;
+    }
+
+    return newReflection(ray, normal, t);
+}
+
+// Distance along the ray to the box or INFTY if it's missed
+float castRayWithBox(Ray ray, vec3 invDir, vec3 boxMin, vec3 boxMax) {
+    vec3 t0 = (boxMin - ray.start) * invDir;
+    vec3 t1 = (boxMax - ray.start) * invDir;
+    vec3 tMin = min(t0, t1);
+    vec3 tMax = max(t0, t1);
+
+    float tNear = max(max(max(tMin.x, tMin.y), tMin.z), 0.0);
+    float tFar = min(min(tMax.x, tMax.y), tMax.z);
+
+    if (tFar < tNear) {
+        return INFTY;
+    }
+    return tNear * length(ray.dir);
+}
+
+#define BVH_STACK_SIZE 64
+
+// Traversal of tree nodes from root, intersectLeaf(ray, index, refl, material) is called for every item of the leaves
+// that may be closer than refl
+#define TRAVERSE_BVH(nodes, root, intersectLeaf) \
+    vec3 safeDir = mix(ray.dir, vec3(1E-8), lessThan(abs(ray.dir), vec3(1E-8))); \
+    vec3 invDir = 1.0 / safeDir; \
+    \
+    int stack[BVH_STACK_SIZE]; \
+    int stackSize = 0; \
+    stack[stackSize++] = root; \
+    \
+    while (stackSize > 0) { \
+        BVHNode node = nodes[stack[--stackSize]]; \
+        if (castRayWithBox(ray, invDir, node.boundsMin, node.boundsMax) >= refl.dist) { \
+            continue; \
+        } \
+        \
+        if (node.count > 0) { \
+            for (int i = node.leftOrFirst; i < node.leftOrFirst + node.count; ++i) { \
+                intersectLeaf(ray, i, refl, material); \
+            } \
+            continue; \
+        } \
+        \
+        int left = node.leftOrFirst; \
+        int right = left + 1; \
+        float leftDist = castRayWithBox(ray, invDir, nodes[left].boundsMin, nodes[left].boundsMax); \
+        float rightDist = castRayWithBox(ray, invDir, nodes[right].boundsMin, nodes[right].boundsMax); \
+        \
+        /* Nearest child goes on top of the stack so it's visited first */ \
+        if (leftDist > rightDist) { \
+            int tmp = left; \
+            left = right; \
+            right = tmp; \
+            float tmpDist = leftDist; \
+            leftDist = rightDist; \
+            rightDist = tmpDist; \
+        } \
+        if (rightDist < refl.dist) { \
+            stack[stackSize++] = right; \
+        } \
+        if (leftDist < refl.dist) { \
+            stack[stackSize++] = left; \
+        } \
+    } \
+
+void intersectTriangle(Ray ray, int index, inout Reflection refl, inout int material) {
+    Reflection newrefl = castRayWithTriangle(ray, trs[index]);
+    if (newrefl.dist < refl.dist) {
+        refl = newrefl;
+        material = trs[index].material;
+    }
+}
+
+// Triangles of the tree with root in bvh, distances are measured in units of ray.dir
+void castRayWithTriangles(Ray ray, int root, inout Reflection refl, inout int material) {
+    TRAVERSE_BVH(bvh, root, intersectTriangle);
+}
+
+// Traces ray in object space of the instance, the parameter along the ray is the same in both spaces
+void intersectInstance(Ray ray, int index, inout Reflection refl, inout int material) {
+    Instance instance = instances[index];
+    mat4x3 objectFromWorld = transpose(mat3x4(
+            instance.objectFromWorld[0], instance.objectFromWorld[1], instance.objectFromWorld[2]));
+    Ray objectRay = Ray(
+            objectFromWorld * vec4(ray.start, 1.0), objectFromWorld * vec4(ray.dir, 0.0), ray.color, ray.isInside);
+    float scale = length(objectRay.dir) / length(ray.dir);
+
+    // Misses are INFTY in any space, a larger limit would take them for hits
+    Reflection objectRefl = Reflection(vec3(0.0), vec3(0.0), min(refl.dist * scale, INFTY));
+    int objectMaterial = -1;
+    castRayWithTriangles(objectRay, instance.root, objectRefl, objectMaterial);
+    if (objectMaterial < 0) {
+        return;
+    }
+
+    float t = objectRefl.dist / length(objectRay.dir);
+    vec3 normal = normalize(transpose(mat3(objectFromWorld)) * objectRefl.normal);
+    refl = newReflection(ray, normal, t);
+    material = instance.material >= 0 ? instance.material : objectMaterial;
+}
+
+void castRayWithInstances(Ray ray, inout Reflection refl, inout int material) {
+    if (tlas.length() == 0) {
+        return;
+    }
+    TRAVERSE_BVH(tlas, 0, intersectInstance);
+}
+
+#undef TRAVERSE_BVH
+
+#define PROCESS_PRIMITIVE(primitives, count, castFunction) \
+    for (int i = 0; i < count; ++i) { \
+        Reflection newrefl = castFunction(ray, primitives[i]); \
+        if (newrefl.dist < refl.dist) { \
+            refl = newrefl; \
+            material = primitives[i].material; \
+        } \
+    } \
+
+Reflection castRayWithScene(Ray ray, out int material) {
+    Reflection refl = NONE_REFLECTION;
+    material = 0;
+
+#if HAS_SPHERES
+    PROCESS_PRIMITIVE(spheres, SPHERES_COUNT, castRayWithSphere);
+#endif
+#if HAS_PLANES
+    PROCESS_PRIMITIVE(planes, PLANES_COUNT, castRayWithPlane);
+#endif
+#if HAS_TRIANGLES
+    if (bvh.length() > 0) {
+        castRayWithTriangles(ray, 0, refl, material);
+    }
+#endif
+#if HAS_INSTANCES
+    castRayWithInstances(ray, refl, material);
+#endif
+#if HAS_LENSES
+    PROCESS_PRIMITIVE(lenses, LENSES_COUNT, castRayWithLens);
+#endif
+
+    return refl;
+}
+
+#undef PROCESS_PRIMITIVE
+
+// Density per unit solid angle of directions diffusedReflection returns around perfectReflection.
+// It picks a direction uniformly in the cone with cos in [1 - 2 * roughness, 1] and mixes it with
+// perfectReflection, which turns angle phi of the cone into angle psi = phi - asin((1 - r) * sin(psi) / r)
+float diffusedPdf(vec3 perfectReflection, vec3 dir, float roughness) {
+    float r = roughness;
+    if (r >= 1.0) {
+        return 1.0 / (4.0 * PI);
+    }
+
+    float psi = acos(clamp(dot(perfectReflection, dir), -1.0, 1.0));
+    float x = (1.0 - r) * sin(psi) / r;
+    if (x > 1.0) {
+        return 0.0;
+    }
+    float phi = psi + asin(x);
+    if (cos(phi) < 1.0 - 2.0 * r) {
+        return 0.0;
+    }
+
+    float dPhi = 1.0 + (1.0 - r) * cos(psi) / sqrt(max(r * r - x * x * r * r, 1E-12));
+    float ratio = psi < 1E-4 ? 1.0 / r : sin(phi) / sin(psi);
+    return ratio * dPhi / (4.0 * PI * r);
+}
+
+// Density of the direction of the next bounce, 0 for perfect reflection and refraction
+float scatterPdf(Ray ray, Material material, vec3 normal, vec3 dir) {
+    if (material.transparent || material.roughness == 0.0) {
+        return 0.0;
+    }
+    return diffusedPdf(reflect(ray.dir, normal), dir, material.roughness);
+}
+
+#if HAS_SUN
+// Cosine of the angular radius of the sun seen from point
+float sunCosMax(vec3 point) {
+    vec3 toSun = sunPosition - point;
+    return sqrt(max(1.0 - sunRadius * sunRadius / dot(toSun, toSun), 0.0));
+}
+
+// Density of uniform sampling of the cone of the sun, 0 if dir misses it
+float sunPdf(vec3 point, vec3 dir) {
+    float cosMax = sunCosMax(point);
+    if (dot(normalize(dir), normalize(sunPosition - point)) < cosMax) {
+        return 0.0;
+    }
+    return 1.0 / (2.0 * PI * (1.0 - cosMax));
+}
+#endif
+
+// MIS (balance heuristic) weight of the sun seen by a ray scattered with density scatteredPdf, 0 if it's missed.
+// Camera rays and perfect reflections can't sample the sun explicitly, so they take it with weight 1
+float sunHit(Ray ray, float scatteredPdf) {
+#if HAS_SUN
+    float lightPdf = sunPdf(ray.start, ray.dir);
+    if (lightPdf == 0.0) {
+        return 0.0;
+    }
+    return scatteredPdf == 0.0 ? 1.0 : scatteredPdf / (scatteredPdf + lightPdf);
+#else
+    return 0.0;
+#endif
+}
+
+// Next event estimation: shadow ray to a random point of the sun disc.
+// Scattering contributes color * scatterPdf per unit solid angle (castRay multiplies throughput by color only),
+// so with balance heuristic the light sample adds sunColor * color * scatterPdf / (scatterPdf + lightPdf)
+float sunLight(Ray ray, Reflection refl, Material material, vec2 random) {
+#if HAS_SUN
+    if (material.transparent || material.roughness == 0.0) {
+        return 0.0;
+    }
+
+    vec3 axis = normalize(sunPosition - refl.intersection);
+    float cosMax = sunCosMax(refl.intersection);
+    float cosTheta = 1.0 - random.x * (1.0 - cosMax);
+    float sinTheta = sqrt(max(1.0 - cosTheta * cosTheta, 0.0));
+    float angle = 2.0 * PI * random.y;
+
+    vec3 up = abs(axis.y) < 0.999 ? vec3(0, 1, 0) : vec3(1, 0, 0);
+    vec3 tangent = normalize(cross(up, axis));
+    vec3 bitangent = cross(axis, tangent);
+    vec3 dir = tangent * sinTheta * cos(angle) + bitangent * sinTheta * sin(angle) + axis * cosTheta;
+
+    float bsdfPdf = scatterPdf(ray, material, refl.normal, dir);
+    if (bsdfPdf == 0.0) {
+        return 0.0;
+    }
+
+    int occluder;
+    if (castRayWithScene(Ray(refl.intersection, dir, ray.color, ray.isInside), occluder).dist != INFTY) {
+        return 0.0;
+    }
+
+    float lightPdf = 1.0 / (2.0 * PI * (1.0 - cosMax));
+    return bsdfPdf / (bsdfPdf + lightPdf);
+#else
+    return 0.0;
+#endif
+}
+
+#if HAS_SUN
+#define SUN_COLOR sunColor
+#else
+#define SUN_COLOR vec3(0.0)
+#endif
+
+// Terminates path with probability 1 - throughput / ROULETTE_THRESHOLD, survived paths are divided by the returned probability
+// so the estimate stays unbiased, 0 means the path is terminated
+float russianRoulette(int bounce, float throughput) {
+    // Path ends after the last bounce anyway
+    if (bounce + 1 < MIN_BOUNCES || bounce + 1 >= MAX_BOUNCES) {
+        return 1.0;
+    }
+    float survival = min(throughput / ROULETTE_THRESHOLD, 1.0);
+    return sample2D(bounce, SAMPLE_ROULETTE).x < survival ? survival : 0.0;
+}
+
+// First hit of the last traced path: distance from the camera (INFTY for the sky), color of the material
+// and normal facing the camera (both 0 for the sky)
+float cameraHitDistance = INFTY;
+vec3 cameraAlbedo = vec3(0.0);
+vec3 cameraNormal = vec3(0.0);
+
+void recordCameraHit(Ray ray, Reflection refl, int material) {
+    cameraHitDistance = refl.dist;
+    if (refl.dist == INFTY) {
+        cameraAlbedo = vec3(0.0);
+        cameraNormal = vec3(0.0);
+        return;
+    }
+    cameraAlbedo = materials[material].color;
+    cameraNormal = faceforward(refl.normal, ray.dir, refl.normal);
+}
+
+// Traces one color channel from bounce firstBounce on
+float castRay(Ray ray, int firstBounce) {
+    float res = 1.0;
+    // Light gathered by shadow rays
+    float light = 0.0;
+    float scatteredPdf = 0.0;
+
+    for (int i = firstBounce; i < MAX_BOUNCES; ++i) {
+        int material;
+        Reflection refl = castRayWithScene(ray, material);
+        if (i == 0) {
+            recordCameraHit(ray, refl, material);
+        }
+
+        if (refl.dist == INFTY) {
+            return light + res * (castRayWithSky(ray) + SUN_COLOR[ray.color] * sunHit(ray, scatteredPdf));
+        }
+
+        Material mat = materials[material];
+        light += res * mat.color[ray.color] * SUN_COLOR[ray.color] * sunLight(ray, refl, mat, sample2D(i, SAMPLE_SUN));
+
+        vec3 refvector = reflectOrRefract(ray, mat, refl.normal, sample2D(i, SAMPLE_DIFFUSE));
+        scatteredPdf = scatterPdf(ray, mat, refl.normal, refvector);
+        ray = Ray(refl.intersection, refvector, ray.color, ray.isInside);
+        res *= mat.color[ray.color];
+
+        float survival = russianRoulette(i, res);
+        if (survival == 0.0) {
+            return light;
+        }
+        res /= survival;
+    }
+
+    return light + res;
+}
+
+// Traces all three channels along one path while it's the same for all of them,
+// the path is split into per-channel castRay only at dispersive transparent materials
+vec3 castRayShared(Ray ray) {
+    vec3 res = vec3(1.0);
+    vec3 light = vec3(0.0);
+    float scatteredPdf = 0.0;
+
+    for (int i = 0; i < MAX_BOUNCES; ++i) {
+        int material;
+        Reflection refl = castRayWithScene(ray, material);
+        if (i == 0) {
+            recordCameraHit(ray, refl, material);
+        }
+
+        if (refl.dist == INFTY) {
+            return light + res * (texture(skybox, ray.dir).rgb + SUN_COLOR * sunHit(ray, scatteredPdf));
+        }
+
+        Material mat = materials[material];
+#if DISPERSION
+        if (mat.transparent && mat.dispersionCoefficient != 0.0) {
+            vec3 split;
+            for (int color = COLOR_RED; color <= COLOR_BLUE; ++color) {
+                Ray channelRay = Ray(ray.start, ray.dir, color, ray.isInside);
+                vec3 refvector = reflectOrRefract(channelRay, mat, refl.normal, sample2D(i, SAMPLE_DIFFUSE));
+                channelRay = Ray(refl.intersection, refvector, color, channelRay.isInside);
+                split[color] = mat.color[color] * castRay(channelRay, i + 1);
+            }
+            return light + res * split;
+        }
+#endif
+
+        light += res * mat.color * SUN_COLOR * sunLight(ray, refl, mat, sample2D(i, SAMPLE_SUN));
+
+        vec3 refvector = reflectOrRefract(ray, mat, refl.normal, sample2D(i, SAMPLE_DIFFUSE));
+        scatteredPdf = scatterPdf(ray, mat, refl.normal, refvector);
+        ray = Ray(refl.intersection, refvector, ray.color, ray.isInside);
+        res *= mat.color;
+
+        float survival = russianRoulette(i, max(max(res.r, res.g), res.b));
+        if (survival == 0.0) {
+            return light;
+        }
+        res /= survival;
+    }
+
+    return light + res;
+}
+
+vec4 getColor(vec3 camera, vec3 dir) {
+    vec4 res = vec4(0.0, 0.0, 0.0, 1.0);
+
+    Ray ray = Ray(camera, dir, COLOR_RED, false);
+    // Without dispersion all channels follow the same path anyway
+#if SHARED_PATH || !DISPERSION
+    res.xyz = castRayShared(ray);
+#else
+    res.x = castRay(ray, 0);
+
+    ray.color = COLOR_GREEN;
+    res.y = castRay(ray, 0);
+
+    ray.color = COLOR_BLUE;
+    res.z = castRay(ray, 0);
+#endif
+
+    return res;
+}
+
+vec3 cameraRay(vec2 pixelCentre) {
+    vec2 uv = (pixelCentre - resolution / 2) / max(resolution.x, resolution.y);
+    return rotationMatrix * normalize(vec3(uv, 1.0));
+}
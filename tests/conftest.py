@@ -0,0 +1,37 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+ENGINE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'engine')
+# Engine modules import each other as top level modules and open shaders relative to engine/
+sys.path.insert(0, ENGINE)
+
+
+@pytest.fixture(autouse=True)
+def engine_directory(monkeypatch):
+    monkeypatch.chdir(ENGINE)
+
+
+# PyOpenGL picks its platform once per process, so everything that needs a headless context runs in a subprocess
+HEADLESS_PROBE = ("import headless; headless.select_platform('egl', True); "
+                  "headless.HeadlessContext.create('egl', (1, 1)).destroy()")
+
+
+def run_engine(*args, timeout=600):
+    """
+    Runs python with args in engine/ in a new process
+    """
+    return subprocess.run([sys.executable, *args], cwd=ENGINE, capture_output=True, text=True, timeout=timeout)
+
+
+@pytest.fixture(scope='session')
+def headless_gl():
+    """
+    Skips the test unless an OpenGL 4.6 core context can be created without a window
+    """
+    result = run_engine('-c', HEADLESS_PROBE)
+    if result.returncode != 0:
+        errors = [line for line in result.stderr.splitlines() if 'Error' in line]
+        pytest.skip(f"no headless OpenGL 4.6 context: {errors[-1] if errors else result.stderr.strip()}")
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from bvh import BVH, INFTY, intersect_triangles
+
+
+def random_triangles(count, seed=0, spread=10.0, size=0.5):
+    random = np.random.default_rng(seed)
+    centers = random.uniform(-spread, spread, size=(count, 1, 3))
+    return (centers + random.uniform(-size, size, size=(count, 3, 3))).astype(np.float32)
+
+
+def leaves(bvh):
+    return [node for node in bvh.nodes if node['count'] > 0]
+
+
+@pytest.mark.parametrize('count', [1, 2, 5, 100, 2000])
+def test_leaves_reference_every_triangle_once(count):
+    bvh = BVH(random_triangles(count))
+
+    referenced = np.concatenate([np.arange(node['left_first'], node['left_first'] + node['count'])
+                                 for node in leaves(bvh)])
+    assert np.array_equal(np.sort(referenced), np.arange(count))
+    assert np.array_equal(np.sort(bvh.order), np.arange(count))
+
+
+def test_node_bounds_contain_their_triangles_and_children():
+    triangles = random_triangles(2000)
+    bvh = BVH(triangles)
+    assert np.array_equal(bvh.vertices, triangles[bvh.order])
+
+    for node in bvh.nodes:
+        first = node['left_first']
+        if node['count'] > 0:
+            vertices = bvh.vertices[first:first + node['count']].reshape(-1, 3)
+            assert np.all(vertices >= node['bounds_min']) and np.all(vertices <= node['bounds_max'])
+        else:
+            for child in bvh.nodes[first:first + 2]:
+                assert np.all(child['bounds_min'] >= node['bounds_min'])
+                assert np.all(child['bounds_max'] <= node['bounds_max'])
+
+
+def test_leaves_are_small():
+    bvh = BVH(random_triangles(2000))
+    assert max(node['count'] for node in leaves(bvh)) <= 2 * BVH.MAX_LEAF_SIZE
+
+
+def test_large_scene_is_split():
+    # SAH costs of nodes this large exceed INFTY, they must still be compared with each other
+    bvh = BVH(random_triangles(1000, spread=1E4, size=10.0))
+    assert len(bvh.nodes) > 1
+    assert max(node['count'] for node in leaves(bvh)) <= 2 * BVH.MAX_LEAF_SIZE
+
+
+def test_coincident_triangles_are_split_in_half():
+    bvh = BVH(np.repeat(random_triangles(1), 64, axis=0))
+    assert len(bvh.nodes) > 1
+    assert max(node['count'] for node in leaves(bvh)) <= BVH.MAX_LEAF_SIZE
+
+
+def test_intersect_matches_brute_force():
+    triangles = random_triangles(500, spread=5.0)
+    bvh = BVH(triangles)
+    random = np.random.default_rng(1)
+
+    hits = 0
+    for _ in range(300):
+        origin = random.uniform(-8, 8, size=3).astype(np.float32)
+        # Aim at a random triangle so most rays hit something
+        target = triangles[random.integers(len(triangles))].mean(axis=0)
+        direction = (target - origin) * random.uniform(0.5, 2)
+
+        distance, index = bvh.intersect(origin, direction)
+        expected = intersect_triangles(bvh.vertices, origin, direction)
+        assert distance == pytest.approx(float(expected.min()), rel=1E-5)
+        if distance < INFTY:
+            hits += 1
+            assert expected[index] == pytest.approx(distance, rel=1E-5)
+        else:
+            assert index == -1
+    assert hits > 250
+
+
+def test_empty():
+    bvh = BVH(np.zeros((0, 3, 3)))
+    assert len(bvh.nodes) == 0
+    assert bvh.intersect((0, 0, 0), (0, 0, 1)) == (INFTY, -1)
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from conftest import run_engine
+from capture import FrameWriter, ReadbackRing
+
+
+def test_buffers_are_reused_in_order():
+    ring = ReadbackRing(['a', 'b', 'c'])
+    used = []
+    for number in range(7):
+        buffer = ring.acquire()
+        if buffer is None:
+            ring.release()
+            buffer = ring.acquire()
+        used.append(buffer)
+        assert ring.start(buffer, f'fence {number}') == number
+    assert used == ['a', 'b', 'c', 'a', 'b', 'c', 'a']
+    assert ring.stalls == 4
+
+
+def test_readbacks_are_released_in_start_order():
+    ring = ReadbackRing([1, 2])
+    ring.start(ring.acquire(), 'first', 10)
+    ring.start(ring.acquire(), 'second')
+    assert ring.oldest() == (1, 'first', 10)
+    assert ring.release() == (1, 'first', 10)
+    assert ring.release() == (2, 'second', 11)
+    assert ring.oldest() is None
+    # Freed buffers come back in the order they were released
+    assert [ring.acquire(), ring.acquire()] == [1, 2]
+
+
+def test_no_stall_while_readbacks_finish_in_time():
+    ring = ReadbackRing([1, 2])
+    for _ in range(10):
+        ring.start(ring.acquire(), None)
+        # Capture collects the finished readback before starting the next one
+        ring.release()
+    assert ring.stalls == 0 and ring.captured == 10
+
+
+def test_ring_errors():
+    with pytest.raises(ValueError):
+        ReadbackRing([])
+    with pytest.raises(RuntimeError):
+        ReadbackRing([1]).release()
+
+
+def test_writer_keeps_submission_order(tmp_path):
+    writer = FrameWriter(str(tmp_path / '{:03d}.raw'))
+    images = [np.full((2, 3, 4), number, dtype=np.uint8) for number in range(5)]
+    for number in (3, 0, 4, 1, 2):
+        assert writer.submit(number, images[number][::-1])
+    writer.close()
+    assert writer.written == [3, 0, 4, 1, 2]
+    assert np.array_equal(np.fromfile(tmp_path / '004.raw', dtype=np.uint8), images[4].ravel())
+
+
+@pytest.mark.parametrize('pattern, policy', [('frames.gif', 'block'), ('{:03d}.jpg', 'skip')])
+def test_writer_rejects_unknown_options(pattern, policy):
+    with pytest.raises(ValueError):
+        FrameWriter(pattern, policy)
+
+
+def test_sequence_captures_every_frame(tmp_path, headless_gl):
+    result = run_engine('batch.py', 'demo.ExampleSceneLoader', str(tmp_path / '{:02d}.raw'), '--resolution', '32', '18',
+                        '--samples', '1', '--frames', '12', '--yaw-step', '30', '--software')
+    assert result.returncode == 0, result.stderr
+    frames = [np.fromfile(tmp_path / f'{number:02d}.raw', dtype=np.uint8).reshape(18, 32, 4) for number in range(12)]
+    # Turntable frames differ from each other, a frame read back from a stale buffer would repeat the previous one
+    assert all(np.any(previous != frame) for previous, frame in zip(frames, frames[1:]))
+    assert 'waits for readback' in result.stdout
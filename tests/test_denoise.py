@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from denoise import denoise
+from reprojection import INFTY
+
+HEIGHT, WIDTH = 48, 64
+SIGMAS = dict(color_sigma=0.5, normal_sigma=0.1, albedo_sigma=0.1, depth_sigma=0.05)
+
+
+def features(left_albedo=0.5, right_albedo=0.5):
+    """
+    First hits of a wall facing the camera, the left and right half may have different materials
+    :return: (albedo, normal, depth)
+    """
+    albedo = np.empty((HEIGHT, WIDTH, 3), dtype=np.float32)
+    albedo[:, :WIDTH // 2] = left_albedo
+    albedo[:, WIDTH // 2:] = right_albedo
+    normal = np.zeros((HEIGHT, WIDTH, 3), dtype=np.float32)
+    normal[..., 2] = 1
+    return albedo, normal, np.full((HEIGHT, WIDTH), 5, dtype=np.float32)
+
+
+def halves(left, right):
+    color = np.empty((HEIGHT, WIDTH, 3), dtype=np.float32)
+    color[:, :WIDTH // 2] = left
+    color[:, WIDTH // 2:] = right
+    return color
+
+
+def run(color, albedo, normal, depth, samples):
+    samples = np.full((HEIGHT, WIDTH), samples, dtype=np.float32)
+    return denoise(color, albedo, normal, depth, samples, 3, **SIGMAS)
+
+
+def test_constant_image_is_unchanged():
+    color = np.full((HEIGHT, WIDTH, 3), 0.3, dtype=np.float32)
+    assert np.allclose(run(color, *features(), 1), 0.3, atol=1E-6)
+
+
+@pytest.mark.parametrize('samples', [1, 4, 64])
+def test_noise_is_reduced_and_mean_kept(samples):
+    random = np.random.default_rng(samples)
+    truth = halves(0.7, 0.2)
+    # Noise of the mean of samples falls with their square root, so does the color sigma of the filter
+    noisy = (truth + random.normal(0, 0.1, truth.shape) / np.sqrt(samples)).astype(np.float32)
+    result = run(noisy, *features(0.8, 0.2), samples)
+
+    assert np.mean((noisy - truth) ** 2) / np.mean((result - truth) ** 2) > 50
+    # Filter is a weighted mean of neighbours, means of both materials stay within the noise of the input mean
+    for columns in (slice(0, WIDTH // 2), slice(WIDTH // 2, WIDTH)):
+        standard_error = 0.1 / np.sqrt(samples * HEIGHT * WIDTH / 2)
+        assert abs(result[:, columns].mean() - truth[:, columns].mean()) < 10 * standard_error
+
+
+def test_material_edges_do_not_bleed():
+    random = np.random.default_rng(0)
+    truth = halves(0.7, 0.2)
+    noisy = (truth + random.normal(0, 0.1, truth.shape)).astype(np.float32)
+    result = run(noisy, *features(0.8, 0.2), 1)
+    # Columns at the edge average only their own side
+    assert abs(result[:, WIDTH // 2 - 1].mean() - 0.7) < 0.02
+    assert abs(result[:, WIDTH // 2].mean() - 0.2) < 0.02
+
+
+def test_sky_does_not_mix_with_surfaces():
+    albedo, normal, depth = features()
+    # Same albedo and normal as the surface and colors close enough to be mixed, only the distance tells the sky apart
+    depth[:, WIDTH // 2:] = INFTY
+    result = run(halves(0.45, 0.55), albedo, normal, depth, 1)
+    assert np.allclose(result[:, :WIDTH // 2], 0.45, atol=1E-3)
+    assert np.allclose(result[:, WIDTH // 2:], 0.55, atol=1E-3)
+
+
+def test_filter_fades_as_image_converges():
+    # Texture detail has the same first hit features, only color sigma keeps it
+    detail = halves(0.45, 0.55)
+    blurred = run(detail, *features(), 1)
+    converged = run(detail, *features(), 1024)
+    assert np.abs(blurred - detail).max() > 0.01
+    assert np.abs(converged - detail).max() < 1E-4
@@ -0,0 +1,174 @@
+import numpy as np
+import pytest
+
+from buffers import Buffers
+from dirty_ranges import DirtyRanges
+from scene import SceneLoader, Material, Color
+
+
+def covered(ranges):
+    return {index for start, end in ranges for index in range(start, end)}
+
+
+def check_ranges(dirty: DirtyRanges):
+    ranges = list(dirty)
+    assert all(start < end for start, end in ranges)
+    # Sorted, disjoint and separated by more than the merge gap
+    assert all(end + dirty.merge_gap < next_start for (_, end), (next_start, _) in zip(ranges, ranges[1:]))
+
+
+@pytest.mark.parametrize('merge_gap', [0, 1, 4])
+@pytest.mark.parametrize('seed', range(20))
+def test_random_marks_and_truncates(merge_gap, seed):
+    random = np.random.default_rng(seed)
+    dirty = DirtyRanges(merge_gap)
+    expected = set()
+    size = 200
+
+    for _ in range(100):
+        if random.random() < 0.1:
+            size = int(random.integers(0, 200))
+            dirty.truncate(size)
+            expected = {index for index in expected if index < size}
+        else:
+            start = int(random.integers(0, 200))
+            end = start + int(random.integers(0, 10))
+            dirty.mark(start, end)
+            expected |= set(range(start, end))
+            size = max(size, end)
+
+        check_ranges(dirty)
+        elements = covered(dirty)
+        # Merged ranges may cover a few clean elements, never anything past the truncated size
+        assert expected <= elements
+        assert all(index < size for index in elements)
+        if merge_gap == 0:
+            assert elements == expected
+        assert bool(dirty) == bool(expected)
+
+
+def test_mark_merges_within_gap():
+    dirty = DirtyRanges(2)
+    dirty.mark(0)
+    dirty.mark(3)
+    dirty.mark(10, 12)
+    assert list(dirty) == [(0, 4), (10, 12)]
+    assert dirty.size == 6
+
+    dirty.mark(5, 8)
+    assert list(dirty) == [(0, 12)]
+
+
+def test_empty_mark_is_ignored():
+    dirty = DirtyRanges()
+    dirty.mark(5, 5)
+    dirty.mark(5, 3)
+    assert not dirty
+
+
+def test_truncate_cuts_the_last_range():
+    dirty = DirtyRanges()
+    dirty.mark(0, 4)
+    dirty.mark(6, 10)
+    dirty.truncate(8)
+    assert list(dirty) == [(0, 4), (6, 8)]
+    dirty.truncate(6)
+    assert list(dirty) == [(0, 4)]
+    dirty.truncate(0)
+    assert not dirty
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_coalesced_merges_smallest_gaps(seed):
+    random = np.random.default_rng(seed)
+    dirty = DirtyRanges()
+    for start in random.choice(1000, size=40, replace=False):
+        dirty.mark(int(start), int(start) + int(random.integers(1, 4)))
+    ranges = list(dirty)
+
+    for max_ranges in (1, 5, len(ranges) - 1, len(ranges), len(ranges) + 3):
+        result = dirty.coalesced(max_ranges)
+        assert len(result) == min(len(ranges), max_ranges)
+        assert covered(ranges) <= covered(result)
+        assert all(end < next_start for (_, end), (next_start, _) in zip(result, result[1:]))
+
+        # Only the smallest gaps between ranges are uploaded as clean elements
+        gaps = sorted(next_start - end for (_, end), (next_start, _) in zip(ranges, ranges[1:]))
+        extra = sum(end - start for start, end in result) - dirty.size
+        assert extra == sum(gaps[:max(len(ranges) - max_ranges, 0)])
+
+
+class SpheresSceneLoader(SceneLoader):
+    def define_materials_list(self):
+        self.material = Material(Color(1, 1, 1), 0.5, self)
+
+
+@pytest.fixture
+def scene_loader():
+    scene_loader = SpheresSceneLoader(None)
+    scene_loader.add_spheres(np.arange(15, dtype=np.float32).reshape(5, 3), np.arange(1, 6), scene_loader.material)
+    return scene_loader
+
+
+def spheres(scene_loader):
+    return scene_loader.pack_buffers()[Buffers.SPHERES]
+
+
+def dirty(scene_loader, buffer):
+    return list(scene_loader._SceneLoader__dirty[buffer])
+
+
+def test_update_changes_one_record(scene_loader):
+    scene_loader.update(Buffers.SPHERES, 2, radius=10, center=(1, 2, 3))
+    assert np.array_equal(spheres(scene_loader)['radius'], [1, 2, 10, 4, 5])
+    assert np.array_equal(spheres(scene_loader)['center'][2], [1, 2, 3])
+    assert dirty(scene_loader, Buffers.SPHERES) == [(2, 3)]
+
+
+def test_update_without_change_is_not_dirty(scene_loader):
+    scene_loader.update(Buffers.SPHERES, 1, radius=2)
+    assert dirty(scene_loader, Buffers.SPHERES) == []
+
+
+@pytest.mark.parametrize('index', [-1, 5, 100])
+def test_update_out_of_range(scene_loader, index):
+    with pytest.raises(IndexError):
+        scene_loader.update(Buffers.SPHERES, index, radius=1)
+    assert np.array_equal(spheres(scene_loader)['radius'], [1, 2, 3, 4, 5])
+
+
+def test_update_static_buffer(scene_loader):
+    with pytest.raises(ValueError):
+        scene_loader.update(Buffers.TRIANGLES, 0, material=0)
+
+
+def test_remove_moves_last_record(scene_loader):
+    scene_loader.remove(Buffers.SPHERES, 1)
+    assert np.array_equal(spheres(scene_loader)['radius'], [1, 5, 3, 4])
+    assert dirty(scene_loader, Buffers.SPHERES) == [(1, 2)]
+
+    scene_loader.remove(Buffers.SPHERES, 3)
+    assert np.array_equal(spheres(scene_loader)['radius'], [1, 5, 3])
+    assert dirty(scene_loader, Buffers.SPHERES) == [(1, 2)]
+
+
+def test_remove_until_empty(scene_loader):
+    for _ in range(5):
+        scene_loader.remove(Buffers.SPHERES, 0)
+    assert len(spheres(scene_loader)) == 0
+    assert dirty(scene_loader, Buffers.SPHERES) == []
+
+    with pytest.raises(IndexError):
+        scene_loader.remove(Buffers.SPHERES, 0)
+
+
+@pytest.mark.parametrize('index', [-1, 5])
+def test_remove_out_of_range(scene_loader, index):
+    with pytest.raises(IndexError):
+        scene_loader.remove(Buffers.SPHERES, index)
+    assert len(spheres(scene_loader)) == 5
+
+
+def test_remove_material(scene_loader):
+    with pytest.raises(ValueError):
+        scene_loader.remove(Buffers.MATERIAlS, 0)
@@ -0,0 +1,212 @@
+import json
+
+import pytest
+
+from conftest import run_engine
+from dynamic_resolution import ResolutionController
+
+NATIVE = (1280, 720)
+BUDGET = 1 / 60
+
+
+def controller(native_time, native_resolution=NATIVE, **kwargs):
+    """
+    :param native_time: seconds a pass at the native resolution takes
+    """
+    resolution_controller = ResolutionController(native_resolution, BUDGET, scales=(1.0, 0.75, 0.5, 0.35),
+                                                 headroom=0.8, upscale_margin=0.7, **kwargs)
+    resolution_controller.record(native_resolution, native_time)
+    return resolution_controller
+
+
+def set_native_time(resolution_controller, native_time):
+    width, height = resolution_controller.native_resolution
+    resolution_controller.pixel_time = native_time / (width * height)
+
+
+def test_idle_frames_are_native():
+    resolution_controller = controller(0.1)
+    assert resolution_controller.resolution(moving=True) != NATIVE
+    assert resolution_controller.resolution(moving=False) == NATIVE
+    assert resolution_controller.level == 0
+
+
+def test_native_until_measured():
+    resolution_controller = ResolutionController(NATIVE, BUDGET)
+    assert resolution_controller.resolution(moving=True) == NATIVE
+
+
+def test_largest_scale_that_fits():
+    # 20 ms at native resolution doesn't fit 0.8 of 16.7 ms, 0.75 of it in both directions does
+    resolution_controller = controller(0.020)
+    assert resolution_controller.resolution(moving=True) == (960, 544)
+    assert resolution_controller.frame_time(1) <= BUDGET * 0.8
+
+
+def test_hysteresis():
+    resolution_controller = controller(0.020)
+    resolution_controller.resolution(moving=True)
+    assert resolution_controller.level == 1
+
+    # Native frame would fit the budget, but not the upscale margin of it, so the scale is kept
+    set_native_time(resolution_controller, 0.012)
+    assert resolution_controller.resolution(moving=True) == (960, 544)
+    set_native_time(resolution_controller, 0.0095)
+    assert resolution_controller.resolution(moving=True) == (960, 544)
+
+    set_native_time(resolution_controller, 0.009)
+    assert resolution_controller.resolution(moving=True) == NATIVE
+    # Back at native, the same cost doesn't lower it again
+    set_native_time(resolution_controller, 0.012)
+    assert resolution_controller.resolution(moving=True) == NATIVE
+
+
+@pytest.mark.parametrize('native_time', [0.2, 10.0])
+def test_clamped_to_smallest_scale(native_time):
+    resolution_controller = controller(native_time)
+    assert resolution_controller.resolution(moving=True) == (448, 248)
+    assert resolution_controller.level == len(resolution_controller.scales) - 1
+
+
+def test_several_levels_at_once():
+    resolution_controller = controller(0.001)
+    assert resolution_controller.resolution(moving=True) == NATIVE
+    # Cost jumps, the controller goes straight to the scale that fits and straight back
+    set_native_time(resolution_controller, 0.05)
+    assert resolution_controller.resolution(moving=True) == (640, 360)
+    set_native_time(resolution_controller, 0.001)
+    assert resolution_controller.resolution(moving=True) == NATIVE
+
+
+@pytest.mark.parametrize('native_resolution', [(1280, 720), (1366, 768), (20, 10), (1366, 767)])
+@pytest.mark.parametrize('scales', [(1.0, 0.75, 0.5, 0.35), (1.0, 0.999, 0.99, 0.01)])
+def test_scaled_resolution_alignment(native_resolution, scales):
+    resolution_controller = ResolutionController(native_resolution, BUDGET, scales=scales)
+    for level in range(1, len(scales)):
+        width, height = resolution_controller.scaled_resolution(level)
+        assert width % ResolutionController.ALIGNMENT == 0 and height % ResolutionController.ALIGNMENT == 0
+        # History buffers have the native size, a larger internal resolution would index past them
+        assert 0 < width <= native_resolution[0] and 0 < height <= native_resolution[1]
+
+
+def test_scaled_resolution_near_native():
+    # 0.999 of 1366 rounds up to the next multiple of the alignment, 1368, it's taken down to 1360
+    resolution_controller = ResolutionController((1366, 767), BUDGET, scales=(1.0, 0.999))
+    assert resolution_controller.scaled_resolution(1) == (1360, 760)
+
+
+@pytest.mark.parametrize('native_resolution, expected', [((6, 4), (6, 4)), ((12, 5), (8, 5)), ((1, 1), (1, 1))])
+def test_tiny_resolutions_are_not_enlarged(native_resolution, expected):
+    resolution_controller = ResolutionController(native_resolution, BUDGET, scales=(1.0, 0.75, 0.5))
+    assert resolution_controller.scaled_resolution(1) == expected
+    assert resolution_controller.scaled_resolution(2) == expected
+
+
+def test_record_smooths_pixel_time():
+    resolution_controller = controller(0.020)
+    resolution_controller.record((640, 360), 0.020)
+    # A single slow frame at a quarter of the pixels moves the average by SMOOTHING of the difference
+    expected = 0.020 / (1280 * 720) * (1 + 3 * ResolutionController.SMOOTHING)
+    assert resolution_controller.pixel_time == pytest.approx(expected)
+
+
+def test_scales_are_sorted():
+    resolution_controller = ResolutionController(NATIVE, BUDGET, scales=(0.5, 1.0, 0.75))
+    assert resolution_controller.scales == [1.0, 0.75, 0.5]
+
+
+@pytest.mark.parametrize('scales', [(), (1.0, 0.0), (1.5, 1.0), (-0.5,)])
+def test_invalid_scales(scales):
+    with pytest.raises(ValueError):
+        ResolutionController(NATIVE, BUDGET, scales=scales)
+
+
+# Converges the demo scene at the native and at a lower resolution, then switches between them keeping history.
+# Prints mean and median errors of the first frame after every switch and of following native frames
+SWITCH_SCRIPT = """
+import sys, json
+import headless
+headless.select_platform('egl', True)
+
+import config
+config.RESOLUTION = (64, 36)
+config.CACHE_PATH = sys.argv[1]
+config.BACKEND = sys.argv[2]
+SCALED = (32, 16)
+
+with headless.HeadlessContext.create('egl', config.RESOLUTION):
+    import numpy as np
+    import shader
+    from batch import read_pixels
+    from graphics import FrameState, Renderer
+    from demo import ExampleSceneLoader
+    from OpenGL.GL import glBindFramebuffer, GL_READ_FRAMEBUFFER
+
+    _, renderer, logic_provider = shader.create_renderer(FrameState(), ExampleSceneLoader)
+    fragment = isinstance(renderer, Renderer)
+
+    def image(resolution):
+        # Frames at lower resolution are in the corner of the offscreen image, native ones on the screen
+        if resolution != config.RESOLUTION:
+            glBindFramebuffer(GL_READ_FRAMEBUFFER, (renderer.target if fragment else renderer.accumulation).framebuffer)
+        pixels = read_pixels(resolution).astype(np.float64) / 255
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, 0)
+        return pixels
+
+    def converge(resolution, frames=32):
+        renderer.set_internal_resolution(resolution)
+        logic_provider.drop_mixed_frames()
+        for _ in range(frames):
+            renderer.render()
+        return image(resolution)
+
+    def errors(pixels, reference):
+        error = np.abs(pixels - reference)
+        return float(error.mean()), float(np.median(error))
+
+    native = converge(config.RESOLUTION)
+    result = {'allocated': fragment and renderer._Renderer__target is not None}
+    scaled = converge(SCALED)
+
+    converge(config.RESOLUTION, 8)
+    mixed_frames = logic_provider.mixed_frames
+    renderer.set_internal_resolution(SCALED)
+    renderer.render()
+    result['scaled'] = errors(image(SCALED), scaled)
+    result['kept'] = logic_provider.mixed_frames > mixed_frames
+
+    renderer.set_internal_resolution(config.RESOLUTION)
+    result['native'] = []
+    for _ in range(32):
+        renderer.render()
+        result['native'].append(errors(image(config.RESOLUTION), native))
+
+    # A single sample traced right after native frames, without history that would hide it
+    logic_provider.drop_mixed_frames()
+    renderer.set_internal_resolution(SCALED)
+    renderer.render()
+    result['dropped'] = errors(image(SCALED), scaled)
+    result['means'] = [float(native.mean()), float(scaled.mean()), float(image(SCALED).mean())]
+    print(json.dumps(result))
+"""
+
+
+@pytest.mark.parametrize('backend', ['fragment', 'compute'])
+def test_history_is_kept_across_resolution_changes(tmp_path, headless_gl, backend):
+    result = run_engine('-c', SWITCH_SCRIPT, str(tmp_path), backend)
+    assert result.returncode == 0, result.stderr
+    result = json.loads(result.stdout.strip().splitlines()[-1])
+
+    # Nothing is drawn offscreen before the first frame at lower resolution
+    assert not result['allocated']
+    assert result['kept']
+    # Resampled history is off only at edges, most pixels match the image converged at the lower resolution
+    mean, median = result['scaled']
+    assert mean < 0.03 and median < 0.01
+    # Frames drawn offscreen see the same scene as the native ones, also the first one after native frames
+    assert result['dropped'][0] < 0.03
+    native_mean, *scaled_means = result['means']
+    assert all(abs(mean - native_mean) < 0.03 for mean in scaled_means)
+    # Upscaled history fades quickly once the native resolution is back
+    assert result['native'][0][0] < 0.03
+    assert result['native'][-1][0] < 0.005
@@ -0,0 +1,94 @@
+import json
+
+import pytest
+
+from frame_loop import FrameInput, FrameLoop, FrameScheduler, FrameStats, write_trace, read_trace
+
+
+def test_trace_round_trip(tmp_path):
+    inputs = [
+        FrameInput(),
+        FrameInput((3, -2)),
+        FrameInput(keys=('w', 'left shift')),
+        FrameInput((-1, 0), ('a',)),
+    ]
+    path = tmp_path / 'walk.json'
+    write_trace(path, inputs, fps=30)
+
+    fps, loaded = read_trace(path)
+    assert fps == 30
+    assert [(frame.mouse_movement, frame.keys) for frame in loaded] == \
+        [(frame.mouse_movement, frame.keys) for frame in inputs]
+    assert [frame.empty for frame in loaded] == [True, False, False, False]
+
+
+def test_trace_defaults(tmp_path):
+    # Frames without input may be written without their fields
+    path = tmp_path / 'old.json'
+    path.write_text(json.dumps({'frames': [{}, {'keys': ['s']}]}))
+
+    fps, loaded = read_trace(path)
+    assert fps > 0
+    assert loaded[0].empty
+    assert loaded[1].keys == frozenset({'s'}) and loaded[1].mouse_movement == (0, 0)
+
+
+def test_scheduler_fills_idle_frames():
+    scheduler = FrameScheduler(frame_budget=0.1, max_passes=16, headroom=0.8)
+    assert scheduler.passes(moving=False) == 1
+
+    scheduler.record(1, 0.02)
+    assert scheduler.passes(moving=False) == 4
+    assert scheduler.passes(moving=True) == 1
+
+    # Cost of a pass is smoothed, a single cheap frame doesn't jump to max_passes
+    scheduler.record(4, 0.001)
+    assert 4 < scheduler.passes(moving=False) < 16
+    for _ in range(20):
+        scheduler.record(4, 0.001)
+    assert scheduler.passes(moving=False) == 16
+
+
+def test_scheduler_keeps_one_pass_when_over_budget():
+    scheduler = FrameScheduler(frame_budget=0.01, max_passes=16, headroom=0.8)
+    scheduler.record(1, 1.0)
+    assert scheduler.passes(moving=False) == 1
+
+
+class FakeRenderer:
+    def __init__(self):
+        self.presented = []
+
+    def render(self, present=True):
+        self.presented.append(present)
+
+
+class FakeMovementHandler:
+    def handle_frame_input(self, frame_input):
+        return frame_input.mouse_movement != (0, 0)
+
+
+def test_loop_presents_last_pass_and_collects_stats():
+    renderer = FakeRenderer()
+    scheduler = FrameScheduler(frame_budget=1.0, max_passes=3, headroom=1.0)
+    stats = FrameStats()
+    loop = FrameLoop(renderer, FakeMovementHandler(), 2, scheduler, stats=stats)
+
+    for frame_input in (FrameInput(), FrameInput(), FrameInput((1, 0)), FrameInput()):
+        loop.frame(frame_input)
+        loop.present()
+
+    # First frame has no measurement yet, rendering takes no time so the others fill max_passes unless moving
+    assert renderer.presented == [True, False, False, True, True, False, False, True]
+    summary = stats.summary()
+    assert summary['moving']['frames'] == 1
+    assert summary['idle']['frames'] == 2
+    assert loop.passes == 3
+
+
+@pytest.mark.parametrize('passes', [1, 5])
+def test_stats_samples_per_second(passes):
+    stats = FrameStats()
+    for _ in range(10):
+        stats.add(0.02, passes * 4, moving=False)
+    assert stats.summary()['idle']['samples_per_second'] == pytest.approx(passes * 4 / 0.02)
@@ -0,0 +1,86 @@
+import ctypes.util
+import json
+
+import numpy as np
+import pytest
+
+import headless
+from conftest import run_engine
+
+
+def render(tmp_path, *args):
+    output = tmp_path / f"{'_'.join(args) or 'default'}.png"
+    result = run_engine('batch.py', 'demo.ExampleSceneLoader', str(output), '--resolution', '64', '36',
+                        '--samples', '64', '--software', *args)
+    assert result.returncode == 0, result.stderr
+
+    import pygame
+    # Rows of surfarray are columns of the image
+    return pygame.surfarray.array3d(pygame.image.load(str(output))).astype(np.float64) / 255
+
+
+def test_backends_render_the_same_image(tmp_path, headless_gl):
+    fragment = render(tmp_path, '--backend', 'fragment')
+    compute = render(tmp_path, '--backend', 'compute')
+
+    assert fragment.shape == compute.shape == (64, 36, 3)
+    assert fragment.mean() > 0.05
+    # Both estimate the same image with independent noise, their means agree
+    assert abs(fragment.mean() - compute.mean()) < 0.02
+    assert np.abs(fragment - compute).mean() < 0.03
+
+
+# Renders a small field of scaled and rotated rocks as instances and as copied triangles, prints both images
+INSTANCES_SCRIPT = """
+import sys, json
+import headless
+headless.select_platform('egl', True)
+
+import config
+config.RESOLUTION = (64, 36)
+config.CACHE_PATH = sys.argv[1]
+
+with headless.HeadlessContext.create('egl', config.RESOLUTION):
+    import shader
+    from batch import read_pixels
+    from graphics import FrameState
+    from demo import InstancesSceneLoader, FlattenedSceneLoader
+
+    images = []
+    for base in (InstancesSceneLoader, FlattenedSceneLoader):
+        loader = type('Small' + base.__name__, (base,), {'GRID': 4, 'ROCK_SUBDIVISIONS': 2})
+        _, renderer, _ = shader.create_renderer(FrameState(), loader)
+        for _ in range(32):
+            renderer.render()
+        images.append((read_pixels(config.RESOLUTION) / 255).tolist())
+    print(json.dumps(images))
+"""
+
+
+def test_instances_render_like_copied_triangles(tmp_path, headless_gl):
+    result = run_engine('-c', INSTANCES_SCRIPT, str(tmp_path))
+    assert result.returncode == 0, result.stderr
+    instanced, flattened = np.array(json.loads(result.stdout.strip().splitlines()[-1]))
+
+    # Rocks are scaled down, their object space rays are longer than world ones. Misses there must stay misses
+    assert np.abs(instanced - flattened).mean() < 0.005
+    assert abs(instanced.mean() - flattened.mean()) < 0.002
+
+
+def test_unknown_platform():
+    with pytest.raises(ValueError):
+        headless.select_platform('glx')
+
+
+def test_missing_library(monkeypatch):
+    monkeypatch.setattr(ctypes.util, 'find_library', lambda name: None)
+    with pytest.raises(RuntimeError, match='libOSMesa'):
+        headless.select_platform('osmesa')
+
+
+def test_missing_library_is_reported_by_batch():
+    if ctypes.util.find_library('OSMesa') is not None:
+        pytest.skip("OSMesa is installed")
+    result = run_engine('batch.py', 'demo.ExampleSceneLoader', 'unused.png', '--platform', 'osmesa', '--software')
+    assert result.returncode != 0
+    assert "libOSMesa isn't installed" in result.stderr
@@ -0,0 +1,92 @@
+import os
+import re
+
+import numpy as np
+import pytest
+
+from bvh import NODE_DTYPE
+from scene import Material, Sphere, Plane, Triangle, Lens, Instance, SceneLoader
+
+# (size, alignment) of std430 scalar and vector types
+BASIC_TYPES = {
+    'float': (4, 4), 'int': (4, 4), 'uint': (4, 4), 'bool': (4, 4),
+    'vec2': (8, 8), 'ivec2': (8, 8), 'uvec2': (8, 8),
+    'vec3': (12, 16), 'ivec3': (12, 16), 'uvec3': (12, 16),
+    'vec4': (16, 16), 'ivec4': (16, 16), 'uvec4': (16, 16),
+}
+
+STRUCT = re.compile(r'^struct\s+(\w+)\s*\{(.*?)\};', re.MULTILINE | re.DOTALL)
+MEMBER = re.compile(r'^\s*(\w+)\s+(\w+)\s*(?:\[(\d+)\])?\s*;', re.MULTILINE)
+
+
+def round_up(value, alignment):
+    return (value + alignment - 1) // alignment * alignment
+
+
+def std430_structs(path):
+    """
+    :return: {struct name: (member offsets in declaration order, size, alignment)} of all structs of the source
+    """
+    with open(path) as file:
+        source = re.sub(r'//.*', '', file.read())
+
+    structs = {}
+    for name, body in STRUCT.findall(source):
+        offset, alignment, offsets = 0, 4, []
+        for member_type, _, array in MEMBER.findall(body):
+            if member_type in BASIC_TYPES:
+                size, member_alignment = BASIC_TYPES[member_type]
+            else:
+                _, size, member_alignment = structs[member_type]
+            if array:
+                # std430 array stride is the element size rounded up to its alignment, not to vec4
+                size = round_up(size, member_alignment) * int(array)
+            offset = round_up(offset, member_alignment)
+            offsets.append(offset)
+            offset += size
+            alignment = max(alignment, member_alignment)
+        structs[name] = (offsets, round_up(offset, alignment), alignment)
+    return structs
+
+
+STRUCTS = std430_structs(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'shaders', 'trace.glsl'))
+
+
+@pytest.mark.parametrize('struct, dtype', [
+    ('Material', Material.DTYPE),
+    ('Sphere', Sphere.DTYPE),
+    ('Plane', Plane.DTYPE),
+    ('Triangle', Triangle.DTYPE),
+    ('Lens', Lens.DTYPE),
+    ('BVHNode', NODE_DTYPE),
+    ('Instance', Instance.DTYPE),
+])
+def test_dtype_matches_std430_struct(struct, dtype):
+    offsets, size, _ = STRUCTS[struct]
+    assert [dtype.fields[name][1] for name in dtype.names] == offsets
+    assert dtype.itemsize == size
+
+
+def test_fields_fit_their_slots():
+    for dtype in (Material.DTYPE, Sphere.DTYPE, Plane.DTYPE, Triangle.DTYPE, Lens.DTYPE, NODE_DTYPE, Instance.DTYPE):
+        ends = [dtype.fields[name][1] + dtype.fields[name][0].itemsize for name in dtype.names]
+        starts = [dtype.fields[name][1] for name in dtype.names][1:] + [dtype.itemsize]
+        assert all(end <= start for end, start in zip(ends, starts)), dtype
+
+
+def test_packed_records_are_readable_by_offset():
+    record = np.zeros(1, dtype=Triangle.DTYPE)
+    record['c'] = (1, 2, 3)
+    record['material'] = 7
+    data = record.view(np.uint8)
+    assert np.array_equal(data[32:44].view('<f4'), [1, 2, 3])
+    assert data[44:48].view('<i4')[0] == 7
+
+
+def test_concatenate_keeps_padding():
+    spheres = np.zeros(2, dtype=Sphere.DTYPE)
+    spheres['radius'] = (1, 2)
+    result = SceneLoader.concatenate(spheres, spheres[:1])
+    assert result.dtype == Sphere.DTYPE
+    assert result.nbytes == 3 * STRUCTS['Sphere'][1]
+    assert np.array_equal(result['radius'], [1, 2, 1])
@@ -0,0 +1,174 @@
+import json
+import struct
+
+import numpy as np
+import pytest
+
+import config
+import mesh
+from buffers import Buffers
+from scene import SceneLoader
+
+
+@pytest.fixture(autouse=True)
+def cache_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'CACHE_PATH', str(tmp_path / 'cache'))
+
+
+def write_glb(path, gltf, binary: bytes):
+    binary += b'\0' * (-len(binary) % 4)
+    text = json.dumps(gltf).encode()
+    text += b' ' * (-len(text) % 4)
+    length = 12 + 8 + len(text) + 8 + len(binary)
+    with open(path, 'wb') as file:
+        file.write(struct.pack('<4sII', b'glTF', 2, length))
+        file.write(struct.pack('<II', len(text), mesh.GlbParser.JSON_CHUNK) + text)
+        file.write(struct.pack('<II', len(binary), mesh.GlbParser.BIN_CHUNK) + binary)
+
+
+def triangle_gltf(nodes, **fields):
+    """
+    One triangle mesh with positions in the bin chunk, placed by nodes
+    """
+    positions = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0]], dtype=np.float32)
+    gltf = {
+        'asset': {'version': '2.0'},
+        'buffers': [{'byteLength': positions.nbytes}],
+        'bufferViews': [{'buffer': 0, 'byteLength': positions.nbytes}],
+        'accessors': [{'bufferView': 0, 'componentType': 5126, 'count': 3, 'type': 'VEC3'}],
+        'meshes': [{'primitives': [{'attributes': {'POSITION': 0}}]}],
+        'nodes': nodes,
+        **fields,
+    }
+    return gltf, positions.tobytes()
+
+
+def test_obj_polygons_and_relative_indices(tmp_path):
+    path = tmp_path / 'quad.obj'
+    path.write_text("v 0 0 0\nv 1 0 0\nv 1 1 0\nv 0 1 0\n"
+                    "f 1/1/1 2/2/1 3/3/1 4/4/1\n"
+                    "v 0 0 1\nf -1 1 2\n")
+
+    parsed = mesh.load_mesh(str(path), cache=False)
+    assert parsed.vertices.shape == (3, 3, 3)
+    assert np.array_equal(parsed.vertices[0], [[0, 0, 0], [1, 0, 0], [1, 1, 0]])
+    assert np.array_equal(parsed.vertices[1], [[0, 0, 0], [1, 1, 0], [0, 1, 0]])
+    assert np.array_equal(parsed.vertices[2], [[0, 0, 1], [0, 0, 0], [1, 0, 0]])
+    assert np.array_equal(parsed.material_ids, [-1, -1, -1])
+
+
+def test_obj_materials(tmp_path):
+    (tmp_path / 'box.mtl').write_text("newmtl red\nKd 1 0 0\nPr 0.25\nnewmtl glass\nd 0.5\nNi 1.5\n")
+    path = tmp_path / 'box.obj'
+    path.write_text("mtllib box.mtl\nv 0 0 0\nv 1 0 0\nv 0 1 0\n"
+                    "usemtl red\nf 1 2 3\nusemtl glass\nf 1 3 2\n")
+
+    parsed = mesh.load_mesh(str(path), cache=False)
+    assert np.array_equal(parsed.material_ids, [0, 1])
+    red, glass = parsed.materials
+    assert red.color == (1, 0, 0) and red.roughness == 0.25 and not red.transparent
+    assert glass.transparent and glass.optical_density == 1.5
+
+
+def test_cache_follows_mtl_changes(tmp_path):
+    mtl = tmp_path / 'box.mtl'
+    mtl.write_text("newmtl red\nKd 1 0 0\n")
+    path = tmp_path / 'box.obj'
+    path.write_text("mtllib box.mtl\nv 0 0 0\nv 1 0 0\nv 0 1 0\nusemtl red\nf 1 2 3\n")
+
+    assert mesh.load_mesh(str(path)).materials[0].color == (1, 0, 0)
+    # Cached entry is read back the same
+    assert mesh.load_mesh(str(path)).materials[0].color == (1, 0, 0)
+
+    mtl.write_text("newmtl red\nKd 0 0 1\n")
+    assert mesh.load_mesh(str(path)).materials[0].color == (0, 0, 1)
+
+    mtl.unlink()
+    assert mesh.load_mesh(str(path)).materials[0].color == (0.8, 0.8, 0.8)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 7, 1 << 22])
+def test_obj_dependencies_across_chunks(tmp_path, monkeypatch, chunk_size):
+    monkeypatch.setattr(mesh.ObjParser, 'CHUNK_SIZE', chunk_size)
+    path = tmp_path / 'box.obj'
+    path.write_bytes(b"mtllib a b.mtl \r\nv 0 0 0\nmtllib\tc.mtl\n# mtllib comment.mtl\nmtllib last.mtl")
+    assert mesh.ObjParser.dependencies(str(path)) == [str(tmp_path / name) for name in ('a b.mtl', 'c.mtl', 'last.mtl')]
+
+
+def test_cached_mesh_matches_parsed(tmp_path):
+    path = tmp_path / 'fan.obj'
+    path.write_text("v 0 0 0\nv 1 0 0\nv 1 1 0\nv 0 1 0\nv -1 1 0\nf 1 2 3 4 5\n")
+
+    parsed = mesh.load_mesh(str(path), cache=False)
+    mesh.load_mesh(str(path))
+    cached = mesh.load_mesh(str(path))
+    assert np.array_equal(cached.vertices, parsed.vertices)
+    assert np.array_equal(cached.material_ids, parsed.material_ids)
+
+
+def test_glb_without_scenes_imports_children_once(tmp_path):
+    # Node 0 is the root of 1, which moves the triangle by 10 along x, node 2 is a separate root
+    nodes = [
+        {'children': [1], 'translation': [0, 0, 5]},
+        {'mesh': 0, 'translation': [10, 0, 0]},
+        {'mesh': 0},
+    ]
+    path = tmp_path / 'nodes.glb'
+    write_glb(path, *triangle_gltf(nodes))
+
+    parsed = mesh.load_mesh(str(path), cache=False)
+    assert parsed.vertices.shape == (2, 3, 3)
+    origins = sorted(map(tuple, parsed.vertices[:, 0]))
+    assert origins == [(0, 0, 0), (10, 0, 5)]
+
+
+def test_glb_scene_selects_roots(tmp_path):
+    nodes = [{'mesh': 0, 'translation': [1, 2, 3]}, {'mesh': 0}]
+    path = tmp_path / 'scene.glb'
+    write_glb(path, *triangle_gltf(nodes, scenes=[{'nodes': [1]}, {'nodes': [0]}], scene=1))
+
+    parsed = mesh.load_mesh(str(path), cache=False)
+    assert np.array_equal(parsed.vertices[0], [[1, 2, 3], [2, 2, 3], [1, 3, 3]])
+
+
+class EmptySceneLoader(SceneLoader):
+    def define_materials_list(self):
+        pass
+
+
+def test_imported_glass_does_not_disperse(tmp_path):
+    (tmp_path / 'glass.mtl').write_text("newmtl glass\nd 0.5\nNi 1.5\n")
+    path = tmp_path / 'glass.obj'
+    path.write_text("mtllib glass.mtl\nv 0 0 0\nv 1 0 0\nv 0 1 0\nusemtl glass\nf 1 2 3\n")
+
+    scene_loader = EmptySceneLoader(None)
+    mesh.import_mesh(scene_loader, str(path))
+    glass, = scene_loader.materials
+    # MTL has no dispersion, the material takes the single shared path of non-dispersive glass
+    assert glass.transparent and glass.dispersion_coefficient == 0
+    assert not np.any(scene_loader.pack_buffers()[Buffers.MATERIAlS]['dispersion_coefficient'])
+
+
+def test_glb_dispersion(tmp_path):
+    materials = [
+        {'name': 'glass', 'extensions': {'KHR_materials_transmission': {}}},
+        {'name': 'flint', 'extensions': {'KHR_materials_transmission': {}, 'KHR_materials_ior': {'ior': 1.6},
+                                         'KHR_materials_dispersion': {'dispersion': 0.5}}},
+    ]
+    gltf, binary = triangle_gltf([{'mesh': 0}], materials=materials)
+    primitive = gltf['meshes'][0]['primitives'][0]
+    gltf['meshes'][0]['primitives'] = [primitive | {'material': 0}, primitive | {'material': 1}]
+    path = tmp_path / 'glass.glb'
+    write_glb(path, gltf, binary)
+
+    glass, flint = mesh.load_mesh(str(path)).materials
+    assert glass.dispersion_coefficient == 0
+    # Abbe number 40, n_F - n_C = 0.6 / 40 is the red to blue spread of 0.4 of the coefficient
+    assert flint.dispersion_coefficient == pytest.approx(0.6 / 40 / 0.4)
+
+
+def test_unsupported_format(tmp_path):
+    path = tmp_path / 'model.fbx'
+    path.write_bytes(b'')
+    with pytest.raises(ValueError):
+        mesh.load_mesh(str(path))
@@ -0,0 +1,126 @@
+import csv
+import json
+
+import numpy as np
+import pytest
+
+import profiler
+from profiler import Profiler, RingBuffer, StageStats
+
+
+def test_ring_buffer_before_wrap_around():
+    ring = RingBuffer(4)
+    assert len(ring.values()) == 0
+    for value in (1, 2, 3):
+        ring.append(value)
+    assert ring.values().tolist() == [1, 2, 3]
+
+
+@pytest.mark.parametrize('count', [4, 5, 9, 10])
+def test_ring_buffer_keeps_last_values_from_oldest(count):
+    ring = RingBuffer(4)
+    for value in range(count):
+        ring.append(value)
+    assert ring.values().tolist() == list(range(count - 4, count))
+
+
+def test_ring_buffer_values_are_copies():
+    ring = RingBuffer(2)
+    ring.append(1)
+    ring.values()[0] = 5
+    ring.append(2)
+    ring.values()[:] = 5
+    assert ring.values().tolist() == [1, 2]
+
+
+def test_ring_buffer_capacity():
+    with pytest.raises(ValueError):
+        RingBuffer(0)
+
+
+def test_percentiles_of_uniform_timings():
+    stats = StageStats(capacity=101)
+    # 0 to 100 ms in random order, percentiles interpolate to the same milliseconds
+    for milliseconds in np.random.default_rng(0).permutation(101):
+        stats.add('trace', 'cpu', milliseconds * 1E-3)
+    metrics = stats.summary()['trace']['cpu']
+    assert metrics['count'] == 101
+    for name, expected in (('mean_ms', 50), ('p50_ms', 50), ('p95_ms', 95), ('p99_ms', 99), ('max_ms', 100)):
+        assert metrics[name] == pytest.approx(expected)
+
+
+def test_percentiles_see_only_recent_timings():
+    stats = StageStats(capacity=10)
+    # A slow start is overwritten once the ring wraps around
+    for _ in range(10):
+        stats.add('trace', 'cpu', 1.0)
+    for milliseconds in range(1, 16):
+        stats.add('trace', 'cpu', milliseconds * 1E-3)
+    metrics = stats.summary()['trace']['cpu']
+    assert metrics['count'] == 10
+    assert metrics['max_ms'] == pytest.approx(15)
+    assert metrics['p50_ms'] == pytest.approx(10.5)
+    assert metrics['mean_ms'] == pytest.approx(10.5)
+    assert np.allclose(stats.values('trace', 'cpu'), np.arange(6, 16) * 1E-3)
+
+
+def test_percentile_of_rare_spikes():
+    stats = StageStats(capacity=100)
+    for index in range(100):
+        stats.add('frame', 'cpu', 0.050 if index % 20 == 0 else 0.010)
+    metrics = stats.summary()['frame']['cpu']
+    # 5 spikes in 100 frames lift the tail but not the median
+    assert metrics['p50_ms'] == pytest.approx(10)
+    assert metrics['p99_ms'] == pytest.approx(50)
+    assert metrics['mean_ms'] == pytest.approx(12)
+
+
+def test_stages_and_clocks_are_separate():
+    stats = StageStats(capacity=4)
+    stats.add('upload', 'cpu', 0.001)
+    stats.add('trace', 'gpu', 0.004)
+    stats.add('trace', 'cpu', 0.002)
+    summary = stats.summary()
+    assert list(summary) == ['upload', 'trace']
+    assert summary['trace']['gpu']['max_ms'] == pytest.approx(4)
+    assert summary['trace']['cpu']['max_ms'] == pytest.approx(2)
+    assert len(stats.values('present', 'cpu')) == 0
+    assert stats.overlay_text() == 'upload 1.00 | trace 2.00 [4.00] ms'
+
+    with pytest.raises(ValueError):
+        stats.add('trace', 'wall', 0.001)
+
+
+def test_write_summary(tmp_path):
+    stats = StageStats(capacity=4)
+    for seconds in (0.001, 0.003):
+        stats.add('trace', 'cpu', seconds)
+        stats.add('trace', 'gpu', seconds * 2)
+
+    stats.write(str(tmp_path / 'profile.json'))
+    assert json.loads((tmp_path / 'profile.json').read_text()) == stats.summary()
+
+    stats.write(str(tmp_path / 'profile.csv'))
+    with open(tmp_path / 'profile.csv', newline='') as file:
+        rows = list(csv.DictReader(file))
+    assert [(row['stage'], row['clock']) for row in rows] == [('trace', 'cpu'), ('trace', 'gpu')]
+    assert float(rows[1]['mean_ms']) == pytest.approx(4)
+
+
+def test_cpu_profiler_records_stages_and_frames(monkeypatch):
+    instance = Profiler(gpu=False, capacity=8)
+    monkeypatch.setattr(profiler, 'stage', profiler.stage)
+    monkeypatch.setattr(profiler, 'end_frame', profiler.end_frame)
+    monkeypatch.setattr(profiler, 'active', None)
+    assert profiler.stage('trace') is profiler.NULL_STAGE
+
+    profiler.enable(instance)
+    for _ in range(3):
+        with profiler.stage('trace', gpu=True):
+            pass
+        profiler.end_frame()
+    summary = instance.stats.summary()
+    # GPU stages are timed on CPU only without queries, frames are the time between end_frame calls
+    assert summary['trace'].keys() == {'cpu'}
+    assert summary['trace']['cpu']['count'] == 3
+    assert summary['frame']['cpu']['count'] == 2
@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+from demo import ExampleSceneLoader
+from reference import ReferenceRenderer, convergence
+from scene import SceneLoader, Material, Color, Sun, Vector
+
+RESOLUTION = (32, 18)
+
+
+class FurnaceSceneLoader(SceneLoader):
+    """
+    White rough and glass spheres, nothing absorbs light so every pixel is the color of a uniform sky
+    """
+
+    def define_materials_list(self):
+        self.white = Material(Color(1, 1, 1), 1.0, self)
+        self.glass = Material(Color(1, 1, 1), 0.0, self, True, 1.5)
+
+
+def furnace_buffers():
+    scene_loader = FurnaceSceneLoader(None)
+    scene_loader.add_spheres(np.array([[0, 0, 5.0], [1.5, 0, 4]]), np.array([1.0, 0.5]), scene_loader.white)
+    scene_loader.add_spheres(np.array([[-1.5, 0, 4]]), np.array([0.5]), scene_loader.glass)
+    return scene_loader.pack_buffers()
+
+
+@pytest.mark.parametrize('value', [128, 255])
+def test_furnace(value):
+    skybox = np.full((6, 4, 4, 3), value, dtype=np.uint8)
+    # Roulette off and enough bounces for rays caught between the spheres to escape
+    renderer = ReferenceRenderer(furnace_buffers(), skybox, max_bounces=32, min_bounces=32)
+    image, rays = renderer.render(RESOLUTION, (0, 0, 0), np.eye(3), 8, workers=1)
+
+    assert image.shape == (RESOLUTION[1], RESOLUTION[0], 3)
+    assert rays > RESOLUTION[0] * RESOLUTION[1] * 8
+    assert np.allclose(image, value / 255, atol=1E-5)
+
+
+def test_furnace_bounce_limit_keeps_throughput():
+    # Paths that run out of bounces add their throughput of 1, the white furnace stays exact even with roulette
+    skybox = np.full((6, 4, 4, 3), 255, dtype=np.uint8)
+    renderer = ReferenceRenderer(furnace_buffers(), skybox, max_bounces=2, min_bounces=1)
+    image, _ = renderer.render(RESOLUTION, (0, 0, 0), np.eye(3), 8, workers=1)
+    assert np.allclose(image, 1.0, atol=1E-5)
+
+
+def test_convergence_counts_and_exact_furnace():
+    skybox = np.full((6, 4, 4, 3), 255, dtype=np.uint8)
+    renderers = {
+        'roulette': ReferenceRenderer(furnace_buffers(), skybox, max_bounces=2, min_bounces=1),
+        'no roulette': ReferenceRenderer(furnace_buffers(), skybox, max_bounces=2, min_bounces=2),
+    }
+    counts, results = convergence(renderers, (16, 9), (0, 0, 0), np.eye(3), 6, workers=1)
+
+    assert counts == [1, 2, 4, 6]
+    assert list(results) == list(renderers)
+    # White furnace has no variance, every count matches the ground truth
+    for errors, seconds, rays in results.values():
+        assert np.allclose(errors, 0, atol=1E-5)
+        assert seconds > 0 and rays >= 16 * 9 * 6
+
+
+def test_sun_without_next_event_estimation_is_unbiased():
+    # Under a black sky the sun is the only light, escaped paths alone have to estimate the same mean as shadow rays
+    skybox = np.zeros((6, 4, 4, 3), dtype=np.uint8)
+    sun = Sun(Vector(-20.0, 30.0, -10.0), 10.0, Color(4.0, 4.0, 4.0))
+    nee = ReferenceRenderer(furnace_buffers(), skybox, sun=sun)
+    bsdf = ReferenceRenderer(furnace_buffers(), skybox, sun=sun, next_event_estimation=False)
+    nee_image, nee_rays = nee.render(RESOLUTION, (0, 0, 0), np.eye(3), 16, workers=1)
+    bsdf_image, bsdf_rays = bsdf.render(RESOLUTION, (0, 0, 0), np.eye(3), 128, workers=1)
+
+    assert nee_image.mean() > 0.01
+    assert bsdf_image.mean() == pytest.approx(nee_image.mean(), rel=0.05)
+    # No shadow rays, the paths alone are traced
+    assert bsdf_rays < nee_rays * 128 / 16
+
+
+@pytest.fixture
+def demo_renderer():
+    return ReferenceRenderer.from_scene_loader(ExampleSceneLoader(None))
+
+
+def test_demo_mean_within_confidence_interval(demo_renderer):
+    # Means of independent single sample images estimate the image mean, a render of other samples of the
+    # sequence has to land within the confidence interval of that estimate
+    means = [demo_renderer.render(RESOLUTION, (0, 0, -1), np.eye(3), 1, workers=1, first_sample=index)[0].mean()
+             for index in range(8)]
+    interval = 4 * np.std(means, ddof=1) / np.sqrt(len(means))
+
+    image, _ = demo_renderer.render(RESOLUTION, (0, 0, -1), np.eye(3), 8, workers=1, first_sample=100)
+    assert abs(image.mean() - np.mean(means)) < interval
+    assert np.all(np.isfinite(image)) and np.all(image >= 0)
+
+
+def test_demo_noise_falls_with_samples(demo_renderer):
+    # Pixel variance of the mean of n samples falls at least like 1 / n, faster with the low discrepancy R2 sequence
+    few = [demo_renderer.render(RESOLUTION, (0, 0, -1), np.eye(3), 1, workers=1, first_sample=index)[0]
+           for index in (0, 1)]
+    many = [demo_renderer.render(RESOLUTION, (0, 0, -1), np.eye(3), 4, workers=1, first_sample=index)[0]
+            for index in (8, 12)]
+    ratio = np.var(few[0] - few[1]) / np.var(many[0] - many[1])
+    assert ratio > 3
+
+
+def test_hash_sampler_estimates_same_mean(demo_renderer):
+    # The sin hash kept for --convergence sampler is noisier than R2 but has to converge to the same image
+    hashed = ReferenceRenderer.from_scene_loader(ExampleSceneLoader(None), hash_sampler=True)
+    image, _ = demo_renderer.render(RESOLUTION, (0, 0, -1), np.eye(3), 8, workers=1)
+    hashed_image, _ = hashed.render(RESOLUTION, (0, 0, -1), np.eye(3), 8, workers=1)
+    assert np.all(np.isfinite(hashed_image)) and np.all(hashed_image >= 0)
+    assert hashed_image.mean() == pytest.approx(image.mean(), rel=0.01)
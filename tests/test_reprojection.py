@@ -0,0 +1,163 @@
+import numpy as np
+import pytest
+
+from reprojection import INFTY, Camera, accumulate, camera_rays, pixel_centres, project, reproject
+
+RESOLUTION = (64, 36)
+WALL = 10.0
+LIMIT = 16
+TOLERANCE = 0.05
+
+
+def yaw(angle):
+    cos, sin = np.cos(angle), np.sin(angle)
+    return np.array([[cos, 0, sin], [0, 1, 0], [-sin, 0, cos]], dtype=np.float32)
+
+
+def trace_wall(camera, resolution=RESOLUTION):
+    """
+    First hits of a wall at z = WALL filling the view
+    :return: (hit points of shape (height, width, 3), distances of shape (height, width))
+    """
+    directions = camera_rays(pixel_centres(resolution), resolution, camera)
+    distance = (WALL - camera.position[2]) / directions[..., 2]
+    return camera.position + directions * distance[..., None], distance.astype(np.float32)
+
+
+def wall_color(points):
+    # Linear in the position on the wall, bilinear resampling of it is nearly exact
+    return np.stack((points[..., 0] * 0.1 + 0.5, points[..., 1] * 0.1 + 0.5, np.full(points.shape[:2], 0.25)), axis=-1)
+
+
+def reproject_wall(prev_camera, camera, history_samples=8.0, prev_resolution=RESOLUTION, resolution=RESOLUTION):
+    points, history_distance = trace_wall(prev_camera, prev_resolution)
+    history_color = wall_color(points).astype(np.float32)
+    samples = np.full(history_distance.shape, history_samples, dtype=np.float32)
+    expected_points, hit_distance = trace_wall(camera, resolution)
+    color, samples = reproject(history_color, samples, history_distance, hit_distance, resolution, camera,
+                               prev_camera, LIMIT, TOLERANCE, prev_resolution)
+    return color, samples, wall_color(expected_points)
+
+
+def test_project_inverts_camera_rays():
+    camera = Camera((1, 2, -3), yaw(0.3))
+    points, _ = trace_wall(camera)
+    coord, visible = project(points, None, np.zeros(points.shape[:2], dtype=bool), RESOLUTION, camera)
+    assert np.all(visible)
+    assert np.allclose(coord, pixel_centres(RESOLUTION), atol=1E-3)
+
+
+def test_static_camera_keeps_history():
+    camera = Camera((0, 0, 0), np.eye(3))
+    color, samples, expected = reproject_wall(camera, camera, history_samples=100)
+    assert np.allclose(color, expected, atol=1E-6)
+    assert np.all(samples == LIMIT)
+
+
+@pytest.mark.parametrize('position, rotation, coverage', [
+    ((0.3, 0, 0), np.eye(3), 0.95),
+    ((0, 0.2, 0), np.eye(3), 0.95),
+    ((0, 0, 1.0), np.eye(3), 0.99),
+    ((0, 0, -1.0), np.eye(3), 0.75),
+    ((0, 0, 0), yaw(0.05), 0.9),
+    ((0.2, 0.1, 0.5), yaw(-0.03), 0.85),
+])
+def test_reprojection_error_under_camera_motion(position, rotation, coverage):
+    prev_camera = Camera((0, 0, 0), np.eye(3))
+    color, samples, expected = reproject_wall(prev_camera, Camera(position, rotation))
+
+    # Pixels that see the wall where the previous frame saw it too keep all of their history
+    kept = samples > 0
+    assert np.mean(kept) >= coverage
+    assert np.allclose(samples[kept], 8)
+    error = np.abs(color[kept] - expected[kept])
+    assert error.mean() < 1E-3
+    # Border pixels with taps outside of the previous view are off by at most the color step of one pixel
+    step = 0.1 * WALL / max(RESOLUTION)
+    assert error.max() < 1.1 * step
+
+
+@pytest.mark.parametrize('prev_resolution, resolution', [
+    ((64, 36), (32, 16)),
+    ((32, 16), (64, 36)),
+    ((64, 36), (48, 24)),
+])
+@pytest.mark.parametrize('position', [(0, 0, 0), (0.2, 0, 0.3)])
+def test_reprojection_across_resolution_change(prev_resolution, resolution, position):
+    # History of the internal resolution of moving frames is resampled to the next one instead of being dropped
+    prev_camera = Camera((0, 0, 0), np.eye(3))
+    color, samples, expected = reproject_wall(prev_camera, Camera(position, np.eye(3)),
+                                              prev_resolution=prev_resolution, resolution=resolution)
+    assert color.shape == (resolution[1], resolution[0], 3)
+
+    kept = samples > 0
+    assert np.mean(kept) > 0.9
+    error = np.abs(color[kept] - expected[kept])
+    assert error.mean() < 1E-3
+    step = 0.1 * WALL / max(prev_resolution)
+    assert error.max() < 1.1 * step
+
+
+def test_moving_out_of_view_drops_history():
+    prev_camera = Camera((0, 0, 0), np.eye(3))
+    _, samples, _ = reproject_wall(prev_camera, Camera((50, 0, 0), np.eye(3)))
+    assert np.all(samples == 0)
+
+
+def test_disoccluded_pixels_are_rejected():
+    prev_camera = Camera((0, 0, 0), np.eye(3))
+    camera = Camera((0.3, 0, 0), np.eye(3))
+    points, history_distance = trace_wall(prev_camera)
+    history_color = wall_color(points).astype(np.float32)
+    history_samples = np.full(history_distance.shape, 8, dtype=np.float32)
+    # An object in front of the wall covered the middle of the previous frame and is gone now
+    width, height = RESOLUTION
+    occluded = np.zeros(history_distance.shape, dtype=bool)
+    occluded[height // 4:3 * height // 4, width // 4:3 * width // 4] = True
+    history_distance = np.where(occluded, history_distance * 0.5, history_distance)
+    history_color[occluded] = 100
+
+    _, hit_distance = trace_wall(camera)
+    color, samples = reproject(history_color, history_samples, history_distance, hit_distance, RESOLUTION,
+                               camera, prev_camera, LIMIT, TOLERANCE)
+    # Colors of the object never leak into the wall
+    assert np.all(color < 2)
+    assert np.mean(samples[height // 3:2 * height // 3, width // 3:2 * width // 3] == 0) > 0.9
+
+
+def test_sky_reprojects_by_direction():
+    prev_camera = Camera((0, 0, 0), np.eye(3))
+    camera = Camera((5, 0, 0), yaw(0.05))
+    directions = camera_rays(pixel_centres(RESOLUTION), RESOLUTION, prev_camera)
+    history_color = (directions * 0.5 + 0.5).astype(np.float32)
+    history_samples = np.full(RESOLUTION[::-1], 8, dtype=np.float32)
+    sky = np.full(RESOLUTION[::-1], INFTY, dtype=np.float32)
+
+    color, samples = reproject(history_color, history_samples, sky, sky, RESOLUTION, camera, prev_camera,
+                               LIMIT, TOLERANCE)
+    # Camera translation doesn't move the sky, only rotation does
+    kept = samples > 0
+    assert np.mean(kept) > 0.9
+    expected = camera_rays(pixel_centres(RESOLUTION), RESOLUTION, camera) * 0.5 + 0.5
+    assert np.abs(color[kept] - expected[kept]).max() < 1E-2
+
+
+def test_history_limit():
+    prev_camera = Camera((0, 0, 0), np.eye(3))
+    _, samples, _ = reproject_wall(prev_camera, Camera((0.1, 0, 0), np.eye(3)), history_samples=1000)
+    assert samples.max() == LIMIT
+
+    points, distance = trace_wall(prev_camera)
+    color, samples = reproject(wall_color(points), np.ones_like(distance), distance, distance, RESOLUTION,
+                               prev_camera, prev_camera, 0, TOLERANCE)
+    assert not np.any(color) and not np.any(samples)
+
+
+def test_accumulate_is_running_mean():
+    random = np.random.default_rng(0)
+    frames = random.random((10, 4, 4, 3)).astype(np.float32)
+    color, samples = np.zeros((4, 4, 3), dtype=np.float32), np.zeros((4, 4), dtype=np.float32)
+    for frame in frames:
+        color, samples = accumulate(color, samples, frame, np.ones((4, 4), dtype=np.float32))
+    assert np.all(samples == 10)
+    assert np.allclose(color, frames.mean(axis=0), atol=1E-6)
@@ -0,0 +1,148 @@
+import numpy as np
+import pytest
+
+import scene_file
+from buffers import Buffers
+from conftest import run_engine
+from demo import ExampleSceneLoader
+from scene import Sphere, Material, Color
+
+
+class InstancedSceneLoader(ExampleSceneLoader):
+    def define_materials_list(self):
+        super().define_materials_list()
+        self.instance_material = Material(Color(0.8, 0.2, 0.2), 0.3, self)
+
+    def spawn_triangles(self):
+        tetrahedron = np.array([[[0, 0, 0], [1, 0, 0], [0, 1, 0]], [[0, 0, 0], [0, 1, 0], [0, 0, 1]],
+                                [[0, 0, 0], [0, 0, 1], [1, 0, 0]], [[1, 0, 0], [0, 1, 0], [0, 0, 1]]])
+        transforms = np.tile(np.eye(4), (5, 1, 1))
+        transforms[:, 0, 3] = np.arange(5) * 2
+        self.add_instances(self.add_mesh(tetrahedron, self.instance_material), transforms)
+        return super().spawn_triangles()
+
+
+@pytest.fixture(scope='module', params=[ExampleSceneLoader, InstancedSceneLoader])
+def demo_buffers(request):
+    scene_loader = request.param(None)
+    return scene_loader.pack_buffers(), scene_loader.spawn_skybox_textures(), scene_loader.spawn_sun()
+
+
+def assert_same_sun(loaded, sun):
+    assert loaded.position.as_record() == sun.position.as_record()
+    assert loaded.radius == sun.radius
+    assert loaded.color.as_record() == sun.color.as_record()
+
+
+def test_save_load_round_trip(tmp_path, demo_buffers):
+    buffers, skybox, sun = demo_buffers
+    path = tmp_path / 'demo.scene'
+    scene_file.write(path, buffers, skybox, sun)
+
+    loaded, loaded_skybox, loaded_sun = scene_file.read(path)
+    assert loaded_skybox == skybox
+    assert_same_sun(loaded_sun, sun)
+    assert set(loaded) == set(scene_file.BUFFER_DTYPES)
+    assert len(buffers[Buffers.TRIANGLES]) > 0
+    for buffer, data in buffers.items():
+        assert loaded[buffer].dtype == scene_file.BUFFER_DTYPES[buffer]
+        # Padding is part of the std430 records uploaded to the SSBOs, so compare bytes, not fields
+        assert np.ascontiguousarray(loaded[buffer]).tobytes() == np.ascontiguousarray(data).tobytes(), buffer
+
+
+def test_binary_scene_loader_packs_loaded_buffers(tmp_path, demo_buffers):
+    buffers, skybox, sun = demo_buffers
+    path = tmp_path / 'demo.scene'
+    scene_file.write(path, buffers, skybox, sun)
+
+    scene_loader = scene_file.BinarySceneLoader(None, path)
+    assert scene_loader.spawn_skybox_textures() == skybox
+    # Baked scene compiles the same HAS_SUN variant and lights the scene like the source one
+    assert_same_sun(scene_loader.spawn_sun(), sun)
+    packed = scene_loader.pack_buffers()
+    for buffer, data in buffers.items():
+        assert np.array_equal(packed[buffer], data)
+
+
+def test_save_writes_sun(tmp_path):
+    path = tmp_path / 'demo.scene'
+    scene_file.save(ExampleSceneLoader(None), path)
+    assert_same_sun(scene_file.read(path)[2], ExampleSceneLoader(None).spawn_sun())
+
+
+def test_baked_scene_renders_like_source(tmp_path, headless_gl):
+    scene_file.save(ExampleSceneLoader(None), tmp_path / 'demo.scene')
+    images = []
+    for scene in ('demo.ExampleSceneLoader', str(tmp_path / 'demo.scene')):
+        output = tmp_path / f'{len(images)}.png'
+        result = run_engine('batch.py', scene, str(output), '--resolution', '64', '36', '--samples', '4', '--software')
+        assert result.returncode == 0, result.stderr
+
+        import pygame
+        images.append(pygame.surfarray.array3d(pygame.image.load(str(output))))
+    # Same buffers, sun and sample sequence, so the same pixels. The sun covers about a pixel at this resolution,
+    # a baked scene without it differs there
+    assert np.array_equal(images[0], images[1])
+
+
+def test_blocks_are_aligned(tmp_path, demo_buffers):
+    buffers, skybox, sun = demo_buffers
+    path = tmp_path / 'demo.scene'
+    scene_file.write(path, buffers, skybox, sun)
+
+    header = np.fromfile(path, dtype=scene_file.HEADER_DTYPE, count=1)[0]
+    blocks = np.fromfile(path, dtype=scene_file.BLOCK_DTYPE, count=header['blocks'],
+                         offset=scene_file.HEADER_DTYPE.itemsize)
+    assert header['version'] == scene_file.VERSION
+    assert np.all(blocks['offset'] % scene_file.ALIGNMENT == 0)
+
+
+def test_missing_buffers_are_empty(tmp_path):
+    spheres = np.zeros(3, dtype=Sphere.DTYPE)
+    spheres['radius'] = (1, 2, 3)
+    path = tmp_path / 'spheres.scene'
+    scene_file.write(path, {Buffers.SPHERES: spheres}, [])
+
+    loaded, skybox, sun = scene_file.read(path)
+    assert sun is None
+    assert np.array_equal(loaded[Buffers.SPHERES]['radius'], [1, 2, 3])
+    assert all(len(loaded[buffer]) == 0 for buffer in scene_file.BUFFER_DTYPES if buffer != Buffers.SPHERES)
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'other.scene'
+    path.write_bytes(b'PNG\0' + bytes(64))
+    with pytest.raises(ValueError):
+        scene_file.read(path)
+
+    path.write_bytes(b'')
+    with pytest.raises(ValueError):
+        scene_file.read(path)
+
+
+def test_rejects_other_versions(tmp_path):
+    path = tmp_path / 'old.scene'
+    scene_file.write(path, {}, [])
+    header = np.fromfile(path, dtype=scene_file.HEADER_DTYPE, count=1)
+    header['version'] = scene_file.VERSION + 1
+    with open(path, 'r+b') as file:
+        file.write(header.tobytes())
+
+    with pytest.raises(ValueError):
+        scene_file.read(path)
+
+
+def test_rejects_mismatched_record_size(tmp_path):
+    path = tmp_path / 'spheres.scene'
+    scene_file.write(path, {Buffers.SPHERES: np.zeros(2, dtype=Sphere.DTYPE)}, [])
+    header = np.fromfile(path, dtype=scene_file.HEADER_DTYPE, count=1)
+    blocks = np.fromfile(path, dtype=scene_file.BLOCK_DTYPE, count=header[0]['blocks'],
+                         offset=scene_file.HEADER_DTYPE.itemsize)
+    # Sphere written by a build whose dtype dropped the std430 padding
+    blocks[0]['itemsize'] = 20
+    with open(path, 'r+b') as file:
+        file.seek(scene_file.HEADER_DTYPE.itemsize)
+        file.write(blocks.tobytes())
+
+    with pytest.raises(ValueError):
+        scene_file.read(path)
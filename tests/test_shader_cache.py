@@ -0,0 +1,70 @@
+import json
+
+from conftest import run_engine
+
+# Links the same program three times with the binary cache in a temporary directory, corrupting the cached binary
+# before the second time, prints what every link compiled and how the cache file looked
+SCRIPT = """
+import os, sys, json
+import headless
+headless.select_platform('egl', True)
+
+with headless.HeadlessContext.create('egl', (1, 1)):
+    import config
+    import graphics
+    from graphics import Shader, ShaderProgram
+
+    config.CACHE_PATH = sys.argv[1]
+    compiled = []
+    compile_shader = graphics.OpenGL.GL.shaders.compileShader
+    graphics.OpenGL.GL.shaders.compileShader = lambda *args: compiled.append(1) or compile_shader(*args)
+
+    def link():
+        compiled.clear()
+        program = ShaderProgram(Shader('../shaders/render.vert'), Shader(sys.argv[2]))
+        program.specialize({'VALUE': 2})
+        return len(compiled), program.uniform_location('value') != -1
+
+    def binaries():
+        directory = os.path.join(config.CACHE_PATH, 'shaders')
+        return sorted(os.path.join(directory, name) for name in os.listdir(directory))
+
+    result = {'cold': link(), 'binaries': len(binaries())}
+    for path in binaries():
+        with open(path, 'wb') as file:
+            file.write(sys.argv[3].encode())
+    result['corrupted'] = link()
+    result['rewritten'] = all(os.path.getsize(path) > 64 for path in binaries())
+    result['warm'] = link()
+    print(json.dumps(result))
+"""
+
+FRAGMENT = """#version 460
+#ifndef VALUE
+#define VALUE 1
+#endif
+uniform float value = 1.0;
+out vec4 color;
+
+void main() {
+    color = vec4(value * VALUE);
+}
+"""
+
+
+def test_corrupted_binaries_are_relinked_and_replaced(tmp_path, headless_gl):
+    fragment = tmp_path / 'value.frag'
+    fragment.write_text(FRAGMENT)
+    for contents in ('', 'RIP', 'RIP!', 'garbage of a crashed write' * 100):
+        cache = tmp_path / f'cache{len(contents)}'
+        result = run_engine('-c', SCRIPT, str(cache), str(fragment), contents)
+        assert result.returncode == 0, result.stderr
+        result = json.loads(result.stdout.strip().splitlines()[-1])
+
+        # Shaders are compiled on a cold start and again after the binaries were corrupted, none on a warm start
+        compiled, linked = result['cold']
+        assert compiled > 0 and linked
+        assert result['binaries'] > 0
+        assert result['corrupted'] == [compiled, True]
+        assert result['rewritten']
+        assert result['warm'] == [0, True]
@@ -0,0 +1,133 @@
+import json
+
+import numpy as np
+
+from conftest import run_engine
+from graphics import Shader, ShaderProgram
+
+# Renders the demo scene, adds and removes spheres between frames, prints the number of linked variants after
+# every frame and the defines of the loaded scene
+EDIT_SCRIPT = """
+import sys, json
+import headless
+headless.select_platform('egl', True)
+
+import config
+config.RESOLUTION = (32, 18)
+config.CACHE_PATH = sys.argv[1]
+
+with headless.HeadlessContext.create('egl', config.RESOLUTION):
+    import numpy as np
+    import shader
+    from buffers import Buffers
+    from graphics import FrameState
+    from demo import ExampleSceneLoader
+
+    program, renderer, logic_provider = shader.create_renderer(FrameState(), ExampleSceneLoader)
+    scene_loader = logic_provider.scene_loader
+    variants = [program.variants]
+    renderer.render()
+    variants.append(program.variants)
+    defines = dict(program.defines)
+
+    for i in range(4):
+        scene_loader.add_spheres(np.array([[i, 5.0, 20.0]]), np.array([0.5]), scene_loader.metal)
+        renderer.render()
+        variants.append(program.variants)
+    for _ in range(4):
+        scene_loader.remove(Buffers.SPHERES, 0)
+        renderer.render()
+        variants.append(program.variants)
+    print(json.dumps({'variants': variants, 'defines': defines, 'final': dict(program.defines)}))
+"""
+
+# Compiles every shader with every define set given as JSON, compileShader raises with the log on errors
+COMPILE_SCRIPT = """
+import sys, json
+import headless
+headless.select_platform('egl', True)
+
+with headless.HeadlessContext.create('egl', (1, 1)):
+    from graphics import Shader
+
+    for path, variants in json.loads(sys.argv[1]).items():
+        shader = Shader(path)
+        for defines in variants:
+            shader.compile(defines)
+    print('compiled')
+"""
+
+# Defines of the demo scene with the fragment backend and default config
+DEMO_DEFINES = {
+    'HAS_SPHERES': True, 'HAS_PLANES': True, 'HAS_LENSES': True,
+    'SPHERES_COUNT': 3, 'PLANES_COUNT': 1, 'LENSES_COUNT': 2,
+    'HAS_TRIANGLES': True, 'HAS_INSTANCES': False, 'HAS_SUN': True, 'DISPERSION': True,
+    'MAX_BOUNCES': 10, 'MIN_BOUNCES': 3, 'ROULETTE_THRESHOLD': 0.1,
+    'SHARED_PATH': True, 'REPROJECTION': True, 'REPROJECTION_TOLERANCE': 0.05,
+    'ACCUMULATION_FORMAT': 'RGBA32F', 'DENOISE': False,
+}
+
+
+def tracer_variants():
+    """
+    Demo defines with every flag flipped, every unrolled count dropped and every accumulation format
+    """
+    variants = [DEMO_DEFINES]
+    for name, value in DEMO_DEFINES.items():
+        if isinstance(value, bool):
+            variants.append(DEMO_DEFINES | {name: not value})
+        elif name.endswith('_COUNT'):
+            variants.append({key: value for key, value in DEMO_DEFINES.items() if key != name})
+    for accumulation_format in ('RGB32F', 'RGB16F', 'RGB9E5'):
+        variants.append(DEMO_DEFINES | {'ACCUMULATION_FORMAT': accumulation_format, 'REPROJECTION': False})
+        variants.append(DEMO_DEFINES | {'ACCUMULATION_FORMAT': accumulation_format})
+    # Nothing in the scene
+    variants.append({key: value for key, value in DEMO_DEFINES.items() if not key.endswith('_COUNT')} |
+                    {name: False for name in ('HAS_SPHERES', 'HAS_PLANES', 'HAS_LENSES', 'HAS_TRIANGLES', 'HAS_SUN')})
+    return variants
+
+
+def test_variant_source_defines_follow_version(tmp_path):
+    path = tmp_path / 'shader.frag'
+    path.write_text("#version 460\nvoid main() {\n}\n")
+    shader = Shader(str(path))
+
+    source = shader.variant_source({'B': 2.5, 'A': True, 'C': 'RGB16F'})
+    assert source.split('\n')[:5] == ['#version 460', '#define A 1', '#define B 2.5', '#define C RGB16F', '#line 2']
+    assert source.endswith("void main() {\n}\n")
+    assert shader.variant_source({}) == shader.source
+
+
+def test_program_is_not_linked_before_use(tmp_path):
+    path = tmp_path / 'shader.comp'
+    path.write_text("#version 460\nlayout(local_size_x = 1) in;\nvoid main() {\n}\n")
+    # Creating a program and setting uniforms needs no GL context as long as nothing is linked
+    program = ShaderProgram(Shader(str(path)), defines={'A': 1})
+    program.set_uniform('value', 1.0)
+    assert program.variants == 0
+    assert program.defines is None
+
+
+def test_variants_compile(tmp_path, headless_gl):
+    variants = {
+        '../shaders/render.frag': tracer_variants(),
+        '../shaders/render.comp': tracer_variants(),
+        '../shaders/denoise.comp': [{'NORMAL_SIGMA': 0.1, 'ALBEDO_SIGMA': 0.1, 'DEPTH_SIGMA': 0.05}],
+    }
+    result = run_engine('-c', COMPILE_SCRIPT, json.dumps(variants))
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().endswith('compiled')
+
+
+def test_scene_edits_link_few_variants(tmp_path, headless_gl):
+    result = run_engine('-c', EDIT_SCRIPT, str(tmp_path))
+    assert result.returncode == 0, result.stderr
+    result = json.loads(result.stdout.strip().splitlines()[-1])
+
+    assert result['defines'] == DEMO_DEFINES
+    # Nothing is linked before the scene is loaded, then only the variant of the loaded scene
+    assert result['variants'][:2] == [0, 1]
+    # Spheres added and removed again switch once to runtime loop bounds and back to the loaded variant
+    assert np.all(np.diff(result['variants']) >= 0)
+    assert result['variants'][-1] == 2
+    assert result['final'] == result['defines']